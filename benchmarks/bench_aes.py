@@ -0,0 +1,65 @@
+"""Throughput benchmark for the AES-CBC backends of kindle.aescipher.
+
+Encrypts and decrypts payloads from 1 KB to 100 MB with every installed
+backend. The pure Python ``pyaes`` backend is slow, so it is skipped for
+payloads above ``--pyaes-limit`` bytes.
+
+Usage: python benchmarks/bench_aes.py [--pyaes-limit 1048576]
+"""
+
+import argparse
+import os
+import time
+
+from kindle.aescipher import (
+    AES_BACKENDS, aes_cbc_decrypt, aes_cbc_encrypt, cryptography_available
+)
+
+SIZES = (
+    ("1 KB", 2**10), ("64 KB", 2**16), ("1 MB", 2**20), ("10 MB", 10 * 2**20),
+    ("100 MB", 100 * 2**20)
+)
+
+
+def throughput(func, size: int) -> float:
+    start = time.perf_counter()
+    rounds = 0
+    while True:
+        func()
+        rounds += 1
+        elapsed = time.perf_counter() - start
+        if elapsed > 0.5:
+            return size * rounds / elapsed / 2**20
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pyaes-limit", type=int, default=2**20)
+    args = parser.parse_args()
+
+    key = os.urandom(32)
+    iv = os.urandom(16)
+
+    for backend in AES_BACKENDS:
+        if backend == "cryptography" and not cryptography_available:
+            print(f"{backend:>12}: not installed")
+            continue
+
+        for label, size in SIZES:
+            if backend == "pyaes" and size > args.pyaes_limit:
+                print(f"{backend:>12} {label:>7}: skipped")
+                continue
+
+            data = os.urandom(size)
+            encrypted = aes_cbc_encrypt(key, iv, data, backend=backend)
+            enc = throughput(
+                lambda: aes_cbc_encrypt(key, iv, data, backend=backend), size)
+            dec = throughput(
+                lambda: aes_cbc_decrypt(key, iv, encrypted, backend=backend),
+                size)
+            print(f"{backend:>12} {label:>7}: encrypt {enc:9.1f} MB/s, "
+                  f"decrypt {dec:9.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
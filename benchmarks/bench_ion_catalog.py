@@ -0,0 +1,57 @@
+"""Benchmark for the Ion parse overhead per call.
+
+Parses a small voucher like Ion value, which imports the ProtectedData
+shared symbol table, with a catalog built for every call (the previous
+behaviour) and with the shared :data:`kindle.dedrm.PROTECTED_DATA_CATALOG`.
+
+Usage: python benchmarks/bench_ion_catalog.py [--rounds 5000]
+"""
+
+import argparse
+import os
+import time
+
+from amazon.ion import simpleion
+from amazon.ion.core import IonType
+from amazon.ion.simple_types import IonPyDict
+from amazon.ion.symbols import SymbolTableCatalog, shared_symbol_table
+
+from kindle.dedrm import PROTECTED_DATA_TABLE, SYM_NAMES, get_ion_parser
+
+
+def fresh_catalog_parse(ion: bytes):
+    catalog = SymbolTableCatalog()
+    catalog.register(shared_symbol_table('ProtectedData', 1, SYM_NAMES))
+    return simpleion.loads(ion, catalog=catalog)
+
+
+def run(func, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=5000)
+    args = parser.parse_args()
+
+    voucher = IonPyDict.from_value(IonType.STRUCT, {
+        "cipher_iv": os.urandom(16),
+        "cipher_text": os.urandom(256),
+        "license": {"license_type": "Purchase"}
+    })
+    voucher.ion_annotations = ("com.amazon.drm.Voucher@1.0",)
+    ion = simpleion.dumps(voucher, imports=[PROTECTED_DATA_TABLE])
+    assert fresh_catalog_parse(ion) == get_ion_parser(ion, addprottable=True)
+
+    fresh = run(lambda: fresh_catalog_parse(ion), args.rounds)
+    shared = run(lambda: get_ion_parser(ion, addprottable=True), args.rounds)
+    print(f"{len(ion)} byte value")
+    print(f"{'new catalog per call':>22}: {fresh:8.1f} us/parse")
+    print(f"{'shared catalog':>22}: {shared:8.1f} us/parse")
+
+
+if __name__ == "__main__":
+    main()
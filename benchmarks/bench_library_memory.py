@@ -0,0 +1,98 @@
+"""Memory benchmark for the library representation.
+
+Builds a synthetic syncMetaData response and compares the memory held by
+the raw ``xmltodict`` dict with a :class:`kindle.models.Library`, plus the
+time for an ASIN lookup in both. Each :class:`~kindle.models.Library` is
+built from its own parse, which is dropped before measuring.
+
+Usage: python benchmarks/bench_library_memory.py [--items 50000]
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+import xmltodict
+
+from kindle.api import _LibraryStreamParser
+from kindle.models import Library, iter_meta_data
+
+
+def make_response(items: int) -> str:
+    parts = ["<response><sync_time>2021-01-01T00:00:00+0000</sync_time>"
+             "<add_update_list>"]
+    for i in range(items):
+        parts.append(
+            f"<meta_data><ASIN>B{i:09d}</ASIN>"
+            f'<title pronunciation="Title {i}">Title {i}</title>'
+            f'<authors><author pronunciation="Author {i}">Author {i}'
+            f"</author></authors>"
+            f"<publishers><publisher>Publisher {i % 100}</publisher>"
+            f"</publishers>"
+            f"<publication_date>2020-01-01T00:00:00+0000</publication_date>"
+            f"<purchase_date>2021-01-01T00:00:00+0000</purchase_date>"
+            f"<textbook_type></textbook_type>"
+            f"<cde_contenttype>EBOK</cde_contenttype>"
+            f"<content_type>application/x-mobipocket-ebook</content_type>"
+            f"<origins><origin><type>Purchase</type></origin></origins>"
+            f"</meta_data>")
+    parts.append("</add_update_list><removal_list></removal_list></response>")
+    return "".join(parts)
+
+
+def measure(func):
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def build_from_dict(text: str) -> Library:
+    # parsed again, so the model does not share strings with another dict
+    raw = xmltodict.parse(text)["response"]
+    model = Library.from_dict(raw)
+    del raw
+    return model
+
+
+def build_from_events(text: str) -> Library:
+    parser = _LibraryStreamParser()
+    events = list(parser.feed(text.encode())) + list(parser.close())
+    return Library.from_events(events)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=50000)
+    args = parser.parse_args()
+
+    text = make_response(args.items)
+    raw, raw_size = measure(lambda: xmltodict.parse(text)["response"])
+    model, model_size = measure(lambda: build_from_dict(text))
+    _, stream_size = measure(lambda: build_from_events(text))
+
+    print(f"{args.items} items")
+    for name, size in (("raw dict", raw_size),
+                       ("Library", model_size),
+                       ("streamed", stream_size)):
+        print(f"{name:>10}: {size / 2**20:8.1f} MiB "
+              f"({size / args.items:6.0f} B/item)")
+
+    asin = f"B{args.items - 1:09d}"
+    start = time.perf_counter()
+    next(i for i in iter_meta_data(raw, "add_update_list")
+         if i["ASIN"] == asin)
+    scan = time.perf_counter() - start
+    start = time.perf_counter()
+    model[asin]
+    lookup = time.perf_counter() - start
+    print(f"lookup {asin}: scan {scan * 1e3:.3f} ms, "
+          f"index {lookup * 1e3:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark for the key derivation of encrypted auth files.
+
+Compares the pure Python :class:`pbkdf2.PBKDF2` with the native
+:func:`hashlib.pbkdf2_hmac` used by
+:func:`kindle.aescipher.derive_from_pbkdf2` and measures saving and loading an encrypted file with a fresh
+:class:`kindle.aescipher.AESCipher` per call and with one cached instance.
+
+Usage: python benchmarks/bench_pbkdf2.py [--rounds 200] [--iterations 1000]
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import pathlib
+import tempfile
+import time
+
+from pbkdf2 import PBKDF2
+
+from kindle.aescipher import AESCipher, derive_from_pbkdf2
+
+
+def run(func, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1e3
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    salt = os.urandom(12)
+    password = "password"
+
+    def pure():
+        PBKDF2(password, salt, args.iterations, hashlib.sha256, hmac).read(32)
+
+    def native():
+        derive_from_pbkdf2(password, key_size=32, salt=salt,
+                           kdf_iterations=args.iterations,
+                           hashmod=hashlib.sha256, mac=hmac)
+
+    print(f"{'pbkdf2':>24}: {run(pure, args.rounds):8.3f} ms/key")
+    print(f"{'hashlib.pbkdf2_hmac':>24}: "
+          f"{run(native, args.rounds):8.3f} ms/key")
+
+    data = json.dumps({"access_token": "Atna|" + "x" * 400})
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = pathlib.Path(tmp) / "auth.json"
+
+        def fresh():
+            crypter = AESCipher(password, kdf_iterations=args.iterations)
+            crypter.to_file(data, filename)
+            AESCipher(password, kdf_iterations=args.iterations).from_file(
+                filename)
+
+        crypter = AESCipher(password, kdf_iterations=args.iterations)
+
+        def cached():
+            crypter.to_file(data, filename)
+            crypter.from_file(filename)
+
+        print(f"{'save+load, new cipher':>24}: "
+              f"{run(fresh, args.rounds):8.3f} ms")
+        print(f"{'save+load, same cipher':>24}: "
+              f"{run(cached, args.rounds):8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
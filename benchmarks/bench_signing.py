@@ -0,0 +1,63 @@
+"""Micro-benchmark for request signing.
+
+Compares signatures per second of the uncached path (the PEM key is parsed
+for every request) and a cached :class:`kindle.auth.RSASigner` for every
+installed backend and of passing the PEM key as str.
+
+Usage: python benchmarks/bench_signing.py [--seconds 2]
+"""
+
+import argparse
+import time
+
+import rsa
+
+from kindle.auth import (
+    SIGNING_BACKENDS, RSASigner, cryptography_available, sign_request
+)
+
+
+def run(func, seconds: float) -> float:
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        func()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    _, private_key = rsa.newkeys(2048)
+    pem = private_key.save_pkcs1().decode("utf-8")
+    body = b'{"asin": "B000000000"}'
+    adp_token = "{enc:x}{key:x}{iv:x}{name:x}{serial:Mg==}"
+
+    for backend in SIGNING_BACKENDS:
+        if backend == "cryptography" and not cryptography_available:
+            print(f"{backend:>12}: not installed")
+            continue
+
+        def uncached():
+            sign_request("GET", "/path", body, adp_token,
+                         RSASigner(pem, backend=backend))
+
+        signer = RSASigner(pem, backend=backend)
+
+        def cached():
+            sign_request("GET", "/path", body, adp_token, signer)
+
+        print(f"{backend:>12}: uncached {run(uncached, args.seconds):10.1f} "
+              f"sig/s, cached {run(cached, args.seconds):10.1f} sig/s")
+
+    def pem_str():
+        sign_request("GET", "/path", body, adp_token, pem)
+
+    print(f"{'str key':>12}: {run(pem_str, args.seconds):10.1f} sig/s")
+
+
+if __name__ == "__main__":
+    main()
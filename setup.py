@@ -46,6 +46,7 @@ setup(
     ],
     install_requires=[
         'beautifulsoup4',
+        'httpcore>=0.12,<0.13',
         'httpx==0.16.*',
         'pbkdf2',
         'Pillow',
@@ -55,6 +56,9 @@ setup(
         'amazon.ion'
     ],
     extras_require={
+        'fast': [
+            'cryptography'
+        ],
         'docs': [
             'sphinx',
             'sphinx_rtd_theme',
@@ -3,8 +3,10 @@
 from kindle._logging import log_helper
 from kindle._version import __version__
 from kindle.auth import Authenticator
+from kindle.client import AsyncKindleClient, KindleClient
 
 
 __all__ = [
-    "__version__", "Authenticator", "log_helper"
+    "__version__", "AsyncKindleClient", "Authenticator", "KindleClient",
+    "log_helper"
 ]
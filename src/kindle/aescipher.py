@@ -1,15 +1,28 @@
 import base64
+import hashlib
 import hmac
 import json
 import logging
 import os
 import pathlib
 import struct
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from hashlib import sha256
-from typing import Dict, Optional, Tuple, TYPE_CHECKING, Union
+from typing import BinaryIO, Dict, Optional, Tuple, TYPE_CHECKING, Union
 
 from pbkdf2 import PBKDF2
-from pyaes import AESModeOfOperationCBC, Encrypter, Decrypter
+from pyaes import AESModeOfOperationCBC
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.ciphers import (
+        Cipher, algorithms, modes
+    )
+    cryptography_available = True
+except ImportError:
+    cryptography_available = False
 
 if TYPE_CHECKING:
     import audible
@@ -17,10 +30,250 @@ if TYPE_CHECKING:
 logger = logging.getLogger('kindle.aescipher')
 
 BLOCK_SIZE: int = 16  # the AES block size
+KEY_CACHE_SIZE: int = 16  # derived keys cached per AESCipher instance
+AES_BACKENDS = ("cryptography", "pyaes")
+STREAM_CHUNK_SIZE: int = 64 * 1024
+
+
+class _PyaesCBC:
+    # pure Python fallback, processes whole blocks only
+    def __init__(self, key: bytes, iv: bytes) -> None:
+        self._mode = AESModeOfOperationCBC(key, iv)
+
+    def encrypt(self, data: bytes) -> bytes:
+        encrypt = self._mode.encrypt
+        return b"".join(
+            encrypt(bytes(data[i:i + BLOCK_SIZE]))
+            for i in range(0, len(data), BLOCK_SIZE))
+
+    def decrypt(self, data: bytes) -> bytes:
+        decrypt = self._mode.decrypt
+        return b"".join(
+            decrypt(bytes(data[i:i + BLOCK_SIZE]))
+            for i in range(0, len(data), BLOCK_SIZE))
+
+
+class _CryptographyCBC:
+    # native AES from OpenSSL, processes whole blocks only
+    def __init__(self, key: bytes, iv: bytes) -> None:
+        cipher = Cipher(
+            algorithms.AES(key), modes.CBC(iv), backend=default_backend())
+        self._encryptor = cipher.encryptor()
+        self._decryptor = cipher.decryptor()
+
+    def encrypt(self, data: bytes) -> bytes:
+        return self._encryptor.update(data)
+
+    def decrypt(self, data: bytes) -> bytes:
+        return self._decryptor.update(data)
+
+
+def _aes_cbc(key: bytes, iv: bytes, backend: Optional[str] = None):
+    if backend is None:
+        backend = "cryptography" if cryptography_available else "pyaes"
+
+    if backend not in AES_BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(AES_BACKENDS)}.")
+
+    if backend == "cryptography" and not cryptography_available:
+        raise ValueError("backend cryptography is not installed.")
+
+    if len(iv) != BLOCK_SIZE:
+        raise ValueError("initialization vector must be 16 bytes")
+
+    if backend == "cryptography":
+        return _CryptographyCBC(key, iv)
+    return _PyaesCBC(key, iv)
+
+
+def _to_bytes(data: Union[str, bytes]) -> bytes:
+    # like pyaes, a str is taken as a sequence of byte values
+    if isinstance(data, str):
+        try:
+            return data.encode("latin-1")
+        except UnicodeEncodeError:
+            raise ValueError("bytes must be in range(0, 256)") from None
+    return bytes(data)
+
+
+def _append_padding(data: bytes, padding: str) -> bytes:
+    if padding == "default":
+        pad = BLOCK_SIZE - len(data) % BLOCK_SIZE
+        return data + bytes((pad,)) * pad
+
+    if padding == "none":
+        if not data or len(data) % BLOCK_SIZE:
+            raise ValueError("invalid data length for final block")
+        return data
+
+    raise ValueError("invalid padding option")
+
+
+def _strip_padding(data: bytes, padding: str) -> bytes:
+    # same checks as pyaes, the padding bytes itself are not verified
+    if padding == "default":
+        pad = data[-1]
+        if pad > BLOCK_SIZE:
+            raise ValueError("invalid padding byte")
+        return data[:-pad]
+
+    if padding == "none":
+        return data
+
+    raise ValueError("invalid padding option")
+
+
+class AESCBCEncryptor:
+    """Encrypts data chunk by chunk in cipher block chaining mode.
+
+    Chunks of any size can be passed to :meth:`update`. All complete blocks
+    are encrypted and returned at once, the rest is buffered. The padding is
+    applied by :meth:`finalize`. The output is the same as with
+    :func:`aes_cbc_encrypt` for the concatenated chunks.
+
+    Args:
+        key: The AES key.
+        iv: The initialization vector.
+        padding: Can be ``default`` or ``none`` (Default: default)
+        backend: The AES backend. See :func:`aes_cbc_encrypt`.
+
+    Example:
+        >>> encryptor = AESCBCEncryptor(key, iv)
+        >>> for chunk in chunks:
+        ...     target.write(encryptor.update(chunk))
+        >>> target.write(encryptor.finalize())
+    """
+
+    def __init__(self, key: bytes, iv: bytes, padding: str = "default",
+                 backend: Optional[str] = None) -> None:
+        if padding not in ("default", "none"):
+            raise ValueError("invalid padding option")
+
+        self._cbc = _aes_cbc(key, iv, backend)
+        self._padding = padding
+        self._buffer: Optional[bytes] = b""
+        self._processed = 0
+
+    def update(self, data: Union[str, bytes]) -> bytes:
+        """Encrypts all complete blocks of the buffered data and `data`."""
+        if self._buffer is None:
+            raise ValueError("already finalized")
+
+        data = _to_bytes(data)
+        if self._buffer:
+            data = self._buffer + data
+        end = len(data) - len(data) % BLOCK_SIZE
+        self._buffer = data[end:]
+        self._processed += end
+        return self._cbc.encrypt(memoryview(data)[:end]) if end else b""
+
+    def finalize(self) -> bytes:
+        """Pads and encrypts the remaining data. No further updates are
+        possible afterwards.
+        """
+        if self._buffer is None:
+            raise ValueError("already finalized")
+
+        data, self._buffer = self._buffer, None
+        if self._padding == "none":
+            if data or not self._processed:
+                raise ValueError("invalid data length for final block")
+            return b""
+        return self._cbc.encrypt(_append_padding(data, self._padding))
+
+
+class AESCBCDecryptor:
+    """Decrypts data chunk by chunk in cipher block chaining mode.
 
+    Works like :class:`AESCBCEncryptor`. With the ``default`` padding the
+    last complete block is held back until :meth:`finalize`, because only
+    then it is known which block carries the padding.
 
-def aes_cbc_encrypt(key: bytes, iv: bytes, data: str,
-                    padding: str = "default") -> bytes:
+    Args:
+        key: The AES key used at encryption.
+        iv: The initialization vector used at encryption.
+        padding: Can be ``default`` or ``none`` (Default: default)
+        backend: The AES backend. See :func:`aes_cbc_encrypt`.
+    """
+
+    def __init__(self, key: bytes, iv: bytes, padding: str = "default",
+                 backend: Optional[str] = None) -> None:
+        if padding not in ("default", "none"):
+            raise ValueError("invalid padding option")
+
+        self._cbc = _aes_cbc(key, iv, backend)
+        self._padding = padding
+        self._buffer: Optional[bytes] = b""
+        self._processed = 0
+
+    def update(self, data: bytes) -> bytes:
+        """Decrypts all complete blocks of the buffered data and `data`,
+        except the last block if it can hold the padding.
+        """
+        if self._buffer is None:
+            raise ValueError("already finalized")
+
+        data = bytes(data)
+        if self._buffer:
+            data = self._buffer + data
+        keep = len(data) % BLOCK_SIZE
+        if not keep and self._padding == "default":
+            keep = BLOCK_SIZE
+        end = max(len(data) - keep, 0)
+        self._buffer = data[end:]
+        self._processed += end
+        return self._cbc.decrypt(memoryview(data)[:end]) if end else b""
+
+    def finalize(self) -> bytes:
+        """Decrypts the last block and removes the padding. No further
+        updates are possible afterwards.
+        """
+        if self._buffer is None:
+            raise ValueError("already finalized")
+
+        data, self._buffer = self._buffer, None
+        if not (data or self._processed) or len(data) % BLOCK_SIZE:
+            raise ValueError("invalid length")
+        if not data:
+            return b""
+        return _strip_padding(self._cbc.decrypt(data), self._padding)
+
+
+def aes_cbc_stream(cipher: Union[AESCBCEncryptor, AESCBCDecryptor],
+                   source: BinaryIO,
+                   target: BinaryIO,
+                   chunk_size: int = STREAM_CHUNK_SIZE) -> int:
+    """Pipes `source` through `cipher` into `target`.
+
+    Only one chunk is held in memory at a time. The cipher is finalized
+    afterwards.
+
+    Args:
+        cipher: A new :class:`AESCBCEncryptor` or :class:`AESCBCDecryptor`.
+        source: A readable binary file object.
+        target: A writable binary file object.
+        chunk_size: The number of bytes read at once.
+
+    Returns:
+        The number of bytes written to `target`.
+    """
+    written = 0
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        data = cipher.update(chunk)
+        target.write(data)
+        written += len(data)
+
+    data = cipher.finalize()
+    target.write(data)
+    return written + len(data)
+
+
+def aes_cbc_encrypt(key: bytes, iv: bytes, data: Union[str, bytes],
+                    padding: str = "default",
+                    backend: Optional[str] = None) -> bytes:
     """Encrypts data in cipher block chaining mode of operation.
 
     Args:
@@ -28,33 +281,41 @@ def aes_cbc_encrypt(key: bytes, iv: bytes, data: str,
         iv: The initialization vector.
         data: The data to encrypt.
         padding: Can be ``default`` or ``none`` (Default: default)
+        backend: The AES backend. Can be ``cryptography`` or ``pyaes``.
+            If ``None``, ``cryptography`` is used if installed, otherwise
+            the pure-Python ``pyaes`` package.
 
     Returns:
         The encrypted data.
     """
-    encrypter = Encrypter(AESModeOfOperationCBC(key, iv), padding=padding)
-    encrypted = encrypter.feed(data) + encrypter.feed()
-    return encrypted
+    cbc = _aes_cbc(key, iv, backend)
+    return cbc.encrypt(_append_padding(_to_bytes(data), padding))
 
 
 def aes_cbc_decrypt(key: bytes,
                     iv: bytes,
                     encrypted_data: bytes,
-                    padding: str = "default") -> bytes:
+                    padding: str = "default",
+                    backend: Optional[str] = None) -> bytes:
     """Decrypts data encrypted in cipher block chaining mode of operation.
 
+    Use :class:`AESCBCDecryptor` to decrypt large data in chunks.
+
     Args:
         key: The AES key used at encryption.
         iv: The initialization vector used at encryption.
         encrypted_data: The encrypted data to decrypt.
         padding: Can be ``default`` or ``none`` (Default: default)
+        backend: The AES backend. See :func:`aes_cbc_encrypt`.
     
     Returns:
         The decrypted data.
     """
-    decrypter = Decrypter(AESModeOfOperationCBC(key, iv), padding=padding)
-    decrypted = decrypter.feed(encrypted_data) + decrypter.feed()
-    return decrypted
+    if not encrypted_data or len(encrypted_data) % BLOCK_SIZE:
+        raise ValueError("invalid length")
+
+    cbc = _aes_cbc(key, iv, backend)
+    return _strip_padding(cbc.decrypt(bytes(encrypted_data)), padding)
 
 
 def create_salt(salt_marker: bytes,
@@ -90,6 +351,18 @@ def unpack_salt(packed_salt: bytes, salt_marker: bytes) -> Tuple[bytes, int]:
     return salt, kdf_iterations
 
 
+@lru_cache(maxsize=None)
+def _hashlib_name(hashmod) -> Optional[str]:
+    # hashlib constructors and PEP 247 modules both provide a name
+    try:
+        digest = hashmod() if callable(hashmod) else hashmod.new()
+        name = digest.name
+        hashlib.new(name)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return name
+
+
 def derive_from_pbkdf2(password: str,
                        *,
                        key_size: int,
@@ -97,8 +370,20 @@ def derive_from_pbkdf2(password: str,
                        kdf_iterations: int,
                        hashmod,
                        mac) -> bytes:
-    """Creates an AES key with the :class:`PBKDF2` key derivation class."""
-    kdf = PBKDF2(password, salt, min(kdf_iterations, 65535), hashmod, mac)
+    """Creates an AES key with the PBKDF2 key derivation function.
+
+    The native :func:`hashlib.pbkdf2_hmac` is used if `mac` is
+    :mod:`hmac` and `hashmod` is supported by :mod:`hashlib`. Otherwise the
+    pure Python :class:`PBKDF2` class is used. Both return the same key.
+    """
+    iterations = min(kdf_iterations, 65535)
+    name = _hashlib_name(hashmod) if mac is hmac else None
+    if name is not None:
+        if isinstance(password, str):
+            password = password.encode("utf-8")
+        return hashlib.pbkdf2_hmac(name, password, salt, iterations, key_size)
+
+    kdf = PBKDF2(password, salt, iterations, hashmod, mac)
     return kdf.read(key_size)
 
 
@@ -123,6 +408,9 @@ class AESCipher:
     wrapped by ``salt_marker`` on both sides. With the default value of
     ``salt_marker = b'$'``, the header size is thus 4 and the salt 12 bytes.
     The salt marker must be a byte string of 1-6 bytes length.
+    Each encryption uses a new random salt and iv. Derived keys are cached
+    per instance, so loading a file saved or loaded before by the same
+    instance does not derive the key again.
     The last block of the encrypted output is padded with up to 16 bytes, all
     having the value of the length of the padding.
     All values in dict mode are written as base64 encoded string.
@@ -177,16 +465,34 @@ class AESCipher:
         self.mac = mac
         self.salt_marker = salt_marker
         self.kdf_iterations = kdf_iterations
+        self._keys: OrderedDict = OrderedDict()
+        self._keys_lock = threading.Lock()
+
+    def _derive_key(self, salt: bytes, kdf_iterations: int) -> bytes:
+        cache_key = (self.password, salt, kdf_iterations, self.key_size)
+        with self._keys_lock:
+            key = self._keys.get(cache_key)
+            if key is not None:
+                self._keys.move_to_end(cache_key)
+                return key
 
-    def _encrypt(self, data: str) -> Tuple[bytes, bytes, bytes]:
-        header, salt = create_salt(self.salt_marker, self.kdf_iterations)
         key = derive_from_pbkdf2(
             password=self.password,
             key_size=self.key_size,
             salt=salt,
-            kdf_iterations=self.kdf_iterations,
+            kdf_iterations=kdf_iterations,
             hashmod=self.hashmod,
             mac=self.mac)
+
+        with self._keys_lock:
+            self._keys[cache_key] = key
+            while len(self._keys) > KEY_CACHE_SIZE:
+                self._keys.popitem(last=False)
+        return key
+
+    def _encrypt(self, data: str) -> Tuple[bytes, bytes, bytes]:
+        header, salt = create_salt(self.salt_marker, self.kdf_iterations)
+        key = self._derive_key(salt, self.kdf_iterations)
         iv = os.urandom(BLOCK_SIZE)
         encrypted_data = aes_cbc_encrypt(key, iv, data)
         return pack_salt(header, salt), iv, encrypted_data
@@ -197,13 +503,7 @@ class AESCipher:
         except ValueError:
             kdf_iterations = self.kdf_iterations
 
-        key = derive_from_pbkdf2(
-            password=self.password,
-            key_size=self.key_size,
-            salt=salt,
-            kdf_iterations=kdf_iterations,
-            hashmod=self.hashmod,
-            mac=self.mac)
+        key = self._derive_key(salt, kdf_iterations)
         return aes_cbc_decrypt(key, iv, encrypted_data).decode("utf-8")
 
     def to_dict(self, data: str) -> Dict[str, str]:
@@ -2,42 +2,81 @@
 # there are many more but what they do?
 
 import base64
+import copy
 import json
+import logging
+import os
 import pathlib
 import re
-from collections import namedtuple
+import shutil
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack, closing, contextmanager
 from datetime import datetime
 from enum import Enum
-from typing import Dict, Optional, Union
-from zipfile import ZipFile
+from typing import (
+    Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Union
+)
+from tempfile import SpooledTemporaryFile
+from xml.etree import ElementTree
+from zipfile import ZipFile, ZipInfo
 
 import httpx
 import xmltodict
 from amazon.ion import simpleion
 
+from .cache import ManifestCache, ResponseCache, is_fresh
+from .client import KindleClient
 from .dedrm import KFXZipBook
+from .exceptions import NetworkError, NotResponding
+from .metrics import bind_endpoint, instrumented
+from .models import Library
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     import kindle
 
 
-def get_library(auth: "kindle.Authenticator",
-                last_sync: Optional[Union[str, Dict]] = None) -> Dict:
-    """Fetches the user library.
+logger = logging.getLogger("kindle.api")
 
-    Args:
-        auth: The Kindle Authenticator
-        last_sync: If not `None`, the library will be updated instead of a 
-            full sync. The `last_sync` value have to be taken from last sync 
-            response `sync_time` key as string or provide the full sync
-            response and the function will extract the value.
+AuthOrClient = Union["kindle.Authenticator", KindleClient]
 
-    Returns:
-        The user library.
+# max. number of range requests to resume an interrupted download
+MAX_RESUMES = 3
+# a download which receives no data for this many seconds is resumed
+DOWNLOAD_TIMEOUT = httpx.Timeout(None, read=60.0)
+CHUNK_SIZE = 64 * 1024
+# concurrently fetched and decrypted book parts larger than this are
+# spooled to disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
 
-    """
-    url = "https://todo-ta-g7g.amazon.com/FionaTodoListProxy/syncMetaData"
+USER_AGENT = "Kindle/1.0.235280.0.10 CFNetwork/1220.1 Darwin/20.3.0"
+LIBRARY_URL = "https://todo-ta-g7g.amazon.com/FionaTodoListProxy/syncMetaData"
+MANIFEST_URL = "https://kindle-digital-delivery.amazon.com/delivery/manifest/kindle.ebook/{asin}"
+PDOC_URL = "https://cde-ta-g7g.amazon.com/FionaCDEServiceEngine/FSDownloadContent"
+WHISPERSYNC_URL = "https://api.amazon.com/whispersync/v2/data/{user_id}/datasets"
+SIDECAR_EBOOK_URL = "https://sars.amazon.com/sidecar/sa/EBOK/{asin}"
+SIDECAR_PDOC_URL = "https://cde-ta-g7g.amazon.com/FionaCDEServiceEngine/sidecar"
+NEWS_URL = "https://sars.amazon.com/kinapps/notifications/new"
+NOTIFICATION_CHANNELS_URL = "https://d3ohh9b4v3oawh.cloudfront.net/iOS/1.1/{marketplace}/notificationsChannels.json"
+DEVICE_CREDENTIALS_URL = "https://firs-ta-g7g.amazon.com/FirsProxy/getDeviceCredentials"
+
+
+@contextmanager
+def _client_for(auth: AuthOrClient) -> Iterator[KindleClient]:
+    # a given client is reused and stays open, otherwise a short-living
+    # client is created for this call only
+    if isinstance(auth, KindleClient):
+        yield auth
+    else:
+        with KindleClient(auth) as client:
+            yield client
+
+
+def _library_params(last_sync: Optional[Union[str, Dict]]) -> Dict:
     params = {"item_count": 1000}
 
     if isinstance(last_sync, dict):
@@ -49,12 +88,136 @@ def get_library(auth: "kindle.Authenticator",
     if last_sync is not None:
         params["last_sync_time"] = last_sync
 
-    with httpx.Client(auth=auth) as session:
-        r = session.get(url, params=params)
-        r.raise_for_status()
-        library = xmltodict.parse(r.text)
-        library = json.loads(json.dumps(library))
-        return library.get("response", library)
+    return params
+
+
+def _parse_xml_response(text: str) -> Dict:
+    data = xmltodict.parse(text)
+    data = json.loads(json.dumps(data))
+    return data.get("response", data)
+
+
+@instrumented
+def get_library(auth: AuthOrClient,
+                last_sync: Optional[Union[str, Dict]] = None,
+                model: bool = False,
+                keep_raw: bool = False) -> Union[Dict, Library]:
+    """Fetches the user library.
+
+    Args:
+        auth: The Kindle Authenticator or a :class:`~kindle.client.KindleClient`
+        last_sync: If not `None`, the library will be updated instead of a
+            full sync. The `last_sync` value have to be taken from last sync
+            response `sync_time` key as string or provide the full sync
+            response and the function will extract the value.
+        model: If ``True``, return a compact :class:`~kindle.models.Library`
+            instead of the raw dict. The response is streamed with
+            :func:`iter_library` and never parsed into a full dict tree.
+        keep_raw: Keep the ``meta_data`` dict of every item as
+            :attr:`~kindle.models.LibraryItem.raw`. Only used with `model`.
+
+    Returns:
+        The user library.
+
+    """
+    if model:
+        return Library.from_events(iter_library(auth, last_sync), keep_raw)
+
+    params = _library_params(last_sync)
+
+    with _client_for(auth) as client:
+        r = client.get(LIBRARY_URL, params=params)
+        return _parse_xml_response(r.text)
+
+
+LibraryEvent = namedtuple("LibraryEvent", ["section", "data"])
+LIBRARY_SECTIONS = ("add_update_list", "removal_list")
+
+
+def _element_to_dict(elem: ElementTree.Element) -> Union[Dict, str, None]:
+    # mimics the xmltodict output for a single element
+    data = {f"@{k}": v for k, v in elem.attrib.items()}
+    for child in elem:
+        value = _element_to_dict(child)
+        if child.tag in data:
+            if not isinstance(data[child.tag], list):
+                data[child.tag] = [data[child.tag]]
+            data[child.tag].append(value)
+        else:
+            data[child.tag] = value
+
+    text = elem.text.strip() if elem.text else ""
+    if not data:
+        return text or None
+    if text:
+        data["#text"] = text
+    return data
+
+
+class _LibraryStreamParser:
+    """Incremental parser for syncMetaData responses.
+
+    Every ``meta_data`` item of the ``add_update_list`` and ``removal_list``
+    is emitted as soon as it is complete and then dropped from the tree.
+    So the memory usage does not depend on the library size.
+    """
+
+    def __init__(self) -> None:
+        self._parser = ElementTree.XMLPullParser(events=("start", "end"))
+        self._stack: List[ElementTree.Element] = []
+
+    def feed(self, data: bytes) -> Iterator[LibraryEvent]:
+        self._parser.feed(data)
+        return self._read_events()
+
+    def close(self) -> Iterator[LibraryEvent]:
+        self._parser.close()
+        return self._read_events()
+
+    def _read_events(self) -> Iterator[LibraryEvent]:
+        for event, elem in self._parser.read_events():
+            if event == "start":
+                self._stack.append(elem)
+                continue
+
+            self._stack.pop()
+            depth = len(self._stack)
+            # depth 0: response, 1: section or value, 2: meta_data
+            if depth == 2 and self._stack[1].tag in LIBRARY_SECTIONS:
+                yield LibraryEvent(self._stack[1].tag, _element_to_dict(elem))
+                self._stack[1].remove(elem)
+            elif depth == 1 and elem.tag not in LIBRARY_SECTIONS:
+                yield LibraryEvent(elem.tag, _element_to_dict(elem))
+                self._stack[0].remove(elem)
+
+
+@instrumented
+def iter_library(auth: AuthOrClient,
+                 last_sync: Optional[Union[str, Dict]] = None
+                 ) -> Iterator[LibraryEvent]:
+    """Fetches the user library and yields the items while they arrive.
+
+    Other than :func:`get_library`, the response is parsed incrementally.
+    The memory usage stays flat, regardless of the library size.
+
+    Args:
+        auth: The Kindle Authenticator or a :class:`~kindle.client.KindleClient`
+        last_sync: See :func:`get_library`.
+
+    Yields:
+        A :class:`LibraryEvent` for every ``meta_data`` item with the
+        section (``add_update_list`` or ``removal_list``) as `section`.
+        All other values of the response (like the ``sync_time``) are
+        yielded with their name as `section`.
+    """
+    params = _library_params(last_sync)
+    parser = _LibraryStreamParser()
+
+    with _client_for(auth) as client:
+        with client.stream("GET", LIBRARY_URL, params=params) as r:
+            for chunk in r.iter_bytes():
+                yield from parser.feed(chunk)
+    yield from parser.close()
 
 
 def _build_correlation_id(auth: "kindle.Authenticator",
@@ -74,11 +237,12 @@ def _b64ion_to_dict(b64ion: str) -> Dict:
     return dict(ion)
 
 
-def get_manifest_ebook(auth: "kindle.Authenticator", asin: str) -> Dict:
+def _manifest_request(auth: "kindle.Authenticator",
+                      asin: str) -> Tuple[str, Dict[str, str]]:
     asin = asin.upper()
-    url = f"https://kindle-digital-delivery.amazon.com/delivery/manifest/kindle.ebook/{asin}"
+    url = MANIFEST_URL.format(asin=asin)
     headers = {
-        "User-Agent": "Kindle/1.0.235280.0.10 CFNetwork/1220.1 Darwin/20.3.0",
+        "User-Agent": USER_AGENT,
         "X-ADP-AttemptCount": "1",
         "X-ADP-CorrelationId": _build_correlation_id(auth, asin),
         "X-ADP-Transport": "WiFi",
@@ -87,11 +251,10 @@ def get_manifest_ebook(auth: "kindle.Authenticator", asin: str) -> Dict:
         "x-amzn-accept-type": "application/x.amzn.digital.deliverymanifest@1.0",
         "X-ADP-SW": "1184366692"
     }
+    return url, headers
 
-    with httpx.Client(auth=auth) as session:
-        r = session.get(url, headers=headers)
-        manifest = r.json()
 
+def _parse_manifest(manifest: Dict) -> Dict:
     manifest["responseContext"] = _b64ion_to_dict(manifest["responseContext"])
     for resource in manifest["resources"]:
         if "responseContext" in resource:
@@ -99,6 +262,46 @@ def get_manifest_ebook(auth: "kindle.Authenticator", asin: str) -> Dict:
     return manifest
 
 
+def _device_serial(auth: "kindle.Authenticator") -> str:
+    return auth.device_info["device_serial_number"]
+
+
+def _cache_manifest(raw: Dict, asin: str, device: str,
+                    cache: Optional[ManifestCache]) -> Dict:
+    # _parse_manifest decodes in place, the disk cache needs the raw response
+    if cache is None:
+        return _parse_manifest(raw)
+    manifest = _parse_manifest(copy.deepcopy(raw))
+    cache.put(asin, device, raw, manifest)
+    return manifest
+
+
+@instrumented
+def get_manifest_ebook(auth: AuthOrClient,
+                       asin: str,
+                       cache: Optional[ManifestCache] = None) -> Dict:
+    """Returns the delivery manifest of an ebook.
+
+    Args:
+        auth: The Kindle Authenticator or a
+            :class:`~kindle.client.KindleClient`.
+        asin: The ASIN of the book.
+        cache: If given, a cached manifest is returned until it expires and a
+            fetched manifest is added to the cache.
+    """
+    with _client_for(auth) as client:
+        if cache is not None:
+            manifest = cache.get(
+                asin, _device_serial(client.auth), _parse_manifest)
+            if manifest is not None:
+                return manifest
+
+        url, headers = _manifest_request(client.auth, asin)
+        r = client.get(url, headers=headers)
+        return _cache_manifest(
+            r.json(), asin, _device_serial(client.auth), cache)
+
+
 class Scope(Enum):
     REQUIRED = 1
     PREFERRED = 2
@@ -112,15 +315,9 @@ class Scope(Enum):
 Request = namedtuple("Request", ["method", "url", "fn", "headers"])
 
 
-def download_ebook(auth: "kindle.Authenticator",
-                   manifest: Dict,
-                   scope: Union[str, Scope] = Scope.DEFERRED,
-                   decrypt: bool = False):
-    """proof-of-concent, quick and dirty.
-    
-    Download content and create a kfx-zip file in the current working dir. 
-    Decrypts the book optionally.
-    """
+def _build_requests(auth: "kindle.Authenticator",
+                    manifest: Dict,
+                    scope: Union[str, Scope]) -> List[Request]:
     assert "resources" in manifest, "Incorrect manifest data"
     if isinstance(scope, str):
         try:
@@ -130,9 +327,8 @@ def download_ebook(auth: "kindle.Authenticator",
             raise ValueError(
                 "Scope must be in %s, got %s" % \
                 (", ".join(allowed_scopes), scope)
-            )    
+            )
 
-    session = httpx.Client(auth=auth, timeout=None)
     parts = []
     for resource in manifest["resources"]:
         if not scope.should_download(resource["requirement"]):
@@ -154,7 +350,7 @@ def download_ebook(auth: "kindle.Authenticator",
                 timestamp=manifest["responseContext"]["manifestTime"])
 
             headers = {
-                "User-Agent": "Kindle/1.0.235280.0.10 CFNetwork/1220.1 Darwin/20.3.0",
+                "User-Agent": USER_AGENT,
                 "X-ADP-AttemptCount": "1",
                 "X-ADP-CorrelationId": correlation_id,
                 "X-ADP-Transport": manifest["responseContext"]["transport"],
@@ -185,139 +381,556 @@ def download_ebook(auth: "kindle.Authenticator",
                 fn=fn,
                 headers=headers))
 
-    files = []
-    for part in parts:
-        r = session.request(
-            method=part.method,
-            url=part.url,
-            headers=part.headers)
-        r.raise_for_status()
-        fn = part.fn
-
-        if fn is None:
-            cd = r.headers.get("content-disposition")
-            fn = re.findall('filename="(.+)"', cd)
-            fn = fn[0]
-
-        fn = pathlib.Path(fn)
-        files.append(fn)
-        fn.write_bytes(r.content)
-        print(f"Book part successfully saved to {fn}")
-
-    asin = manifest["content"]["id"].upper()
-    manifest_file = pathlib.Path(f"{asin}.manifest")
-    manifest_json_data = json.dumps(manifest)
-    manifest_file.write_text(manifest_json_data)
-    files.append(manifest_file)
-
-    fn = asin + "_EBOK.kfx-zip"
-    with ZipFile(fn, 'w') as myzip:
-        for file in files:
-            myzip.write(file)
-            file.unlink()
-
-    if decrypt:
-        fn_dec = asin + "_EBOK.kfx-zip.tmp"
-        kfx_book = KFXZipBook(fn, auth)
-        kfx_book.processBook()
-        kfx_book.getFile(fn_dec)
-        pathlib.Path(fn).unlink()
-        pathlib.Path(fn_dec).rename(fn)
-
-
-def download_pdoc(auth: "kindle.Authenticator", asin: str) -> None:
-    "Downloading personal added documents"
-    url = "https://cde-ta-g7g.amazon.com/FionaCDEServiceEngine/FSDownloadContent"
-    params = {
+    return parts
+
+
+def _part_filename(part: Request, r: httpx.Response) -> pathlib.Path:
+    fn = part.fn
+
+    if fn is None:
+        cd = r.headers.get("content-disposition")
+        fn = re.findall('filename="(.+)"', cd)
+        fn = fn[0]
+
+    return pathlib.Path(fn)
+
+
+class _KFXZipWriter:
+    """Writes the parts of a book directly into a kfx-zip archive.
+
+    The archive is written to a unique temporary file in `target_dir` and
+    moved to its final name ``<ASIN>_EBOK.kfx-zip`` by :meth:`commit`. So
+    several workers can share one target directory.
+    """
+
+    def __init__(self,
+                 auth: "kindle.Authenticator",
+                 manifest: Dict,
+                 target_dir: Optional[Union[str, pathlib.Path]] = None) -> None:
+        self.auth = auth
+        self.asin = manifest["content"]["id"].upper()
+        self.target_dir = pathlib.Path(target_dir or ".")
+        self.filename = self.target_dir / f"{self.asin}_EBOK.kfx-zip"
+        self._tmp_files = []
+        self._zip = ZipFile(self._tmp_file(), "x")
+
+    def _tmp_file(self) -> pathlib.Path:
+        fn = self.target_dir / f".{self.asin}_EBOK.{uuid.uuid4().hex}.tmp"
+        self._tmp_files.append(fn)
+        return fn
+
+    def open_entry(self, name: str, size: Optional[int] = None) -> BinaryIO:
+        """Opens a new archive entry for writing."""
+        info = ZipInfo(name, date_time=time.localtime()[:6])
+        if size is not None:
+            info.file_size = size
+        return self._zip.open(info, "w", force_zip64=size is None)
+
+    def write_entry(self, name: str, fileobj: BinaryIO) -> None:
+        """Copies the content of `fileobj` into a new archive entry."""
+        with self.open_entry(name) as entry:
+            shutil.copyfileobj(fileobj, entry, CHUNK_SIZE)
+
+    def commit(self, manifest: Dict, decrypt: bool) -> pathlib.Path:
+        """Adds the manifest, decrypts optionally and moves the archive to
+        its final name.
+        """
+        self._zip.writestr(f"{self.asin}.manifest", json.dumps(manifest))
+        self._zip.close()
+        fn = self._zip.filename
+
+        if decrypt:
+            fn_dec = self._tmp_file()
+            kfx_book = KFXZipBook(fn, self.auth,
+                                  spool_threshold=SPOOL_MAX_SIZE,
+                                  spool_dir=self.target_dir)
+            kfx_book.process(fn_dec)
+            fn = fn_dec
+
+        os.replace(fn, self.filename)
+        self.abort()
+        return self.filename
+
+    def abort(self) -> None:
+        """Closes the archive and removes all temporary files."""
+        self._zip.close()
+        for fn in self._tmp_files:
+            if fn.exists():
+                fn.unlink()
+
+
+def _content_length(r: httpx.Response) -> Optional[int]:
+    length = r.headers.get("content-length")
+    return int(length) if length is not None else None
+
+
+def _range_headers(part: Request, offset: int) -> Dict[str, str]:
+    # identity encoding keeps byte offsets of a resumed download valid
+    headers = dict(part.headers)
+    headers["Accept-Encoding"] = "identity"
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    return headers
+
+
+class _RangeMismatch(Exception):
+    # a resumed download returned another range than requested
+    pass
+
+
+def _content_range_start(r: httpx.Response) -> Optional[int]:
+    match = re.match(r"bytes (\d+)-\d+/(\d+|\*)$",
+                     r.headers.get("content-range", "").strip())
+    return int(match.group(1)) if match else None
+
+
+def _check_resumed(r: httpx.Response, sink: BinaryIO, offset: int) -> int:
+    # Returns the offset where the response body starts. If the server
+    # ignores the range request, the sink is reset and written again. If it
+    # returns another range, the sink is reset and `_RangeMismatch` raised,
+    # so the download starts again from zero.
+    if not offset:
+        return offset
+
+    if r.status_code != 206:
+        if not sink.seekable():
+            raise RuntimeError(f"{r.url} does not support range requests, "
+                               f"can't resume download.")
+        logger.info(f"{r.url} does not support range requests, "
+                    f"restarting download")
+        sink.seek(0)
+        sink.truncate()
+        return 0
+
+    start = _content_range_start(r)
+    if start != offset:
+        if not sink.seekable():
+            raise RuntimeError(f"{r.url} returned range start {start} "
+                               f"instead of {offset}, can't resume download.")
+        logger.warning(f"{r.url} returned range start {start} instead of "
+                       f"{offset}, restarting download")
+        sink.seek(0)
+        sink.truncate()
+        raise _RangeMismatch()
+    return offset
+
+
+class _DownloadCancelled(Exception):
+    # stops a concurrently fetched part after another part failed
+    pass
+
+
+def _stream_download(client: KindleClient,
+                     part: Request,
+                     open_sink: Callable[[httpx.Response], BinaryIO],
+                     params: Optional[Dict] = None,
+                     max_resumes: int = MAX_RESUMES,
+                     cancelled: Optional[threading.Event] = None) -> int:
+    """Streams the response body of `part` into a sink chunk by chunk.
+
+    The sink is requested with the first response from `open_sink`. Closing
+    the sink is up to the caller. If the connection drops or stalls, the
+    download is resumed with a HTTP Range request against the same url up
+    to `max_resumes` times. If `cancelled` is set, the download stops with
+    the next chunk.
+
+    Returns:
+        The number of bytes written.
+    """
+    sink = None
+    written = 0
+    resumes = 0
+    while True:
+        try:
+            with client.stream(part.method,
+                               part.url,
+                               params=params,
+                               headers=_range_headers(part, written),
+                               timeout=DOWNLOAD_TIMEOUT) as r:
+                if sink is None:
+                    sink = open_sink(r)
+                written = _check_resumed(r, sink, written)
+                for chunk in r.iter_raw():
+                    if cancelled is not None and cancelled.is_set():
+                        raise _DownloadCancelled()
+                    sink.write(chunk)
+                    written += len(chunk)
+            return written
+        except _RangeMismatch:
+            if resumes >= max_resumes:
+                raise RuntimeError(f"{part.url} returned wrong ranges, "
+                                   f"can't resume download.")
+            resumes += 1
+            written = 0
+        except (httpx.TransportError, NetworkError, NotResponding) as exc:
+            if sink is None or resumes >= max_resumes:
+                raise
+            resumes += 1
+            logger.warning(f"download of {part.url} interrupted after "
+                           f"{written} bytes ({exc!r}), resuming")
+
+
+def _write_part(client: KindleClient,
+                part: Request,
+                writer: _KFXZipWriter) -> None:
+    with ExitStack() as stack:
+        names = []
+
+        def open_sink(r):
+            names.append(_part_filename(part, r).name)
+            return stack.enter_context(
+                writer.open_entry(names[0], _content_length(r)))
+
+        _stream_download(client, part, open_sink)
+    logger.info(f"book part successfully saved to {names[0]}")
+
+
+def _spool_part(client: KindleClient,
+                part: Request,
+                target_dir: pathlib.Path,
+                cancelled: Optional[threading.Event] = None
+                ) -> Tuple[str, BinaryIO]:
+    spool = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, dir=target_dir)
+    names = []
+
+    def open_sink(r):
+        names.append(_part_filename(part, r).name)
+        return spool
+
+    try:
+        _stream_download(client, part, open_sink, cancelled=cancelled)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    logger.info(f"book part successfully fetched: {names[0]}")
+    return names[0], spool
+
+
+def _iter_spooled_parts(client: KindleClient,
+                        parts: List[Request],
+                        target_dir: pathlib.Path,
+                        concurrency: int) -> Iterator[Tuple[str, BinaryIO]]:
+    # Yields the spooled parts in manifest order as soon as all parts before
+    # them are done. Up to `concurrency` parts are fetched at the same time
+    # and at most twice as many are fetched or wait to be written, so memory
+    # does not grow with the number of parts. The first failed part stops
+    # all others and its error is raised.
+    cancelled = threading.Event()
+    spool_part = bind_endpoint(_spool_part)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    remaining = iter(parts)
+    pending = deque()
+
+    def submit():
+        part = next(remaining, None)
+        if part is not None:
+            pending.append(executor.submit(
+                spool_part, client, part, target_dir, cancelled))
+
+    try:
+        for _ in range(2 * concurrency):
+            submit()
+
+        while pending:
+            for future in pending:
+                if future.done() and future.exception() is not None:
+                    raise future.exception()
+
+            head = pending[0]
+            if not head.done():
+                wait([f for f in pending if not f.done()],
+                     return_when=FIRST_COMPLETED)
+                continue
+
+            pending.popleft()
+            submit()
+            yield head.result()
+    finally:
+        cancelled.set()
+        for future in pending:
+            future.cancel()
+        # running parts stop with their next chunk and close their spools
+        executor.shutdown(wait=True)
+        for future in pending:
+            if not future.cancelled() and future.exception() is None:
+                future.result()[1].close()
+
+
+@instrumented
+def download_ebook(auth: AuthOrClient,
+                   manifest: Dict,
+                   scope: Union[str, Scope] = Scope.DEFERRED,
+                   decrypt: bool = False,
+                   concurrency: int = 1,
+                   target_dir: Optional[Union[str, pathlib.Path]] = None
+                   ) -> pathlib.Path:
+    """proof-of-concent, quick and dirty.
+
+    Download content and create a kfx-zip file in `target_dir` (default:
+    the current working dir). Decrypts the book optionally.
+
+    Book parts are streamed directly into the archive. With a `concurrency`
+    greater than 1, up to `concurrency` book parts are fetched in parallel.
+    They are spooled (in memory up to ``SPOOL_MAX_SIZE`` bytes, on disk
+    above) and written in manifest order as soon as all parts before them
+    are written. At most ``2 * concurrency`` parts are fetched or wait to
+    be written at the same time. The first failed part cancels all other
+    parts and its error is raised.
+
+    Returns:
+        The filename of the kfx-zip file.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be >= 1.")
+
+    with _client_for(auth) as client:
+        parts = _build_requests(client.auth, manifest, scope)
+        writer = _KFXZipWriter(client.auth, manifest, target_dir)
+        try:
+            if concurrency > 1 and len(parts) > 1:
+                spooled = _iter_spooled_parts(
+                    client, parts, writer.target_dir, concurrency)
+                with closing(spooled):
+                    for name, spool in spooled:
+                        with spool:
+                            writer.write_entry(name, spool)
+            else:
+                for part in parts:
+                    _write_part(client, part, writer)
+
+            return writer.commit(manifest, decrypt)
+        except BaseException:
+            writer.abort()
+            raise
+
+
+def _pdoc_params(asin: str) -> Dict:
+    return {
         "type": "PDOC",
         "key": asin,
         "is_archived_items": 1,
         "software_rev": 1184370688
     }
-    with httpx.Client(auth=auth) as session:
-        r = session.get(url, params=params)
-        pathlib.Path(asin).write_bytes(r.content)
 
 
-def whispersync(auth: "kindle.Authenticator") -> Dict:
+@instrumented
+def download_pdoc(auth: AuthOrClient, asin: str) -> None:
+    "Downloading personal added documents"
+    part = Request(method="GET", url=PDOC_URL, fn=asin, headers={})
+    with _client_for(auth) as client, ExitStack() as stack:
+        _stream_download(
+            client, part,
+            lambda r: stack.enter_context(pathlib.Path(asin).open("wb")),
+            params=_pdoc_params(asin))
+
+
+def _whispersync_url(auth: "kindle.Authenticator",
+                     identifier: Optional[str] = None) -> str:
     user_id = auth.customer_info["user_id"]
-    url = f"https://api.amazon.com/whispersync/v2/data/{user_id}/datasets"
-    params1 = {
-        "embed": "records.first_page",
-        "quiet": "true"
-    }
-    # alternative params in other requests found
-    params2 = {
-        "filterDeletedUpto": 201,
+    url = WHISPERSYNC_URL.format(user_id=user_id)
+    if identifier is not None:
+        url += f"/{identifier}/records"
+    return url
+
+
+def _max_sync_number(items: List[Dict],
+                     cursor: Optional[int]) -> Optional[int]:
+    for item in items:
+        sync_number = item.get("syncNumber")
+        if sync_number is not None and (cursor is None or sync_number > cursor):
+            cursor = sync_number
+    return cursor
+
+
+def _next_cursor(page: Dict, key: str,
+                 after: Optional[int]) -> Tuple[List[Any], Optional[int]]:
+    # Returns the items of a whispersync page and the `after` value for
+    # the next page. The cursor is the highest `syncNumber` seen so far.
+    items = page.get(key) or []
+    return items, _max_sync_number(items, after)
+
+
+@instrumented
+def whispersync(auth: AuthOrClient) -> Dict:
+    """Returns the first page of datasets with their first page of records.
+
+    Use :func:`iter_whispersync_datasets` and
+    :func:`iter_whispersync_records` to walk all pages.
+    """
+    params = {
         "embed": "records.first_page",
-        "filterDeleted": "true",
-        "after": 188
-    }
-    params3 = {
-        "after": 201,
         "quiet": "true"
     }
-    with httpx.Client(auth=auth) as session:
-        r = session.get(url, params=params1)
+    with _client_for(auth) as client:
+        r = client.get(_whispersync_url(client.auth), params=params)
         return r.json()
 
 
-def whispersync_records_by_identifier(auth: "kindle.Authenticator",
-                                      identifier: str) -> Dict:
-    user_id = auth.customer_info["user_id"]
-    url = f"https://api.amazon.com/whispersync/v2/data/{user_id}/datasets/{identifier}/records"
-    params = {
-        "after": 201
-    }
-    with httpx.Client(auth=auth) as session:
-        r = session.get(url, params=params)
+@instrumented
+def whispersync_records_by_identifier(auth: AuthOrClient,
+                                      identifier: str,
+                                      after: Optional[int] = 201) -> Dict:
+    """Returns a single page of records of a whispersync dataset."""
+    params = {}
+    if after is not None:
+        params["after"] = after
+    with _client_for(auth) as client:
+        url = _whispersync_url(client.auth, identifier)
+        r = client.get(url, params=params)
         return r.json()
 
 
-def sidecar_ebook(auth: "kindle.Authenticator", asin: str) -> Dict:
-    url = f"https://sars.amazon.com/sidecar/sa/EBOK/{asin}"
-    with httpx.Client(auth=auth) as session:
-        r = session.get(url)
+def _whispersync_params(quiet: bool,
+                        filter_deleted_upto: Optional[int]) -> Dict[str, Any]:
+    params = {}
+    if quiet:
+        params["quiet"] = "true"
+    if filter_deleted_upto is not None:
+        params["filterDeleted"] = "true"
+        params["filterDeletedUpto"] = filter_deleted_upto
+    return params
+
+
+def _iter_pages(client: KindleClient,
+                url: str,
+                key: str,
+                params: Dict[str, Any],
+                after: Optional[int]) -> Iterator[Dict]:
+    while True:
+        page_params = dict(params)
+        if after is not None:
+            page_params["after"] = after
+
+        r = client.get(url, params=page_params)
+        items, cursor = _next_cursor(r.json(), key, after)
+
+        yield from items
+
+        if not items or cursor == after:
+            break
+        after = cursor
+
+
+@instrumented
+def iter_whispersync_datasets(auth: AuthOrClient,
+                              after: Optional[int] = None,
+                              filter_deleted_upto: Optional[int] = None
+                              ) -> Iterator[Dict]:
+    """Yields all whispersync datasets page by page.
+
+    Pages are requested with the ``after`` cursor, which is the highest
+    ``syncNumber`` of the previous page.
+
+    Args:
+        auth: The Kindle Authenticator or a
+            :class:`~kindle.client.KindleClient`.
+        after: Yield only datasets with a ``syncNumber`` greater than this.
+        filter_deleted_upto: If given, deleted datasets up to this
+            ``syncNumber`` are filtered out by the server.
+    """
+    with _client_for(auth) as client:
+        url = _whispersync_url(client.auth)
+        params = _whispersync_params(True, filter_deleted_upto)
+        yield from _iter_pages(client, url, "datasets", params, after)
+
+
+@instrumented
+def iter_whispersync_records(auth: AuthOrClient,
+                             identifier: str,
+                             after: Optional[int] = None,
+                             filter_deleted_upto: Optional[int] = None
+                             ) -> Iterator[Dict]:
+    """Yields all records of a whispersync dataset page by page.
+
+    Args:
+        auth: The Kindle Authenticator or a
+            :class:`~kindle.client.KindleClient`.
+        identifier: The dataset identifier.
+        after: Yield only records with a ``syncNumber`` greater than this.
+        filter_deleted_upto: If given, deleted records up to this
+            ``syncNumber`` are filtered out by the server.
+    """
+    with _client_for(auth) as client:
+        url = _whispersync_url(client.auth, identifier)
+        params = _whispersync_params(False, filter_deleted_upto)
+        yield from _iter_pages(client, url, "records", params, after)
+
+
+def _cached_get(client: KindleClient,
+                url: str,
+                cache: Optional[ResponseCache],
+                params: Optional[Dict] = None) -> httpx.Response:
+    # a fresh cached response is returned without a request, a stale one
+    # is revalidated with a conditional request
+    if cache is None:
+        return client.get(url, params=params)
+
+    key = cache.key(_device_serial(client.auth), url, params)
+    entry = cache.lookup(key)
+    if entry is not None and is_fresh(entry):
+        return cache.response(entry)
+
+    r = client.get(url, params=params,
+                   headers=cache.conditional_headers(entry))
+    return cache.update(key, entry, r)
+
+
+@instrumented
+def sidecar_ebook(auth: AuthOrClient,
+                  asin: str,
+                  cache: Optional[ResponseCache] = None) -> Dict:
+    with _client_for(auth) as client:
+        r = _cached_get(client, SIDECAR_EBOOK_URL.format(asin=asin), cache)
         return r.json()
 
 
-def sidecar_pdoc(auth: "kindle.Authenticator", asin: str) -> Dict:
-    url = f"https://cde-ta-g7g.amazon.com/FionaCDEServiceEngine/sidecar"
-    params = {
+def _sidecar_pdoc_params(asin: str) -> Dict:
+    return {
         "type": "PDOC",
         "key": asin
     }
-    with httpx.Client(auth=auth, params=params) as session:
-        r = session.get(url)
+
+
+@instrumented
+def sidecar_pdoc(auth: AuthOrClient,
+                 asin: str,
+                 cache: Optional[ResponseCache] = None) -> Dict:
+    with _client_for(auth) as client:
+        r = _cached_get(client, SIDECAR_PDOC_URL, cache,
+                        params=_sidecar_pdoc_params(asin))
         return r.json()
 
 
-def get_news(auth: "kindle.Authenticator") -> Dict:
-    url = "https://sars.amazon.com/kinapps/notifications/new"
-    with httpx.Client(auth=auth) as session:
-        r = session.get(url)
+@instrumented
+def get_news(auth: AuthOrClient,
+             cache: Optional[ResponseCache] = None) -> Dict:
+    with _client_for(auth) as client:
+        r = _cached_get(client, NEWS_URL, cache)
         return r.json()
 
 
-def get_notification_channels(auth: "kindle.Authenticator", marketplace: str) -> Dict:
+@instrumented
+def get_notification_channels(auth: AuthOrClient,
+                              marketplace: str,
+                              cache: Optional[ResponseCache] = None) -> Dict:
     # marketplace e.g. A1PA6795UKMFR9
-    url = f"https://d3ohh9b4v3oawh.cloudfront.net/iOS/1.1/{marketplace}/notificationsChannels.json"
-    with httpx.Client(auth=auth) as session:
-        r = session.get(url)
+    url = NOTIFICATION_CHANNELS_URL.format(marketplace=marketplace)
+    with _client_for(auth) as client:
+        r = _cached_get(client, url, cache)
         return r.json()
 
 
-def get_device_credentials(auth: "kindle.Authenticator") -> Dict:
+@instrumented
+def get_device_credentials(auth: AuthOrClient,
+                           cache: Optional[ResponseCache] = None) -> Dict:
     # gives same credential types like a device registration
     # value are different, but why?
     # credentials from device registration are still valid
     # gives cookies for more amazon domains
-    url = "https://firs-ta-g7g.amazon.com/FirsProxy/getDeviceCredentials"
     params = {
         "softwareVersion": "1184366692"
     }
-    with httpx.Client(auth=auth) as session:
-        r = session.get(url, params=params)
-        cred = xmltodict.parse(r.text)
-        cred = json.loads(json.dumps(cred))
-        return cred.get("response", cred)
+    with _client_for(auth) as client:
+        r = _cached_get(client, DEVICE_CREDENTIALS_URL, cache, params=params)
+        return _parse_xml_response(r.text)
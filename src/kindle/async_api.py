@@ -0,0 +1,481 @@
+"""Asynchronous counterparts of the :mod:`kindle.api` functions.
+
+Every coroutine accepts an :class:`~kindle.auth.Authenticator` or an
+:class:`~kindle.client.AsyncKindleClient`. Pass a client to reuse its
+connection pool and to keep many requests in flight on one event loop.
+"""
+
+import asyncio
+import functools
+import logging
+import pathlib
+from collections import deque
+from contextlib import ExitStack
+from tempfile import SpooledTemporaryFile
+from typing import (
+    Any, AsyncIterator, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+)
+
+import httpx
+
+from .api import (
+    DEVICE_CREDENTIALS_URL,
+    DOWNLOAD_TIMEOUT,
+    LIBRARY_URL,
+    LibraryEvent,
+    MAX_RESUMES,
+    NEWS_URL,
+    NOTIFICATION_CHANNELS_URL,
+    PDOC_URL,
+    SIDECAR_EBOOK_URL,
+    SIDECAR_PDOC_URL,
+    SPOOL_MAX_SIZE,
+    Request,
+    Scope,
+    _KFXZipWriter,
+    _LibraryStreamParser,
+    _RangeMismatch,
+    _build_requests,
+    _cache_manifest,
+    _check_resumed,
+    _content_length,
+    _device_serial,
+    _library_params,
+    _manifest_request,
+    _next_cursor,
+    _parse_manifest,
+    _parse_xml_response,
+    _part_filename,
+    _pdoc_params,
+    _range_headers,
+    _sidecar_pdoc_params,
+    _whispersync_params,
+    _whispersync_url
+)
+from .cache import ManifestCache, ResponseCache, is_fresh
+from .client import AsyncKindleClient
+from .exceptions import NetworkError, NotResponding
+from .metrics import instrumented
+from .models import Library
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    import kindle
+
+
+logger = logging.getLogger("kindle.async_api")
+
+AuthOrAsyncClient = Union["kindle.Authenticator", AsyncKindleClient]
+
+
+class _AsyncClientFor:
+    # a given client is reused and stays open, otherwise a short-living
+    # client is created for this call only
+    def __init__(self, auth: AuthOrAsyncClient) -> None:
+        self._auth = auth
+        self._client: Optional[AsyncKindleClient] = None
+
+    async def __aenter__(self) -> AsyncKindleClient:
+        if isinstance(self._auth, AsyncKindleClient):
+            return self._auth
+        self._client = AsyncKindleClient(self._auth)
+        return self._client
+
+    async def __aexit__(self, *args) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+
+
+@instrumented
+async def get_library(auth: AuthOrAsyncClient,
+                      last_sync: Optional[Union[str, Dict]] = None,
+                      model: bool = False,
+                      keep_raw: bool = False) -> Union[Dict, Library]:
+    """Fetches the user library.
+
+    See :func:`kindle.api.get_library` for details.
+    """
+    if model:
+        library = Library()
+        async for section, data in iter_library(auth, last_sync):
+            library._apply_event(section, data, keep_raw)
+        return library
+
+    params = _library_params(last_sync)
+
+    async with _AsyncClientFor(auth) as client:
+        r = await client.get(LIBRARY_URL, params=params)
+        return _parse_xml_response(r.text)
+
+
+@instrumented
+async def iter_library(auth: AuthOrAsyncClient,
+                       last_sync: Optional[Union[str, Dict]] = None
+                       ) -> AsyncIterator[LibraryEvent]:
+    """Fetches the user library and yields the items while they arrive.
+
+    See :func:`kindle.api.iter_library` for details.
+    """
+    params = _library_params(last_sync)
+    parser = _LibraryStreamParser()
+
+    async with _AsyncClientFor(auth) as client:
+        async with client.stream("GET", LIBRARY_URL, params=params) as r:
+            async for chunk in r.aiter_bytes():
+                for event in parser.feed(chunk):
+                    yield event
+    for event in parser.close():
+        yield event
+
+
+@instrumented
+async def get_manifest_ebook(auth: AuthOrAsyncClient,
+                             asin: str,
+                             cache: Optional[ManifestCache] = None) -> Dict:
+    async with _AsyncClientFor(auth) as client:
+        if cache is not None:
+            manifest = cache.get(
+                asin, _device_serial(client.auth), _parse_manifest)
+            if manifest is not None:
+                return manifest
+
+        url, headers = _manifest_request(client.auth, asin)
+        r = await client.get(url, headers=headers)
+        return _cache_manifest(
+            r.json(), asin, _device_serial(client.auth), cache)
+
+
+async def _stream_download(client: AsyncKindleClient,
+                           part: Request,
+                           open_sink: Callable[[httpx.Response], BinaryIO],
+                           params: Optional[Dict] = None,
+                           max_resumes: int = MAX_RESUMES) -> int:
+    # see kindle.api._stream_download
+    sink = None
+    written = 0
+    resumes = 0
+    while True:
+        try:
+            async with client.stream(part.method,
+                                     part.url,
+                                     params=params,
+                                     headers=_range_headers(part, written),
+                                     timeout=DOWNLOAD_TIMEOUT) as r:
+                if sink is None:
+                    sink = open_sink(r)
+                written = _check_resumed(r, sink, written)
+                async for chunk in r.aiter_raw():
+                    sink.write(chunk)
+                    written += len(chunk)
+            return written
+        except _RangeMismatch:
+            if resumes >= max_resumes:
+                raise RuntimeError(f"{part.url} returned wrong ranges, "
+                                   f"can't resume download.")
+            resumes += 1
+            written = 0
+        except (httpx.TransportError, NetworkError, NotResponding) as exc:
+            if sink is None or resumes >= max_resumes:
+                raise
+            resumes += 1
+            logger.warning(f"download of {part.url} interrupted after "
+                           f"{written} bytes ({exc!r}), resuming")
+
+
+async def _write_part(client: AsyncKindleClient,
+                      part: Request,
+                      writer: _KFXZipWriter) -> None:
+    with ExitStack() as stack:
+        names = []
+
+        def open_sink(r):
+            names.append(_part_filename(part, r).name)
+            return stack.enter_context(
+                writer.open_entry(names[0], _content_length(r)))
+
+        await _stream_download(client, part, open_sink)
+    logger.info(f"book part successfully saved to {names[0]}")
+
+
+async def _spool_part(client: AsyncKindleClient,
+                      part: Request,
+                      target_dir: pathlib.Path) -> Tuple[str, BinaryIO]:
+    spool = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, dir=target_dir)
+    names = []
+
+    def open_sink(r):
+        names.append(_part_filename(part, r).name)
+        return spool
+
+    try:
+        await _stream_download(client, part, open_sink)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    logger.info(f"book part successfully fetched: {names[0]}")
+    return names[0], spool
+
+
+async def _iter_spooled_parts(
+        client: AsyncKindleClient,
+        parts: List[Request],
+        target_dir: pathlib.Path,
+        concurrency: int) -> AsyncIterator[Tuple[str, BinaryIO]]:
+    # see kindle.api._iter_spooled_parts
+    semaphore = asyncio.Semaphore(concurrency)
+    remaining = iter(parts)
+    pending = deque()
+
+    async def fetch(part):
+        async with semaphore:
+            return await _spool_part(client, part, target_dir)
+
+    def submit():
+        part = next(remaining, None)
+        if part is not None:
+            pending.append(asyncio.ensure_future(fetch(part)))
+
+    try:
+        for _ in range(2 * concurrency):
+            submit()
+
+        while pending:
+            for task in pending:
+                if (task.done() and not task.cancelled()
+                        and task.exception() is not None):
+                    raise task.exception()
+
+            head = pending[0]
+            if not head.done():
+                await asyncio.wait([t for t in pending if not t.done()],
+                                   return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            pending.popleft()
+            submit()
+            yield head.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        # cancelled parts close their own spools
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in pending:
+            if not task.cancelled() and task.exception() is None:
+                task.result()[1].close()
+
+
+@instrumented
+async def download_ebook(auth: AuthOrAsyncClient,
+                         manifest: Dict,
+                         scope: Union[str, Scope] = Scope.DEFERRED,
+                         decrypt: bool = False,
+                         concurrency: int = 1,
+                         target_dir: Optional[Union[str, pathlib.Path]] = None
+                         ) -> pathlib.Path:
+    """Download content and create a kfx-zip file in `target_dir`.
+
+    See :func:`kindle.api.download_ebook` for details. Decryption runs in
+    the default executor of the event loop.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be >= 1.")
+
+    async with _AsyncClientFor(auth) as client:
+        parts = _build_requests(client.auth, manifest, scope)
+        writer = _KFXZipWriter(client.auth, manifest, target_dir)
+        try:
+            if concurrency > 1 and len(parts) > 1:
+                spooled = _iter_spooled_parts(
+                    client, parts, writer.target_dir, concurrency)
+                try:
+                    async for name, spool in spooled:
+                        with spool:
+                            writer.write_entry(name, spool)
+                finally:
+                    await spooled.aclose()
+            else:
+                for part in parts:
+                    await _write_part(client, part, writer)
+
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, functools.partial(
+                writer.commit, manifest, decrypt))
+        except BaseException:
+            writer.abort()
+            raise
+
+
+@instrumented
+async def download_pdoc(auth: AuthOrAsyncClient, asin: str) -> None:
+    "Downloading personal added documents"
+    part = Request(method="GET", url=PDOC_URL, fn=asin, headers={})
+    async with _AsyncClientFor(auth) as client:
+        with ExitStack() as stack:
+            await _stream_download(
+                client, part,
+                lambda r: stack.enter_context(pathlib.Path(asin).open("wb")),
+                params=_pdoc_params(asin))
+
+
+@instrumented
+async def whispersync(auth: AuthOrAsyncClient) -> Dict:
+    params = {
+        "embed": "records.first_page",
+        "quiet": "true"
+    }
+    async with _AsyncClientFor(auth) as client:
+        r = await client.get(_whispersync_url(client.auth), params=params)
+        return r.json()
+
+
+@instrumented
+async def whispersync_records_by_identifier(auth: AuthOrAsyncClient,
+                                            identifier: str,
+                                            after: Optional[int] = 201
+                                            ) -> Dict:
+    params = {}
+    if after is not None:
+        params["after"] = after
+    async with _AsyncClientFor(auth) as client:
+        url = _whispersync_url(client.auth, identifier)
+        r = await client.get(url, params=params)
+        return r.json()
+
+
+async def _iter_pages(client: AsyncKindleClient,
+                      url: str,
+                      key: str,
+                      params: Dict[str, Any],
+                      after: Optional[int]) -> AsyncIterator[Dict]:
+    while True:
+        page_params = dict(params)
+        if after is not None:
+            page_params["after"] = after
+
+        r = await client.get(url, params=page_params)
+        items, cursor = _next_cursor(r.json(), key, after)
+
+        for item in items:
+            yield item
+
+        if not items or cursor == after:
+            break
+        after = cursor
+
+
+@instrumented
+async def iter_whispersync_datasets(
+        auth: AuthOrAsyncClient,
+        after: Optional[int] = None,
+        filter_deleted_upto: Optional[int] = None) -> AsyncIterator[Dict]:
+    """Yields all whispersync datasets page by page.
+
+    See :func:`kindle.api.iter_whispersync_datasets` for details.
+
+    Args:
+        auth: The Kindle Authenticator or a
+            :class:`~kindle.client.AsyncKindleClient`.
+        after: Yield only datasets with a ``syncNumber`` greater than this.
+        filter_deleted_upto: If given, deleted datasets up to this
+            ``syncNumber`` are filtered out by the server.
+    """
+    async with _AsyncClientFor(auth) as client:
+        url = _whispersync_url(client.auth)
+        params = _whispersync_params(True, filter_deleted_upto)
+        async for dataset in _iter_pages(
+                client, url, "datasets", params, after):
+            yield dataset
+
+
+@instrumented
+async def iter_whispersync_records(
+        auth: AuthOrAsyncClient,
+        identifier: str,
+        after: Optional[int] = None,
+        filter_deleted_upto: Optional[int] = None) -> AsyncIterator[Dict]:
+    """Yields all records of a whispersync dataset page by page.
+
+    Args:
+        auth: The Kindle Authenticator or a
+            :class:`~kindle.client.AsyncKindleClient`.
+        identifier: The dataset identifier.
+        after: Yield only records with a ``syncNumber`` greater than this.
+        filter_deleted_upto: If given, deleted records up to this
+            ``syncNumber`` are filtered out by the server.
+    """
+    async with _AsyncClientFor(auth) as client:
+        url = _whispersync_url(client.auth, identifier)
+        params = _whispersync_params(False, filter_deleted_upto)
+        async for record in _iter_pages(
+                client, url, "records", params, after):
+            yield record
+
+
+async def _cached_get(client: AsyncKindleClient,
+                      url: str,
+                      cache: Optional[ResponseCache],
+                      params: Optional[Dict] = None) -> httpx.Response:
+    if cache is None:
+        return await client.get(url, params=params)
+
+    key = cache.key(_device_serial(client.auth), url, params)
+    entry = cache.lookup(key)
+    if entry is not None and is_fresh(entry):
+        return cache.response(entry)
+
+    r = await client.get(url, params=params,
+                         headers=cache.conditional_headers(entry))
+    return cache.update(key, entry, r)
+
+
+@instrumented
+async def sidecar_ebook(auth: AuthOrAsyncClient,
+                        asin: str,
+                        cache: Optional[ResponseCache] = None) -> Dict:
+    async with _AsyncClientFor(auth) as client:
+        r = await _cached_get(
+            client, SIDECAR_EBOOK_URL.format(asin=asin), cache)
+        return r.json()
+
+
+@instrumented
+async def sidecar_pdoc(auth: AuthOrAsyncClient,
+                       asin: str,
+                       cache: Optional[ResponseCache] = None) -> Dict:
+    async with _AsyncClientFor(auth) as client:
+        r = await _cached_get(client, SIDECAR_PDOC_URL, cache,
+                              params=_sidecar_pdoc_params(asin))
+        return r.json()
+
+
+@instrumented
+async def get_news(auth: AuthOrAsyncClient,
+                   cache: Optional[ResponseCache] = None) -> Dict:
+    async with _AsyncClientFor(auth) as client:
+        r = await _cached_get(client, NEWS_URL, cache)
+        return r.json()
+
+
+@instrumented
+async def get_notification_channels(auth: AuthOrAsyncClient,
+                                    marketplace: str,
+                                    cache: Optional[ResponseCache] = None
+                                    ) -> Dict:
+    url = NOTIFICATION_CHANNELS_URL.format(marketplace=marketplace)
+    async with _AsyncClientFor(auth) as client:
+        r = await _cached_get(client, url, cache)
+        return r.json()
+
+
+@instrumented
+async def get_device_credentials(auth: AuthOrAsyncClient,
+                                 cache: Optional[ResponseCache] = None
+                                 ) -> Dict:
+    params = {
+        "softwareVersion": "1184366692"
+    }
+    async with _AsyncClientFor(auth) as client:
+        r = await _cached_get(client, DEVICE_CREDENTIALS_URL, cache,
+                              params=params)
+        return _parse_xml_response(r.text)
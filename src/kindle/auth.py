@@ -1,8 +1,19 @@
+import asyncio
 import base64
+import functools
+import heapq
+import itertools
 import json
 import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
 from datetime import datetime, timedelta
-from typing import Any, Callable, Dict, List, Generator, Optional, Union
+from typing import (
+    Any, AsyncGenerator, Callable, Dict, List, Generator, Optional, Tuple,
+    Union
+)
 from typing import TYPE_CHECKING
 
 import httpx
@@ -17,12 +28,43 @@ from kindle.register import deregister as deregister_
 from kindle.register import register as register_
 from kindle.utils import test_convert
 
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding
+    cryptography_available = True
+except ImportError:
+    cryptography_available = False
+
 if TYPE_CHECKING:
     import pathlib
     from kindle.localization import Locale
 
 logger = logging.getLogger("kindle.auth")
 
+SIGNING_BACKENDS = ("cryptography", "rsa")
+
+
+def _refresh_access_token_body(refresh_token: str) -> Dict[str, str]:
+    return {
+        "app_name": "Kindle for iOS",
+        "app_version": "6.38.0.100",
+        "source_token": refresh_token,
+        "requested_token_type": "access_token",
+        "source_token_type": "refresh_token"
+    }
+
+
+def _parse_refresh_response(resp: httpx.Response) -> Dict[str, Any]:
+    resp.raise_for_status()
+    resp_dict = resp.json()
+
+    expires_in_sec = int(resp_dict["expires_in"])
+    expires = (
+            datetime.utcnow() + timedelta(seconds=expires_in_sec)).timestamp()
+
+    return {"access_token": resp_dict["access_token"], "expires": expires}
+
 
 def refresh_access_token(refresh_token: str, domain: str) -> Dict[str, Any]:
     """Refreshes an access token.
@@ -40,23 +82,20 @@ def refresh_access_token(refresh_token: str, domain: str) -> Dict[str, Any]:
         The new access token is valid for 60 minutes.
     """
 
-    body = {
-        "app_name": "Kindle for iOS",
-        "app_version": "6.38.0.100",
-        "source_token": refresh_token,
-        "requested_token_type": "access_token",
-        "source_token_type": "refresh_token"
-    }
-
+    body = _refresh_access_token_body(refresh_token)
     resp = httpx.post(f"https://api.amazon.{domain}/auth/token", data=body)
-    resp.raise_for_status()
-    resp_dict = resp.json()
+    return _parse_refresh_response(resp)
 
-    expires_in_sec = int(resp_dict["expires_in"])
-    expires = (
-            datetime.utcnow() + timedelta(seconds=expires_in_sec)).timestamp()
 
-    return {"access_token": resp_dict["access_token"], "expires": expires}
+async def async_refresh_access_token(refresh_token: str,
+                                     domain: str) -> Dict[str, Any]:
+    """The asynchronous counterpart of :func:`refresh_access_token`."""
+
+    body = _refresh_access_token_body(refresh_token)
+    async with httpx.AsyncClient() as client:
+        resp = await client.post(
+            f"https://api.amazon.{domain}/auth/token", data=body)
+    return _parse_refresh_response(resp)
 
 
 def refresh_website_cookies(refresh_token: str,
@@ -122,11 +161,66 @@ def user_profile(access_token: str, domain: str) -> Dict[str, Any]:
     return resp.json()
 
 
+class RSASigner:
+    """Signs data with SHA256withRSA using a once parsed private key.
+
+    Parsing the PEM key is expensive. A signer parses the key only once and
+    can be used for any number of signatures afterwards.
+
+    Args:
+        private_key: The rsa key obtained after device registration.
+        backend: The signing backend. Can be ``cryptography`` or ``rsa``.
+            If ``None``, ``cryptography`` is used if installed, otherwise
+            the pure-Python ``rsa`` package.
+
+    Raises:
+        ValueError: If `backend` is unknown or not installed.
+    """
+
+    def __init__(self, private_key: str, backend: Optional[str] = None) -> None:
+        if backend is None:
+            backend = "cryptography" if cryptography_available else "rsa"
+
+        if backend not in SIGNING_BACKENDS:
+            raise ValueError(f"backend must be one of "
+                             f"{', '.join(SIGNING_BACKENDS)}.")
+
+        if backend == "cryptography" and not cryptography_available:
+            raise ValueError("backend cryptography is not installed.")
+
+        self.private_key = private_key
+        self.backend = backend
+
+        if backend == "cryptography":
+            self._key = serialization.load_pem_private_key(
+                private_key.encode("utf-8"),
+                password=None,
+                backend=default_backend())
+        else:
+            self._key = rsa.PrivateKey.load_pkcs1(private_key.encode("utf-8"))
+
+    def __repr__(self):
+        return f"{type(self).__name__}(backend={self.backend!r})"
+
+    def sign(self, data: bytes) -> bytes:
+        """Returns the PKCS#1 v1.5 SHA-256 signature of `data`."""
+        if self.backend == "cryptography":
+            return self._key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+        return rsa.pkcs1.sign(data, self._key, "SHA-256")
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_signer(private_key: str) -> RSASigner:
+    # parsing the PEM key costs more than signing, callers passing the key
+    # as str get the parsed key of an earlier call
+    return RSASigner(private_key)
+
+
 def sign_request(method: str,
                  path: str,
                  body: bytes,
                  adp_token: str,
-                 private_key: str) -> Dict[str, str]:
+                 private_key: Union[str, RSASigner]) -> Dict[str, str]:
     """Helper function who creates signed headers for http requests.
 
     Args:
@@ -134,7 +228,8 @@ def sign_request(method: str,
         method: The http request method (GET, POST, DELETE, ...).
         body: The http message body.
         adp_token: The adp token obtained after a device registration.
-        private_key: The rsa key obtained after device registration.
+        private_key: The rsa key obtained after device registration or a
+            :class:`RSASigner` with the already parsed key.
     
     Returns:
         A dict with the signed headers.
@@ -144,8 +239,11 @@ def sign_request(method: str,
 
     data = f"{method}\n{path}\n{date}\n{body}\n{adp_token}"
 
-    key = rsa.PrivateKey.load_pkcs1(private_key.encode("utf-8"))
-    cipher = rsa.pkcs1.sign(data.encode(), key, "SHA-256")
+    if isinstance(private_key, RSASigner):
+        signer = private_key
+    else:
+        signer = _cached_signer(private_key)
+    cipher = signer.sign(data.encode())
     signed_encoded = base64.b64encode(cipher)
 
     signature = f"{signed_encoded.decode()}:{date}"
@@ -157,6 +255,66 @@ def sign_request(method: str,
     }
 
 
+class _RefreshScheduler:
+    """Runs the scheduled access token refreshes of all authenticators.
+
+    A single daemon thread waits for the next due entry of a heap, so the
+    number of threads does not grow with the number of authenticators.
+    Due refreshes run one after another in this thread.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._heap: List[List[Any]] = []
+        self._counter = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, delay: float, callback: Callable[[], Any]) -> List:
+        """Runs `callback` in `delay` seconds. Returns the entry, which can
+        be passed to :meth:`cancel`.
+        """
+        entry = [time.monotonic() + delay, next(self._counter), callback]
+        with self._condition:
+            heapq.heappush(self._heap, entry)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="kindle-refresh-scheduler",
+                    daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return entry
+
+    def cancel(self, entry: List) -> None:
+        # cancelled entries stay in the heap until they are due
+        with self._condition:
+            entry[2] = None
+
+    def _next_callback(self) -> Callable[[], Any]:
+        with self._condition:
+            while True:
+                while self._heap and self._heap[0][2] is None:
+                    heapq.heappop(self._heap)
+                timeout = None
+                if self._heap:
+                    timeout = self._heap[0][0] - time.monotonic()
+                    if timeout <= 0:
+                        entry = heapq.heappop(self._heap)
+                        callback, entry[2] = entry[2], None
+                        return callback
+                self._condition.wait(timeout)
+
+    def _run(self) -> None:
+        while True:
+            callback = self._next_callback()
+            try:
+                callback()
+            except Exception:
+                logger.exception("scheduled callback failed")
+
+
+_refresh_scheduler = _RefreshScheduler()
+
+
 class Authenticator(httpx.Auth):
     """Kindle Authenticator class
 
@@ -196,9 +354,18 @@ class Authenticator(httpx.Auth):
     store_authentication_cookie: Optional[Dict] = None
     website_cookies: Optional[Dict] = None
     requires_request_body: bool = True
+    _signer: Optional[RSASigner] = None
+    _refresh_lock: Optional[threading.Lock] = None
+    _refresh_future: Optional[Future] = None
+    _refresh_entry: Optional[List] = None
+    _refresh_schedule: Optional[Dict[str, Any]] = None
     _forbid_new_attrs: bool = True
     _apply_test_convert: bool = True
 
+    def __init__(self) -> None:
+        # guards the in-flight refresh, see refresh_access_token
+        self._refresh_lock = threading.Lock()
+
     def __setattr__(self, attr, value):
         if self._forbid_new_attrs and not hasattr(self, attr):
             msg = (f"{self.__class__.__name__} is frozen, can't "
@@ -219,7 +386,10 @@ class Authenticator(httpx.Auth):
         return len([i for i in self])
 
     def __repr__(self):
-        return f"{type(self).__name__}({self.__dict__})"
+        # private attributes are locks, timers and caches
+        attrs = {k: v for k, v in self.__dict__.items()
+                 if not k.startswith("_")}
+        return f"{type(self).__name__}({attrs})"
 
     def _update_attrs(self, **kwargs) -> None:
         for attr, value in kwargs.items():
@@ -400,15 +570,39 @@ class Authenticator(httpx.Auth):
 
         yield request
 
+    async def async_auth_flow(
+            self, request: httpx.Request
+    ) -> AsyncGenerator[httpx.Request, httpx.Response]:
+        """Async auth flow to be executed on every request by :mod:`httpx`.
+
+        Other than :meth:`auth_flow`, an expired access token is refreshed
+        without blocking the event loop.
+
+        Args:
+            request: The request made by ``httpx``.
+
+        Yields:
+            The next request
+        """
+        if self.requires_request_body:
+            await request.aread()
+
+        available_modes = self.available_auth_modes
+        if "signing" not in available_modes and "bearer" in available_modes \
+                and self.access_token_expired:
+            await self.async_refresh_access_token()
+
+        yield next(self.auth_flow(request))
+
     def _apply_signing_auth_flow(self, request: httpx.Request) -> None:
         headers = sign_request(method=request.method,
                                path=request.url.raw_path.decode(),
                                body=request.content,
                                adp_token=self.adp_token,
-                               private_key=self.device_private_key)
+                               private_key=self.signer)
 
         request.headers.update(headers)
-        logger.info("signing auth flow applied to request")
+        logger.debug("signing auth flow applied to request")
 
     def _apply_bearer_auth_flow(self, request: httpx.Request) -> None:
         if self.access_token_expired:
@@ -430,6 +624,20 @@ class Authenticator(httpx.Auth):
         Cookies(cookies).set_cookie_header(request)
         logger.info("cookies auth flow applied to request")
 
+    @property
+    def signer(self) -> RSASigner:
+        """The :class:`RSASigner` for the ``device_private_key``.
+
+        The key is parsed on first access and cached until the
+        ``device_private_key`` changes.
+        """
+        signer = self._signer
+        if signer is None or signer.private_key != self.device_private_key:
+            signer = RSASigner(self.device_private_key)
+            self._signer = signer
+            logger.debug(f"created {signer} for device private key")
+        return signer
+
     @property
     def available_auth_modes(self) -> List:
         available_modes = []
@@ -584,18 +792,198 @@ class Authenticator(httpx.Auth):
             domain=self.locale.domain)
 
     def refresh_access_token(self, force: bool = False) -> None:
-        if force or self.access_token_expired:
-            if self.refresh_token is None:
-                message = "No refresh token found. Can't refresh access token."
-                logger.critical(message)
-                raise NoRefreshToken(message)
-            refresh_data = refresh_access_token(
-                refresh_token=self.refresh_token, domain=self.locale.domain)
+        """Refreshes the access token.
+
+        The refresh is single-flight. If many threads or tasks find the
+        access token expired at the same time, only one of them requests a
+        new token. The others wait for it and use the new token afterwards.
+        This holds across threads, event loops and
+        :meth:`async_refresh_access_token`.
 
-            self._update_attrs(**refresh_data)
+        Args:
+            force: If ``True``, refresh the access token even if it is not
+                expired. A refresh which is already in flight is joined.
+        """
+        future, owner = self._join_refresh(force)
+        if future is None:
+            return
+
+        if owner:
+            try:
+                refresh_data = refresh_access_token(
+                    refresh_token=self.refresh_token,
+                    domain=self.locale.domain)
+            except BaseException as exc:
+                self._finish_refresh(future, exc=exc)
+                raise
+            self._finish_refresh(future, refresh_data)
+        else:
+            future.result()
+
+    async def async_refresh_access_token(self, force: bool = False) -> None:
+        """The asynchronous counterpart of :meth:`refresh_access_token`.
+
+        Shares the in-flight refresh with all threads and event loops.
+        """
+        future, owner = self._join_refresh(force)
+        if future is None:
+            return
+
+        if owner:
+            try:
+                refresh_data = await async_refresh_access_token(
+                    refresh_token=self.refresh_token,
+                    domain=self.locale.domain)
+            except BaseException as exc:
+                self._finish_refresh(future, exc=exc)
+                raise
+            self._finish_refresh(future, refresh_data)
         else:
+            # a cancelled waiter must not cancel the shared refresh
+            await asyncio.shield(asyncio.wrap_future(future))
+
+    def _join_refresh(self, force: bool) -> Tuple[Optional[Future], bool]:
+        # Returns the in-flight refresh and if the caller started it. The
+        # caller which starts it must run the refresh, the others wait for
+        # the future. The future is ``None`` if no refresh is necessary.
+        # The lock is never held during a request, so taking it does not
+        # block an event loop.
+        if not (force or self.access_token_expired):
             logger.info("Access Token not expired. No refresh necessary. "
                         "To force refresh please use force=True")
+            return None, False
+
+        if self.refresh_token is None:
+            message = "No refresh token found. Can't refresh access token."
+            logger.critical(message)
+            raise NoRefreshToken(message)
+
+        with self._refresh_lock:
+            if self._refresh_future is not None:
+                logger.debug("Joining access token refresh in flight.")
+                return self._refresh_future, False
+            # another caller may have refreshed the token in the meantime
+            if not force and not self.access_token_expired:
+                logger.debug("Access Token refreshed by concurrent caller.")
+                return None, False
+            self._refresh_future = Future()
+            return self._refresh_future, True
+
+    def _finish_refresh(self,
+                        future: Future,
+                        refresh_data: Optional[Dict[str, Any]] = None,
+                        exc: Optional[BaseException] = None) -> None:
+        with self._refresh_lock:
+            if exc is None:
+                self._update_attrs(**refresh_data)
+            self._refresh_future = None
+
+        if exc is None:
+            future.set_result(None)
+        elif isinstance(exc, Exception):
+            future.set_exception(exc)
+        else:
+            # e.g. a cancelled task, the waiters did not ask for that
+            future.set_exception(
+                RuntimeError("access token refresh was interrupted"))
+
+    @property
+    def refresh_scheduler_running(self) -> bool:
+        return self._refresh_entry is not None
+
+    def start_refresh_scheduler(self,
+                                margin: float = 300.0,
+                                jitter: float = 120.0,
+                                to_file: bool = False,
+                                retry_interval: float = 30.0) -> None:
+        """Refreshes the access token in the background before it expires.
+
+        The refresh is scheduled `margin` seconds before ``expires`` minus
+        a random delay of up to `jitter` seconds. So the first request after
+        the expiration does not have to wait for a token refresh and many
+        authenticators loaded at the same time do not refresh at the same
+        moment. The refreshes of all authenticators run in one shared
+        daemon thread. The next refresh is scheduled after every refresh.
+
+        Args:
+            margin: Seconds before the expiration to refresh the token.
+            jitter: Maximum random seconds to refresh earlier.
+            to_file: If ``True``, save the new token with :meth:`to_file`
+                to the default ``filename`` after every refresh.
+            retry_interval: Seconds to wait before retrying a failed
+                refresh.
+
+        Raises:
+            NoRefreshToken: If no refresh token is available.
+        """
+        if self.refresh_token is None:
+            message = "No refresh token found. Can't schedule refresh."
+            logger.critical(message)
+            raise NoRefreshToken(message)
+
+        if margin < 0 or jitter < 0 or retry_interval <= 0:
+            raise ValueError("margin and jitter must be >= 0 and "
+                             "retry_interval must be > 0.")
+
+        self.stop_refresh_scheduler()
+        schedule = {
+            "margin": margin,
+            "jitter": jitter,
+            "to_file": to_file,
+            "retry_interval": retry_interval,
+            "expires": None
+        }
+        self._refresh_schedule = schedule
+        self._schedule_refresh(schedule, self._plan_refresh(schedule))
+
+    def stop_refresh_scheduler(self) -> None:
+        """Stops the background refresh started with
+        :meth:`start_refresh_scheduler`.
+        """
+        entry = self._refresh_entry
+        self._refresh_entry = None
+        self._refresh_schedule = None
+        if entry is not None:
+            _refresh_scheduler.cancel(entry)
+            logger.info("refresh scheduler stopped")
+
+    def _plan_refresh(self, schedule: Dict[str, Any]) -> float:
+        # Returns the delay until the next refresh. The jitter is drawn
+        # once here. The token expiration is stored with the schedule, so
+        # a refresh by another caller can be detected when the entry is due.
+        schedule["expires"] = self.expires
+        remaining = 0.0
+        if self.expires is not None:
+            remaining = self.access_token_expires.total_seconds()
+        delay = remaining - schedule["margin"] \
+            - random.uniform(0, schedule["jitter"])
+        return max(delay, 0.0)
+
+    def _schedule_refresh(self, schedule: Dict[str, Any],
+                          delay: float) -> None:
+        self._refresh_entry = _refresh_scheduler.schedule(
+            delay, functools.partial(self._run_scheduled_refresh, schedule))
+        logger.debug(f"next access token refresh in {delay:.0f} seconds")
+
+    def _run_scheduled_refresh(self, schedule: Dict[str, Any]) -> None:
+        if self._refresh_schedule is not schedule:
+            return
+
+        try:
+            if self.expires != schedule["expires"]:
+                logger.debug("access token already refreshed")
+            else:
+                self.refresh_access_token(force=True)
+                logger.info("access token refreshed by scheduler")
+                if schedule["to_file"]:
+                    self.to_file()
+            delay = self._plan_refresh(schedule)
+        except Exception:
+            logger.exception("scheduled access token refresh failed")
+            delay = schedule["retry_interval"]
+
+        if self._refresh_schedule is schedule:
+            self._schedule_refresh(schedule, delay)
 
     def set_website_cookies_for_country(self, country_code: str) -> None:
         cookies_domain = test_convert("locale", country_code).domain
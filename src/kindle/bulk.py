@@ -0,0 +1,182 @@
+"""Downloads many books in one run.
+
+The manifest and download steps of every ASIN run as one work item in a
+thread pool. All items share a single :class:`~kindle.client.KindleClient`,
+so connections are reused across books. A failed item is logged and
+reported, the remaining items continue.
+"""
+
+import logging
+import pathlib
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from .api import (
+    AuthOrClient, Scope, download_ebook, get_manifest_ebook
+)
+from .cache import ManifestCache
+from .client import KindleClient
+from .models import Library, iter_meta_data
+
+
+logger = logging.getLogger("kindle.bulk")
+
+BulkItem = namedtuple("BulkItem", ["asin", "path", "error", "elapsed"])
+BulkItem.__doc__ = """The result of a single ASIN.
+
+Either `path` (the downloaded kfx-zip file) or `error` (the raised
+exception) is set. `elapsed` is the time in seconds.
+"""
+
+ProgressCallback = Callable[[BulkItem, int, int], None]
+
+
+class BulkSummary(namedtuple("BulkSummary", ["items", "elapsed"])):
+    """The results of a :func:`download_ebooks` run in input order."""
+
+    __slots__ = ()
+
+    @property
+    def succeeded(self) -> List[BulkItem]:
+        return [item for item in self.items if item.error is None]
+
+    @property
+    def failed(self) -> List[BulkItem]:
+        return [item for item in self.items if item.error is not None]
+
+    def __str__(self):
+        return (f"{len(self.items)} items in {self.elapsed:.1f}s: "
+                f"{len(self.succeeded)} succeeded, {len(self.failed)} failed")
+
+
+def _asins_from(source: Union[Iterable[str], Dict, Library]) -> List[str]:
+    if isinstance(source, Library):
+        asins = [item.asin for item in source
+                 if item.cde_contenttype in (None, "EBOK")]
+    elif isinstance(source, dict):
+        asins = [
+            data["ASIN"]
+            for data in iter_meta_data(source, "add_update_list")
+            if isinstance(data, dict) and data.get("ASIN")
+            and data.get("cde_contenttype", "EBOK") == "EBOK"
+        ]
+    else:
+        asins = list(source)
+
+    # keep the order, but download every book only once
+    seen = set()
+    unique = []
+    for asin in asins:
+        asin = asin.upper()
+        if asin not in seen:
+            seen.add(asin)
+            unique.append(asin)
+    return unique
+
+
+def _download_one(client: KindleClient,
+                  asin: str,
+                  scope: Union[str, Scope],
+                  decrypt: bool,
+                  part_concurrency: int,
+                  target_dir: Optional[Union[str, pathlib.Path]],
+                  manifest_cache: Optional[ManifestCache]) -> BulkItem:
+    start = time.monotonic()
+    try:
+        manifest = get_manifest_ebook(client, asin, cache=manifest_cache)
+        path = download_ebook(client, manifest, scope, decrypt,
+                              part_concurrency, target_dir)
+    except Exception as exc:
+        logger.warning(f"download of {asin} failed: {exc!r}")
+        return BulkItem(asin, None, exc, time.monotonic() - start)
+
+    logger.info(f"downloaded {asin} to {path}")
+    return BulkItem(asin, path, None, time.monotonic() - start)
+
+
+def download_ebooks(auth: AuthOrClient,
+                    asins: Union[Iterable[str], Dict, Library],
+                    scope: Union[str, Scope] = Scope.DEFERRED,
+                    decrypt: bool = False,
+                    target_dir: Optional[Union[str, pathlib.Path]] = None,
+                    concurrency: int = 4,
+                    max_requests_per_host: Optional[int] = None,
+                    part_concurrency: int = 1,
+                    progress: Optional[ProgressCallback] = None,
+                    manifest_cache: Optional[ManifestCache] = None
+                    ) -> BulkSummary:
+    """Fetches the manifest and downloads the book for many ASINs.
+
+    Args:
+        auth: The Kindle Authenticator or a
+            :class:`~kindle.client.KindleClient`.
+        asins: The ASINs to download. Can also be a library returned by
+            :func:`kindle.api.get_library` or a
+            :class:`~kindle.models.Library`. Then all ebooks of the
+            ``add_update_list`` are downloaded. Duplicates are skipped.
+        scope: See :func:`kindle.api.download_ebook`.
+        decrypt: See :func:`kindle.api.download_ebook`.
+        target_dir: See :func:`kindle.api.download_ebook`.
+        concurrency: The max. number of books processed at the same time.
+        max_requests_per_host: The max. number of requests in flight to the
+            same host across all books. Only used if `auth` is an
+            Authenticator, a given client uses its own limit.
+        part_concurrency: The number of parts fetched at the same time per
+            book.
+        progress: Called with the :class:`BulkItem`, the number of finished
+            items and the total number of items after every item. Runs in
+            the calling thread.
+        manifest_cache: If given, manifests are looked up in and added to
+            this cache. A rerun for failed items then reuses the manifests.
+
+    Returns:
+        A :class:`BulkSummary` with the results in input order.
+
+    Example:
+        >>> library = kindle.api.get_library(auth, model=True)
+        >>> summary = download_ebooks(auth, library, concurrency=8,
+        ...                           max_requests_per_host=4)
+        >>> print(summary)
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be >= 1.")
+
+    asins = _asins_from(asins)
+    start = time.monotonic()
+
+    if isinstance(auth, KindleClient):
+        client, own_client = auth, False
+    else:
+        client = KindleClient(
+            auth, max_requests_per_host=max_requests_per_host)
+        own_client = True
+
+    results: Dict[str, BulkItem] = {}
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    futures = [
+        executor.submit(_download_one, client, asin, scope, decrypt,
+                        part_concurrency, target_dir, manifest_cache)
+        for asin in asins
+    ]
+    try:
+        for future in as_completed(futures):
+            item = future.result()
+            results[item.asin] = item
+            if progress is not None:
+                progress(item, len(results), len(asins))
+    except BaseException:
+        # e.g. KeyboardInterrupt, running items are finished before return
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        if own_client:
+            client.close()
+
+    summary = BulkSummary(
+        [results[asin] for asin in asins], time.monotonic() - start)
+    logger.info(f"bulk download finished: {summary}")
+    return summary
@@ -0,0 +1,569 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterator, Optional, Tuple, Union
+from urllib.parse import parse_qsl, urlsplit
+
+import httpx
+
+
+logger = logging.getLogger("kindle.cache")
+
+# max. lifetime of a cached manifest, if no signed url expires earlier
+MANIFEST_MAX_AGE = 3600
+# a manifest is expired this many seconds before its first url expires,
+# so a download never starts with an almost expired url
+MANIFEST_EXPIRY_MARGIN = 120
+
+
+def _url_expiry(url: str) -> Optional[float]:
+    # CloudFront signed urls carry `Expires` as unix timestamp, S3 presigned
+    # urls `X-Amz-Date` and `X-Amz-Expires` (lifetime in seconds)
+    query = {k.lower(): v for k, v in parse_qsl(urlsplit(url).query)}
+    try:
+        if "expires" in query:
+            return float(query["expires"])
+        if "x-amz-date" in query and "x-amz-expires" in query:
+            signed = datetime.strptime(query["x-amz-date"], "%Y%m%dT%H%M%SZ")
+            signed = signed.replace(tzinfo=timezone.utc).timestamp()
+            return signed + float(query["x-amz-expires"])
+    except ValueError:
+        logger.debug(f"unable to parse expiry of url {url}")
+    return None
+
+
+def _unlink(file: pathlib.Path) -> None:
+    try:
+        file.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _manifest_urls(manifest: Dict) -> Iterator[str]:
+    for resource in manifest.get("resources", []):
+        url = resource.get("optimalEndpoint", {}).get("directUrl")
+        if url:
+            yield url
+        url = resource.get("endpoint", {}).get("url")
+        if url:
+            yield url
+
+
+def _manifest_time(manifest: Dict) -> Optional[float]:
+    # `manifestTime` is a unix timestamp in milliseconds
+    try:
+        return float(manifest["responseContext"]["manifestTime"]) / 1000
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def manifest_expiry(manifest: Dict,
+                    max_age: float = MANIFEST_MAX_AGE,
+                    margin: float = MANIFEST_EXPIRY_MARGIN) -> float:
+    """Returns the unix timestamp when a parsed manifest becomes stale.
+
+    That is `max_age` seconds after the ``manifestTime`` or `margin` seconds
+    before the first signed resource url expires, whatever comes first.
+
+    Args:
+        manifest: A manifest returned by
+            :func:`kindle.api.get_manifest_ebook`.
+        max_age: The max. lifetime of a manifest in seconds.
+        margin: The safety margin before a url expires in seconds.
+    """
+    now = time.time()
+    issued = _manifest_time(manifest)
+    expiry = min(issued, now) + max_age if issued is not None else now + max_age
+
+    for url in _manifest_urls(manifest):
+        url_expiry = _url_expiry(url)
+        if url_expiry is not None:
+            expiry = min(expiry, url_expiry - margin)
+
+    return expiry
+
+
+class ManifestCache:
+    """Caches ebook manifests in memory and optionally on disk.
+
+    Manifests are keyed by ASIN and device serial number, because the
+    delivery urls and vouchers are bound to the requesting device. Every
+    entry expires as computed by :func:`manifest_expiry`.
+
+    Cached manifests are kept already parsed in memory, so a hit costs
+    neither a request nor the Ion decoding. On disk, the raw JSON response
+    is stored in `path` and parsed once when it is loaded.
+
+    Args:
+        path: The directory for the disk cache. Defaults to memory only.
+        max_entries: The max. number of manifests kept in memory. The least
+            recently used manifest is dropped first.
+        max_age: See :func:`manifest_expiry`.
+        margin: See :func:`manifest_expiry`.
+
+    Example:
+        >>> cache = ManifestCache("manifests")
+        >>> manifest = kindle.api.get_manifest_ebook(auth, asin, cache=cache)
+    """
+
+    def __init__(self,
+                 path: Optional[Union[str, pathlib.Path]] = None,
+                 max_entries: int = 128,
+                 max_age: float = MANIFEST_MAX_AGE,
+                 margin: float = MANIFEST_EXPIRY_MARGIN) -> None:
+        if max_entries < 1:
+            raise ValueError("max_entries must be >= 1.")
+
+        self.path = pathlib.Path(path) if path is not None else None
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Dict]]" = \
+            OrderedDict()
+
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+    def __repr__(self):
+        return (f"{type(self).__name__}(path={self.path!r}, "
+                f"entries={len(self._entries)})")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(asin: str, device: str) -> Tuple[str, str]:
+        return asin.upper(), device
+
+    def _file(self, key: Tuple[str, str]) -> pathlib.Path:
+        asin, device = key
+        return self.path / f"{device}_{asin}.json"
+
+    def _remember(self, key: Tuple[str, str], expiry: float,
+                  manifest: Dict) -> None:
+        with self._lock:
+            self._entries[key] = (expiry, manifest)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self,
+              key: Tuple[str, str],
+              parse: Callable[[Dict], Dict]) -> Optional[Tuple[float, Dict]]:
+        file = self._file(key)
+        try:
+            entry = json.loads(file.read_text())
+            expiry = float(entry["expires"])
+            raw = entry["manifest"]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            logger.warning(f"ignore invalid cache file {file}: {exc!r}")
+            return None
+
+        if expiry <= time.time():
+            _unlink(file)
+            return None
+        return expiry, parse(raw)
+
+    def get(self,
+            asin: str,
+            device: str,
+            parse: Callable[[Dict], Dict]) -> Optional[Dict]:
+        """Returns a copy of the cached manifest or ``None``.
+
+        Args:
+            asin: The ASIN of the book.
+            device: The device serial number.
+            parse: Parses a raw manifest loaded from disk. Usually
+                :func:`kindle.api._parse_manifest`.
+        """
+        key = self._key(asin, device)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None and self.path is not None:
+            entry = self._load(key, parse)
+            if entry is not None:
+                self._remember(key, *entry)
+
+        if entry is None:
+            return None
+
+        expiry, manifest = entry
+        if expiry <= time.time():
+            logger.debug(f"cached manifest for {key[0]} expired")
+            self.invalidate(asin, device)
+            return None
+
+        logger.debug(f"manifest cache hit for {key[0]}")
+        # callers may modify the manifest, the cached one stays untouched
+        return copy.deepcopy(manifest)
+
+    def put(self, asin: str, device: str, raw: Dict, manifest: Dict) -> None:
+        """Caches a manifest.
+
+        Args:
+            asin: The ASIN of the book.
+            device: The device serial number.
+            raw: The raw JSON response. Only stored on disk.
+            manifest: The parsed manifest.
+        """
+        expiry = manifest_expiry(manifest, self.max_age, self.margin)
+        if expiry <= time.time():
+            logger.debug(f"manifest for {asin} already expired, not cached")
+            return
+
+        key = self._key(asin, device)
+        self._remember(key, expiry, copy.deepcopy(manifest))
+
+        if self.path is not None:
+            file = self._file(key)
+            tmp = file.with_name(file.name + ".tmp")
+            tmp.write_text(json.dumps({"expires": expiry, "manifest": raw}))
+            os.replace(tmp, file)
+
+    def invalidate(self, asin: str, device: Optional[str] = None) -> None:
+        """Removes the cached manifests of `asin`.
+
+        Args:
+            asin: The ASIN of the book.
+            device: The device serial number. Defaults to all devices.
+        """
+        asin = asin.upper()
+        with self._lock:
+            keys = [k for k in self._entries
+                    if k[0] == asin and device in (None, k[1])]
+            for key in keys:
+                del self._entries[key]
+
+        if self.path is not None:
+            pattern = f"{device or '*'}_{asin}.json"
+            for file in self.path.glob(pattern):
+                _unlink(file)
+
+    def clear(self) -> None:
+        """Removes all cached manifests."""
+        with self._lock:
+            self._entries.clear()
+
+        if self.path is not None:
+            for file in self.path.glob("*.json"):
+                _unlink(file)
+
+
+# max. total size of cached response bodies in memory
+RESPONSE_CACHE_SIZE = 16 * 1024 * 1024
+# max. total size of cached response bodies on disk
+RESPONSE_DISK_CACHE_SIZE = 128 * 1024 * 1024
+# response headers kept with a cached body, `content-encoding` and
+# `content-length` are dropped because the body is stored decoded
+_CACHED_HEADERS = (
+    "cache-control", "content-type", "date", "etag", "expires",
+    "last-modified"
+)
+
+CacheEntry = namedtuple(
+    "CacheEntry", ["url", "headers", "content", "expires"])
+CacheEntry.__doc__ = """A cached response.
+
+`headers` is a dict with the cached response headers, `content` the decoded
+body and `expires` the unix timestamp until the entry is fresh.
+"""
+
+
+def _parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    directives = {}
+    for directive in (value or "").split(","):
+        name, _, arg = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+    return directives
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _freshness_lifetime(headers: Dict[str, str],
+                        directives: Dict[str, Optional[str]]) -> float:
+    # RFC 7234, section 4.2.1; a private cache ignores `s-maxage`
+    if "no-cache" in directives:
+        return 0
+    if "max-age" in directives:
+        try:
+            lifetime = int(directives["max-age"])
+        except (TypeError, ValueError):
+            return 0
+        try:
+            lifetime -= int(headers.get("age", 0))
+        except ValueError:
+            pass
+        return max(lifetime, 0)
+
+    expires = _http_date(headers.get("expires"))
+    if expires is not None:
+        date = _http_date(headers.get("date")) or time.time()
+        return max(expires - date, 0)
+    return 0
+
+
+def is_fresh(entry: CacheEntry) -> bool:
+    """Returns ``True`` if `entry` can be used without revalidation."""
+    return entry.expires > time.time()
+
+
+class ResponseCache:
+    """A private HTTP cache for small JSON and XML responses.
+
+    Responses are kept in a least recently used cache in memory and
+    optionally on disk. Both are bounded by the total size of the cached
+    bodies.
+
+    A fresh entry is returned without a request. A stale entry with an
+    ``ETag`` or ``Last-Modified`` validator is revalidated with a
+    conditional request. A ``304 Not Modified`` response then reuses the
+    cached body. ``Cache-Control: no-store`` responses are never cached,
+    ``no-cache`` responses are revalidated on every use.
+
+    Entries are keyed by device serial number and url, because most
+    responses are specific to the account. The :attr:`hits`,
+    :attr:`revalidated` and :attr:`misses` counters show how many requests
+    were answered from the cache, by a ``304`` response or by a full body.
+
+    Args:
+        path: The directory for the disk cache. Defaults to memory only.
+        max_size: The max. total size of the bodies in memory in bytes.
+        max_disk_size: The max. total size of the bodies on disk in bytes.
+
+    Example:
+        >>> cache = ResponseCache("responses")
+        >>> news = kindle.api.get_news(client, cache=cache)
+    """
+
+    def __init__(self,
+                 path: Optional[Union[str, pathlib.Path]] = None,
+                 max_size: int = RESPONSE_CACHE_SIZE,
+                 max_disk_size: int = RESPONSE_DISK_CACHE_SIZE) -> None:
+        self.path = pathlib.Path(path) if path is not None else None
+        self.max_size = max_size
+        self.max_disk_size = max_disk_size
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._size = 0
+        self._disk_size = 0
+
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._disk_size = sum(
+                f.stat().st_size for f in self.path.glob("*.cache"))
+
+    def __repr__(self):
+        return (f"{type(self).__name__}(path={self.path!r}, "
+                f"entries={len(self._entries)}, size={self._size})")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(device: str, url: str, params: Optional[Dict] = None) -> str:
+        """Returns the cache key of a request."""
+        url = str(httpx.URL(url, params=params))
+        return hashlib.sha256(f"{device} {url}".encode()).hexdigest()
+
+    def _file(self, key: str) -> pathlib.Path:
+        return self.path / f"{key}.cache"
+
+    def _remember(self, key: str, entry: CacheEntry) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old.content)
+            self._entries[key] = entry
+            self._size += len(entry.content)
+            while self._size > self.max_size and len(self._entries) > 1:
+                _, dropped = self._entries.popitem(last=False)
+                self._size -= len(dropped.content)
+
+    def _load(self, key: str) -> Optional[CacheEntry]:
+        # file format: the JSON metadata in the first line, then the body
+        file = self._file(key)
+        try:
+            data = file.read_bytes()
+            # the file was used, keep it in the disk cache
+            os.utime(file)
+            meta, _, content = data.partition(b"\n")
+            meta = json.loads(meta)
+            return CacheEntry(
+                meta["url"], meta["headers"], content, meta["expires"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            logger.warning(f"ignore invalid cache file {file}: {exc!r}")
+            return None
+
+    def _save(self, key: str, entry: CacheEntry) -> None:
+        file = self._file(key)
+        meta = {
+            "url": entry.url, "headers": entry.headers,
+            "expires": entry.expires
+        }
+        data = json.dumps(meta).encode() + b"\n" + entry.content
+        tmp = file.with_name(file.name + ".tmp")
+        tmp.write_bytes(data)
+
+        with self._lock:
+            try:
+                self._disk_size -= file.stat().st_size
+            except FileNotFoundError:
+                pass
+            os.replace(tmp, file)
+            self._disk_size += len(data)
+            if self._disk_size > self.max_disk_size:
+                self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        # removes the least recently used files down to 3/4 of the limit
+        files = sorted(
+            ((f.stat(), f) for f in self.path.glob("*.cache")),
+            key=lambda x: x[0].st_mtime)
+        self._disk_size = sum(stat.st_size for stat, _ in files)
+        for stat, file in files:
+            if self._disk_size <= self.max_disk_size * 3 // 4:
+                break
+            _unlink(file)
+            self._disk_size -= stat.st_size
+
+    def lookup(self, key: str) -> Optional[CacheEntry]:
+        """Returns the cached entry for `key` or ``None``."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None and self.path is not None:
+            entry = self._load(key)
+            if entry is not None:
+                self._remember(key, entry)
+        return entry
+
+    @staticmethod
+    def conditional_headers(entry: Optional[CacheEntry]) -> Dict[str, str]:
+        """Returns the validator headers to revalidate `entry`."""
+        headers = {}
+        if entry is not None:
+            if "etag" in entry.headers:
+                headers["If-None-Match"] = entry.headers["etag"]
+            if "last-modified" in entry.headers:
+                headers["If-Modified-Since"] = entry.headers["last-modified"]
+        return headers
+
+    def response(self, entry: CacheEntry) -> httpx.Response:
+        """Builds a ``200`` response from a cached entry."""
+        with self._lock:
+            self.hits += 1
+        return httpx.Response(
+            200, headers=entry.headers, content=entry.content,
+            request=httpx.Request("GET", entry.url))
+
+    def update(self,
+               key: str,
+               entry: Optional[CacheEntry],
+               response: httpx.Response) -> httpx.Response:
+        """Updates the cache with a (conditional) response.
+
+        Args:
+            key: The cache key of the request.
+            entry: The stale entry which was revalidated, if any.
+            response: The received response. Must be read already.
+
+        Returns:
+            The response to use. For a ``304`` response to a revalidation,
+            this is the cached entry as a ``200`` response.
+        """
+        headers = {k: v for k, v in response.headers.items()
+                   if k in _CACHED_HEADERS}
+        directives = _parse_cache_control(headers.get("cache-control"))
+
+        if response.status_code == 304 and entry is not None:
+            merged = dict(entry.headers)
+            merged.update(headers)
+            lifetime = _freshness_lifetime(
+                merged, _parse_cache_control(merged.get("cache-control")))
+            entry = entry._replace(
+                headers=merged, expires=time.time() + lifetime)
+            with self._lock:
+                self.revalidated += 1
+            logger.debug(f"revalidated cached response for {entry.url}")
+            self._store(key, entry)
+            return httpx.Response(
+                200, headers=entry.headers, content=entry.content,
+                request=response.request)
+
+        with self._lock:
+            self.misses += 1
+
+        if response.status_code != 200 or "no-store" in directives:
+            return response
+
+        lifetime = _freshness_lifetime(headers, directives)
+        has_validator = "etag" in headers or "last-modified" in headers
+        if lifetime <= 0 and not has_validator:
+            return response
+
+        entry = CacheEntry(str(response.request.url), headers,
+                           response.content, time.time() + lifetime)
+        if len(entry.content) <= self.max_size:
+            self._store(key, entry)
+        return response
+
+    def _store(self, key: str, entry: CacheEntry) -> None:
+        self._remember(key, entry)
+        if self.path is not None:
+            self._save(key, entry)
+
+    def invalidate(self, key: str) -> None:
+        """Removes the cached entry for `key`."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= len(entry.content)
+
+        if self.path is not None:
+            file = self._file(key)
+            with self._lock:
+                try:
+                    self._disk_size -= file.stat().st_size
+                except FileNotFoundError:
+                    return
+                _unlink(file)
+
+    def clear(self) -> None:
+        """Removes all cached responses."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+            if self.path is not None:
+                for file in self.path.glob("*.cache"):
+                    _unlink(file)
+                self._disk_size = 0
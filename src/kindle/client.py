@@ -0,0 +1,895 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from email.utils import parsedate_to_datetime
+from typing import (
+    Any, Dict, FrozenSet, Iterator, List, Optional, Tuple, TYPE_CHECKING
+)
+
+import httpcore
+import httpx
+
+from .exceptions import (
+    NetworkError, NotResponding, RequestError, raise_for_status
+)
+from .metrics import (
+    UNKNOWN_ENDPOINT, Metrics, RequestRecord, contextvars_available,
+    current_endpoint
+)
+
+if contextvars_available:
+    from contextvars import ContextVar
+
+if TYPE_CHECKING:
+    import kindle
+
+
+logger = logging.getLogger("kindle.client")
+
+DEFAULT_LIMITS = httpx.Limits(max_connections=100,
+                              max_keepalive_connections=20)
+DEFAULT_TIMEOUT = httpx.Timeout(timeout=5.0)
+KEEPALIVE_EXPIRY = 5.0
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset(
+    {"DELETE", "GET", "HEAD", "OPTIONS", "PUT", "TRACE"})
+
+
+def _origin_to_host(origin: Tuple[bytes, bytes, int]) -> str:
+    scheme, host, port = origin[:3]
+    return host.decode("ascii")
+
+
+class PoolStats:
+    """Thread-safe counters about the connection reuse per host.
+
+    A request counts as reused, if it was sent over a connection which
+    already existed in the pool.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._requests: Dict[str, int] = {}
+        self._connections: Dict[str, int] = {}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.as_dict()})"
+
+    def _record_request(self, host: str) -> None:
+        with self._lock:
+            self._requests[host] = self._requests.get(host, 0) + 1
+
+    def _record_connection(self, host: str) -> None:
+        with self._lock:
+            self._connections[host] = self._connections.get(host, 0) + 1
+
+    def as_dict(self) -> Dict[str, Dict[str, int]]:
+        """Returns the number of requests, opened connections and reused
+        connections for every host.
+        """
+        with self._lock:
+            stats = {}
+            for host, requests in self._requests.items():
+                connections = self._connections.get(host, 0)
+                stats[host] = {
+                    "requests": requests,
+                    "connections": connections,
+                    "reused": max(requests - connections, 0)
+                }
+            return stats
+
+    @property
+    def requests(self) -> int:
+        with self._lock:
+            return sum(self._requests.values())
+
+    @property
+    def connections(self) -> int:
+        with self._lock:
+            return sum(self._connections.values())
+
+    @property
+    def reuse_ratio(self) -> float:
+        """The share of requests which reused an existing connection."""
+        requests = self.requests
+        if not requests:
+            return 0.0
+        return max(requests - self.connections, 0) / requests
+
+    def reset(self) -> None:
+        with self._lock:
+            self._requests.clear()
+            self._connections.clear()
+
+
+if contextvars_available:
+    # collects the connect times of the request sent by the current thread
+    # or task, see `_TimedBackend`
+    _connect_times: "ContextVar[Optional[List[float]]]" = ContextVar(
+        "kindle_connect_times", default=None)
+
+
+def _add_connect_time(seconds: float) -> None:
+    times = _connect_times.get()
+    if times is not None:
+        times.append(seconds)
+
+
+class _TimedBackend:
+    # wraps the socket backend of a connection pool and measures the time
+    # to open a new connection. Name resolution happens inside the backend,
+    # so it is part of the connect time. The socket backend of a pool is an
+    # httpcore 0.12 detail, which is why setup.py pins httpcore.
+    def __init__(self, backend) -> None:
+        self._backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self._backend, name)
+
+    def open_tcp_stream(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._backend.open_tcp_stream(*args, **kwargs)
+        finally:
+            _add_connect_time(time.perf_counter() - start)
+
+    def open_uds_stream(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._backend.open_uds_stream(*args, **kwargs)
+        finally:
+            _add_connect_time(time.perf_counter() - start)
+
+
+class _AsyncTimedBackend(_TimedBackend):
+    async def open_tcp_stream(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self._backend.open_tcp_stream(*args, **kwargs)
+        finally:
+            _add_connect_time(time.perf_counter() - start)
+
+    async def open_uds_stream(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self._backend.open_uds_stream(*args, **kwargs)
+        finally:
+            _add_connect_time(time.perf_counter() - start)
+
+
+class _CountingConnectionPool(httpcore.SyncConnectionPool):
+    def __init__(self, *, stats: PoolStats, timing: bool = False,
+                 **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._stats = stats
+        self._timing = timing
+        if timing and contextvars_available:
+            self._backend = _TimedBackend(self._backend)
+
+    def _create_connection(self, origin):
+        self._stats._record_connection(_origin_to_host(origin))
+        return super()._create_connection(origin)
+
+    def request(self, method, url, headers=None, stream=None, ext=None):
+        self._stats._record_request(_origin_to_host(url))
+        if not self._timing:
+            return super().request(
+                method, url, headers=headers, stream=stream, ext=ext)
+
+        connect_times = []
+        token = None
+        if contextvars_available:
+            token = _connect_times.set(connect_times)
+        start = time.perf_counter()
+        try:
+            status, headers, stream, ext = super().request(
+                method, url, headers=headers, stream=stream, ext=ext)
+        finally:
+            if token is not None:
+                _connect_times.reset(token)
+        ext["ttfb"] = time.perf_counter() - start
+        ext["connect_time"] = sum(connect_times)
+        return status, headers, stream, ext
+
+
+class _AsyncCountingConnectionPool(httpcore.AsyncConnectionPool):
+    def __init__(self, *, stats: PoolStats, timing: bool = False,
+                 **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._stats = stats
+        self._timing = timing
+        if timing and contextvars_available:
+            self._backend = _AsyncTimedBackend(self._backend)
+
+    def _create_connection(self, origin):
+        self._stats._record_connection(_origin_to_host(origin))
+        return super()._create_connection(origin)
+
+    async def arequest(self, method, url, headers=None, stream=None,
+                       ext=None):
+        self._stats._record_request(_origin_to_host(url))
+        if not self._timing:
+            return await super().arequest(
+                method, url, headers=headers, stream=stream, ext=ext)
+
+        connect_times = []
+        token = None
+        if contextvars_available:
+            token = _connect_times.set(connect_times)
+        start = time.perf_counter()
+        try:
+            status, headers, stream, ext = await super().arequest(
+                method, url, headers=headers, stream=stream, ext=ext)
+        finally:
+            if token is not None:
+                _connect_times.reset(token)
+        ext["ttfb"] = time.perf_counter() - start
+        ext["connect_time"] = sum(connect_times)
+        return status, headers, stream, ext
+
+
+class _HostLimiter:
+    """Limits the number of requests in flight per host."""
+
+    def __init__(self, limit: int, semaphore_class) -> None:
+        if limit < 1:
+            raise ValueError("max_requests_per_host must be >= 1.")
+        self.limit = limit
+        self._semaphore_class = semaphore_class
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, Any] = {}
+
+    def __call__(self, url: Any) -> Any:
+        host = httpx.URL(url).host
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._semaphore_class(self.limit)
+                self._semaphores[host] = semaphore
+            return semaphore
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    # the header is either a number of seconds or a HTTP date
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _transport_error(exc: httpx.TransportError) -> RequestError:
+    if isinstance(exc, httpx.TimeoutException):
+        return NotResponding()
+    return NetworkError()
+
+
+class RetryPolicy:
+    """Describes when and how often a client retries a failed request.
+
+    Idempotent requests are retried after a timeout, a network error or a
+    response with a status in `statuses`. A request which failed to connect
+    is retried regardless of its method, because it was never sent.
+
+    The n-th retry waits a random time between 0 and
+    ``min(max_backoff, backoff * 2 ** n)`` seconds. A ``Retry-After``
+    header overrides this. If it asks to wait longer than
+    `max_retry_after` seconds, the error is raised immediately.
+
+    Retries are limited by a budget per client. Every request adds
+    `budget_ratio` tokens up to `budget_burst`, every retry takes one. So
+    a failing service gets at most `budget_ratio` retries per request in
+    the long run instead of `max_retries`.
+
+    Args:
+        max_retries: The max. number of retries per request.
+        backoff: The base delay in seconds.
+        max_backoff: The max. delay in seconds.
+        max_retry_after: The max. accepted ``Retry-After`` in seconds.
+        budget_ratio: The retry tokens added per request.
+        budget_burst: The max. number of retry tokens.
+        statuses: The response status codes to retry.
+        methods: The idempotent request methods.
+    """
+
+    def __init__(self,
+                 max_retries: int = 3,
+                 backoff: float = 0.5,
+                 max_backoff: float = 30.0,
+                 max_retry_after: float = 120.0,
+                 budget_ratio: float = 0.2,
+                 budget_burst: float = 10.0,
+                 statuses: FrozenSet[int] = RETRY_STATUSES,
+                 methods: FrozenSet[str] = IDEMPOTENT_METHODS) -> None:
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.budget_ratio = budget_ratio
+        self.budget_burst = budget_burst
+        self.statuses = frozenset(statuses)
+        self.methods = frozenset(m.upper() for m in methods)
+
+    def __repr__(self):
+        return (f"{type(self).__name__}(max_retries={self.max_retries}, "
+                f"backoff={self.backoff}, budget_ratio={self.budget_ratio})")
+
+
+DEFAULT_RETRY = RetryPolicy()
+NO_RETRY = RetryPolicy(max_retries=0)
+
+
+class _Retrier:
+    # the retry decisions and the retry budget of a single client
+    def __init__(self, policy: RetryPolicy) -> None:
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._tokens = policy.budget_burst
+        self.retries = 0
+
+    def started(self) -> None:
+        with self._lock:
+            self._tokens = min(self._tokens + self.policy.budget_ratio,
+                               self.policy.budget_burst)
+
+    def delay(self,
+              method: str,
+              attempt: int,
+              response: Optional[httpx.Response] = None,
+              exc: Optional[Exception] = None) -> Optional[float]:
+        """Returns the delay before the next attempt or ``None``."""
+        policy = self.policy
+        if attempt >= policy.max_retries:
+            return None
+
+        idempotent = method.upper() in policy.methods
+        delay = None
+        if exc is not None:
+            if isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout)):
+                pass
+            elif not idempotent or not isinstance(
+                    exc, (httpx.TimeoutException, httpx.NetworkError)):
+                return None
+        else:
+            if not idempotent or response.status_code not in policy.statuses:
+                return None
+            delay = _retry_after(response)
+            if delay is not None and delay > policy.max_retry_after:
+                return None
+
+        with self._lock:
+            if self._tokens < 1:
+                logger.warning("retry budget exhausted, not retrying")
+                return None
+            self._tokens -= 1
+            self.retries += 1
+
+        if delay is None:
+            delay = random.uniform(
+                0, min(policy.max_backoff, policy.backoff * 2 ** attempt))
+        return delay
+
+
+def _retry_reason(response: Optional[httpx.Response],
+                  exc: Optional[Exception]) -> str:
+    if exc is not None:
+        return repr(exc)
+    return f"status {response.status_code}"
+
+
+def _request_record(method: str,
+                    url: Any,
+                    response: Optional[httpx.Response],
+                    retries: int,
+                    start: float) -> RequestRecord:
+    elapsed = time.perf_counter() - start
+    connect_time = ttfb = transfer_time = 0.0
+    status = None
+    size = 0
+    if response is not None:
+        status = response.status_code
+        size = response.num_bytes_downloaded
+        connect_time = response.ext.get("connect_time", 0.0)
+        ttfb = response.ext.get("ttfb", 0.0)
+        try:
+            transfer_time = max(response.elapsed.total_seconds() - ttfb, 0.0)
+        except AttributeError:
+            # the response was not closed
+            pass
+
+    return RequestRecord(
+        endpoint=current_endpoint() or UNKNOWN_ENDPOINT,
+        method=method.upper(),
+        host=httpx.URL(url).host,
+        status=status,
+        retries=retries,
+        connect_time=connect_time,
+        ttfb=ttfb,
+        transfer_time=transfer_time,
+        elapsed=elapsed,
+        bytes=size)
+
+
+def _create_pool(pool_class, stats: PoolStats, limits: httpx.Limits,
+                 http2: bool, verify, cert, trust_env: bool,
+                 timing: bool = False):
+    ssl_context = httpx.create_ssl_context(
+        verify=verify, cert=cert, trust_env=trust_env)
+    return pool_class(
+        stats=stats,
+        timing=timing,
+        ssl_context=ssl_context,
+        max_connections=limits.max_connections,
+        max_keepalive_connections=limits.max_keepalive_connections,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+        http2=http2)
+
+
+class KindleClient:
+    """A long-lived client with a connection pool for the Kindle API.
+
+    All functions in :mod:`kindle.api` accept a ``KindleClient`` instead of
+    an :class:`~kindle.auth.Authenticator`. Connections to the same host
+    are kept alive and reused between the calls. A client is thread-safe and
+    should be closed after use.
+
+    Args:
+        auth: The Kindle Authenticator.
+        limits: The connection pool limits. Connections are pooled per host.
+        timeout: The default timeout for requests.
+        http2: If ``True``, use HTTP/2 where available.
+        verify: SSL certificates used to verify the identity of requested
+            hosts. See :mod:`httpx` for more details.
+        cert: An optional SSL client certificate.
+        trust_env: If ``True``, use environment variables for configuration.
+        max_requests_per_host: If not ``None``, the max. number of requests
+            in flight to the same host. Further requests wait for a free
+            slot. A streamed response holds its slot until it is closed.
+        retry: When and how often failed requests are retried. Use
+            :data:`NO_RETRY` to disable retries.
+        metrics: If given, the timings, sizes, statuses and retries of all
+            requests are recorded there. See :mod:`kindle.metrics`.
+        **kwargs: Keyword arguments are passed to :class:`httpx.Client`.
+
+    Error responses are raised as :class:`~kindle.exceptions.StatusError`
+    subclasses once all retries failed. Timeouts are raised as
+    :class:`~kindle.exceptions.NotResponding`, other transport errors as
+    :class:`~kindle.exceptions.NetworkError`.
+
+    Example:
+        >>> with KindleClient(auth) as client:
+        ...     library = kindle.api.get_library(client)
+        ...     manifest = kindle.api.get_manifest_ebook(client, asin)
+        ...     print(client.pool_stats)
+    """
+
+    def __init__(self,
+                 auth: "kindle.Authenticator",
+                 *,
+                 limits: httpx.Limits = DEFAULT_LIMITS,
+                 timeout: httpx.Timeout = DEFAULT_TIMEOUT,
+                 http2: bool = False,
+                 verify=True,
+                 cert=None,
+                 trust_env: bool = True,
+                 max_requests_per_host: Optional[int] = None,
+                 retry: RetryPolicy = DEFAULT_RETRY,
+                 metrics: Optional[Metrics] = None,
+                 **kwargs) -> None:
+        self._auth = auth
+        self._pool_stats = PoolStats()
+        self._retrier = _Retrier(retry)
+        self._metrics = metrics
+        self._host_limiter = None
+        if max_requests_per_host is not None:
+            self._host_limiter = _HostLimiter(
+                max_requests_per_host, threading.BoundedSemaphore)
+
+        transport = _create_pool(
+            _CountingConnectionPool, self._pool_stats, limits, http2,
+            verify, cert, trust_env, timing=metrics is not None)
+
+        self._session = httpx.Client(
+            auth=auth,
+            timeout=timeout,
+            transport=transport,
+            trust_env=trust_env,
+            **kwargs)
+        logger.debug(f"created client with {limits}")
+
+    def __enter__(self) -> "KindleClient":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __repr__(self):
+        return f"{type(self).__name__}(closed={self.is_closed})"
+
+    @property
+    def auth(self) -> "kindle.Authenticator":
+        return self._auth
+
+    @property
+    def session(self) -> httpx.Client:
+        """The underlying :class:`httpx.Client`."""
+        return self._session
+
+    @property
+    def pool_stats(self) -> PoolStats:
+        """Statistics about the connection reuse per host."""
+        return self._pool_stats
+
+    @property
+    def is_closed(self) -> bool:
+        return self._session.is_closed
+
+    @property
+    def retries(self) -> int:
+        """The number of retries done by this client."""
+        return self._retrier.retries
+
+    @property
+    def metrics(self) -> Optional[Metrics]:
+        return self._metrics
+
+    def _send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        if self._host_limiter is None:
+            return self._session.request(method, url, **kwargs)
+
+        with self._host_limiter(url):
+            return self._session.request(method, url, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Sends a request with the pooled session.
+
+        Failed requests are retried as described by the client's
+        :class:`RetryPolicy`. Keyword arguments are passed to
+        :meth:`httpx.Client.request`.
+        """
+        self._retrier.started()
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            r = exc = None
+            try:
+                r = self._send(method, url, **kwargs)
+            except httpx.TransportError as e:
+                exc = e
+
+            delay = self._retrier.delay(method, attempt, r, exc)
+            if delay is None:
+                if self._metrics is not None:
+                    self._metrics.observe(
+                        _request_record(method, url, r, attempt, start))
+                if exc is not None:
+                    raise _transport_error(exc) from exc
+                raise_for_status(r)
+                return r
+
+            attempt += 1
+            logger.warning(f"{method} {url} failed with "
+                           f"{_retry_reason(r, exc)}, retry {attempt} "
+                           f"in {delay:.2f}s")
+            if r is not None:
+                r.close()
+            time.sleep(delay)
+
+    def get(self, url: str, **kwargs) -> httpx.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> httpx.Response:
+        return self.request("POST", url, **kwargs)
+
+    @contextmanager
+    def stream(self, method: str, url: str,
+               **kwargs) -> Iterator[httpx.Response]:
+        """Sends a request and streams the response body.
+
+        Must be used as a context manager. Only sending the request and
+        receiving the response headers is retried, not reading the body.
+        Keyword arguments are passed to :meth:`httpx.Client.stream`.
+        """
+        self._retrier.started()
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            with ExitStack() as stack:
+                if self._host_limiter is not None:
+                    stack.enter_context(self._host_limiter(url))
+
+                r = exc = None
+                try:
+                    r = stack.enter_context(
+                        self._session.stream(method, url, **kwargs))
+                except httpx.TransportError as e:
+                    exc = e
+
+                delay = self._retrier.delay(method, attempt, r, exc)
+                if delay is None:
+                    if self._metrics is not None:
+                        stack.callback(self._observe_stream,
+                                       method, url, r, attempt, start)
+                    if exc is not None:
+                        raise _transport_error(exc) from exc
+                    if r.status_code >= 400:
+                        r.read()
+                        raise_for_status(r)
+                    yield r
+                    return
+
+            attempt += 1
+            logger.warning(f"{method} {url} failed with "
+                           f"{_retry_reason(r, exc)}, retry {attempt} "
+                           f"in {delay:.2f}s")
+            time.sleep(delay)
+
+    def _observe_stream(self, method: str, url: str,
+                        response: Optional[httpx.Response],
+                        attempt: int, start: float) -> None:
+        # runs before the stream context exits, closing sets `elapsed`
+        if response is not None:
+            response.close()
+        self._metrics.observe(
+            _request_record(method, url, response, attempt, start))
+
+    def close(self) -> None:
+        """Closes all pooled connections."""
+        self._session.close()
+        logger.debug(f"closed client, pool stats: {self._pool_stats}")
+
+
+class _AsyncStream:
+    # retries until the response headers were received, then holds the
+    # host slot as long as the streamed response is open
+    def __init__(self, client: "AsyncKindleClient", method: str, url: str,
+                 kwargs: Dict[str, Any]) -> None:
+        self._client = client
+        self._method = method
+        self._url = url
+        self._kwargs = kwargs
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._stream: Any = None
+        self._record: Optional[Tuple] = None
+
+    async def __aenter__(self) -> httpx.Response:
+        client = self._client
+        client._retrier.started()
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            if client._host_limiter is not None:
+                self._semaphore = client._host_limiter(self._url)
+                await self._semaphore.acquire()
+
+            r = exc = None
+            try:
+                self._stream = client._session.stream(
+                    self._method, self._url, **self._kwargs)
+                r = await self._stream.__aenter__()
+            except httpx.TransportError as e:
+                self._stream = None
+                self._release()
+                exc = e
+            except BaseException:
+                self._stream = None
+                self._release()
+                raise
+
+            delay = client._retrier.delay(self._method, attempt, r, exc)
+            if delay is None:
+                if client._metrics is not None:
+                    self._record = (r, attempt, start)
+                if exc is not None:
+                    self._observe()
+                    raise _transport_error(exc) from exc
+                if r.status_code >= 400:
+                    try:
+                        await r.aread()
+                        raise_for_status(r)
+                    finally:
+                        await self.__aexit__(None, None, None)
+                return r
+
+            if r is not None:
+                await self.__aexit__(None, None, None)
+            attempt += 1
+            logger.warning(f"{self._method} {self._url} failed with "
+                           f"{_retry_reason(r, exc)}, retry {attempt} "
+                           f"in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def __aexit__(self, *args) -> None:
+        stream, self._stream = self._stream, None
+        try:
+            if stream is not None:
+                await stream.__aexit__(*args)
+        finally:
+            self._release()
+            self._observe()
+
+    def _observe(self) -> None:
+        record, self._record = self._record, None
+        if record is not None:
+            self._client._metrics.observe(
+                _request_record(self._method, self._url, *record))
+
+    def _release(self) -> None:
+        if self._semaphore is not None:
+            self._semaphore.release()
+            self._semaphore = None
+
+
+class AsyncKindleClient:
+    """The asynchronous counterpart of :class:`KindleClient`.
+
+    All coroutines in :mod:`kindle.async_api` accept an
+    ``AsyncKindleClient`` instead of an :class:`~kindle.auth.Authenticator`.
+    Many requests can be in flight at the same time on a single event loop.
+    The client must be closed after use with :meth:`aclose`.
+
+    Args:
+        auth: The Kindle Authenticator.
+        limits: The connection pool limits. Connections are pooled per host.
+        timeout: The default timeout for requests.
+        http2: If ``True``, use HTTP/2 where available.
+        verify: SSL certificates used to verify the identity of requested
+            hosts. See :mod:`httpx` for more details.
+        cert: An optional SSL client certificate.
+        trust_env: If ``True``, use environment variables for configuration.
+        max_requests_per_host: If not ``None``, the max. number of requests
+            in flight to the same host.
+        retry: When and how often failed requests are retried. See
+            :class:`KindleClient`.
+        metrics: If given, all requests are recorded there.
+        **kwargs: Keyword arguments are passed to :class:`httpx.AsyncClient`.
+
+    Example:
+        >>> async with AsyncKindleClient(auth) as client:
+        ...     library = await kindle.async_api.get_library(client)
+    """
+
+    def __init__(self,
+                 auth: "kindle.Authenticator",
+                 *,
+                 limits: httpx.Limits = DEFAULT_LIMITS,
+                 timeout: httpx.Timeout = DEFAULT_TIMEOUT,
+                 http2: bool = False,
+                 verify=True,
+                 cert=None,
+                 trust_env: bool = True,
+                 max_requests_per_host: Optional[int] = None,
+                 retry: RetryPolicy = DEFAULT_RETRY,
+                 metrics: Optional[Metrics] = None,
+                 **kwargs) -> None:
+        self._auth = auth
+        self._pool_stats = PoolStats()
+        self._retrier = _Retrier(retry)
+        self._metrics = metrics
+        self._host_limiter = None
+        if max_requests_per_host is not None:
+            self._host_limiter = _HostLimiter(
+                max_requests_per_host, asyncio.Semaphore)
+
+        transport = _create_pool(
+            _AsyncCountingConnectionPool, self._pool_stats, limits, http2,
+            verify, cert, trust_env, timing=metrics is not None)
+
+        self._session = httpx.AsyncClient(
+            auth=auth,
+            timeout=timeout,
+            transport=transport,
+            trust_env=trust_env,
+            **kwargs)
+        logger.debug(f"created async client with {limits}")
+
+    async def __aenter__(self) -> "AsyncKindleClient":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.aclose()
+
+    def __repr__(self):
+        return f"{type(self).__name__}(closed={self.is_closed})"
+
+    @property
+    def auth(self) -> "kindle.Authenticator":
+        return self._auth
+
+    @property
+    def session(self) -> httpx.AsyncClient:
+        """The underlying :class:`httpx.AsyncClient`."""
+        return self._session
+
+    @property
+    def pool_stats(self) -> PoolStats:
+        """Statistics about the connection reuse per host."""
+        return self._pool_stats
+
+    @property
+    def is_closed(self) -> bool:
+        return self._session.is_closed
+
+    @property
+    def retries(self) -> int:
+        """The number of retries done by this client."""
+        return self._retrier.retries
+
+    @property
+    def metrics(self) -> Optional[Metrics]:
+        return self._metrics
+
+    async def _send(self, method: str, url: str,
+                    **kwargs) -> httpx.Response:
+        if self._host_limiter is None:
+            return await self._session.request(method, url, **kwargs)
+
+        async with self._host_limiter(url):
+            return await self._session.request(method, url, **kwargs)
+
+    async def request(self, method: str, url: str,
+                      **kwargs) -> httpx.Response:
+        """Sends a request with the pooled session.
+
+        Failed requests are retried as described by the client's
+        :class:`RetryPolicy`. Keyword arguments are passed to
+        :meth:`httpx.AsyncClient.request`.
+        """
+        self._retrier.started()
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            r = exc = None
+            try:
+                r = await self._send(method, url, **kwargs)
+            except httpx.TransportError as e:
+                exc = e
+
+            delay = self._retrier.delay(method, attempt, r, exc)
+            if delay is None:
+                if self._metrics is not None:
+                    self._metrics.observe(
+                        _request_record(method, url, r, attempt, start))
+                if exc is not None:
+                    raise _transport_error(exc) from exc
+                raise_for_status(r)
+                return r
+
+            attempt += 1
+            logger.warning(f"{method} {url} failed with "
+                           f"{_retry_reason(r, exc)}, retry {attempt} "
+                           f"in {delay:.2f}s")
+            if r is not None:
+                await r.aclose()
+            await asyncio.sleep(delay)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    def stream(self, method: str, url: str, **kwargs) -> Any:
+        """Sends a request and streams the response body.
+
+        Must be used as an async context manager. Only sending the request
+        and receiving the response headers is retried, not reading the
+        body. Keyword arguments are passed to
+        :meth:`httpx.AsyncClient.stream`.
+        """
+        return _AsyncStream(self, method, url, kwargs)
+
+    async def aclose(self) -> None:
+        """Closes all pooled connections."""
+        await self._session.aclose()
+        logger.debug(f"closed async client, pool stats: {self._pool_stats}")
@@ -4,17 +4,24 @@ recode to use amazon.ion instead of the DeDRM BinaryIonParser class. Added
 support for converting a metadata file from DRMION format.
 """
 
+import copy
 import hashlib
 import hmac
 import os
 import shutil
+import struct
 import zipfile
 from io import BytesIO
+from tempfile import SpooledTemporaryFile
 from typing import TYPE_CHECKING
 
 from amazon.ion import simpleion
 from amazon.ion.symbols import shared_symbol_table, SymbolTableCatalog
-from amazon.ion.core import IonType
+from amazon.ion.core import IonEventType, IonType
+from amazon.ion.reader import blocking_reader, NEXT_EVENT, SKIP_EVENT
+from amazon.ion.reader_binary import binary_reader
+from amazon.ion.reader_managed import managed_reader
+from amazon.ion.simple_types import IonPyNull
 
 from .aescipher import aes_cbc_decrypt
 
@@ -66,16 +73,98 @@ def _assert(test, msg="Exception"):
         raise Exception(msg)
 
 
+class _FrozenSymbolTableCatalog(SymbolTableCatalog):
+    # a catalog which can't be changed after creation, safe to share
+    def __init__(self, tables=()):
+        super().__init__()
+        for table in tables:
+            super().register(table)
+
+    def register(self, table):
+        raise TypeError("catalog is read-only")
+
+
+# built once, resolving symbols only reads from the catalog
+PROTECTED_DATA_TABLE = shared_symbol_table('ProtectedData', 1, SYM_NAMES)
+PROTECTED_DATA_CATALOG = _FrozenSymbolTableCatalog([PROTECTED_DATA_TABLE])
+_EMPTY_CATALOG = _FrozenSymbolTableCatalog()
+
+
+def _ion_catalog(addprottable: bool) -> SymbolTableCatalog:
+    return PROTECTED_DATA_CATALOG if addprottable else _EMPTY_CATALOG
+
+
 def get_ion_parser(ion: bytes, single_value: bool = True,
                    addprottable: bool = False):
-    catalog = SymbolTableCatalog()
-    if addprottable:
-        table = shared_symbol_table('ProtectedData', 1, SYM_NAMES)
-        catalog.register(table)
-
+    catalog = _ion_catalog(addprottable)
     return simpleion.loads(ion, catalog=catalog, single_value=single_value)
 
 
+class _BoundedReader:
+    # exposes only the next `length` bytes of a file object
+    def __init__(self, fp, length: int) -> None:
+        self._fp = fp
+        self._remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._fp.read(size)
+        self._remaining -= len(data)
+        return data
+
+
+def _ion_value(reader, event):
+    # builds a single value starting at `event`, like simpleion.load does
+    ion_type = event.ion_type
+    if event.event_type is IonEventType.CONTAINER_START:
+        container = simpleion._FROM_ION_TYPE[ion_type].from_event(event)
+        simpleion._load(container, reader, IonEventType.CONTAINER_END,
+                        ion_type is IonType.STRUCT)
+        return container
+
+    if event.value is None or ion_type is IonType.NULL \
+            or ion_type.is_container:
+        return IonPyNull.from_event(event)
+    return simpleion._FROM_ION_TYPE[ion_type].from_event(event)
+
+
+class _IonStreamReader:
+    """Reads a binary Ion stream value by value.
+
+    Iterating yields the top-level events. A container is skipped, unless
+    :meth:`iter_values` is called for it before the next event is
+    requested. So only one value is held in memory at a time.
+    """
+
+    def __init__(self, fp, addprottable: bool = True) -> None:
+        self._reader = blocking_reader(
+            managed_reader(binary_reader(), _ion_catalog(addprottable)), fp)
+        self._skip = False
+
+    def __iter__(self):
+        reader = self._reader
+        event = reader.send(NEXT_EVENT)
+        while event.event_type is not IonEventType.STREAM_END:
+            self._skip = event.event_type is IonEventType.CONTAINER_START
+            yield event
+            if self._skip:
+                reader.send(SKIP_EVENT)
+            event = reader.send(NEXT_EVENT)
+
+    def iter_values(self):
+        """Yields the values of the current top-level container.
+
+        Must be consumed completely before the next top-level event.
+        """
+        self._skip = False
+        reader = self._reader
+        event = reader.send(NEXT_EVENT)
+        while event.event_type is not IonEventType.CONTAINER_END:
+            yield _ion_value(reader, event)
+            event = reader.send(NEXT_EVENT)
+
+
 class DrmIonVoucher:
     envelope = None
     version = None
@@ -184,49 +273,66 @@ class DrmIon:
     onvoucherrequired = None
 
     def __init__(self, ionstream, onvoucherrequired):
-        self.ion = get_ion_parser(ionstream, addprottable=True, single_value=False)
+        # the envelope is read page by page while parsing, so ionstream
+        # can be a file object which is never read completely into memory
+        if not hasattr(ionstream, "read"):
+            ionstream = BytesIO(ionstream)
+        self.ion = ionstream
         self.onvoucherrequired = onvoucherrequired        
 
     def parse(self, outpages):
-        _assert(len(self.ion) > 0, "DRMION envelope is empty")
-        _assert(self.ion[0].ion_type == IonType.SYMBOL and self.ion[0].ion_annotations[0].text == "doctype", "Expected doctype symbol")
-        _assert(self.ion[1].ion_type == IonType.LIST and self.ion[1].ion_annotations[0].text in ["com.amazon.drm.Envelope@1.0", "com.amazon.drm.Envelope@2.0"],
-                "Unknown type encountered in DRMION envelope, expected Envelope, got %s" % self.ion[1].ion_annotations[0].text)
-
-        for ion_list in self.ion:
-            if not ion_list.ion_annotations[0].text in ["com.amazon.drm.Envelope@1.0", "com.amazon.drm.Envelope@2.0"]:
+        reader = _IonStreamReader(self.ion)
+        count = 0
+        for event in reader:
+            annotation = event.annotations[0].text \
+                if event.annotations else None
+
+            if count == 0:
+                _assert(event.ion_type == IonType.SYMBOL and annotation == "doctype", "Expected doctype symbol")
+            elif count == 1:
+                _assert(event.ion_type == IonType.LIST and annotation in ["com.amazon.drm.Envelope@1.0", "com.amazon.drm.Envelope@2.0"],
+                        "Unknown type encountered in DRMION envelope, expected Envelope, got %s" % annotation)
+            count += 1
+
+            if event.event_type is not IonEventType.CONTAINER_START or \
+                    annotation not in ["com.amazon.drm.Envelope@1.0", "com.amazon.drm.Envelope@2.0"]:
                 continue
 
-            for item in ion_list:
-                if item.ion_annotations[0].text in ["com.amazon.drm.EnvelopeMetadata@1.0", "com.amazon.drm.EnvelopeMetadata@2.0"]:
-                    if item.get("encryption_voucher") is None:
-                        continue
-
-                    if self.vouchername == "":
-                        self.vouchername = item["encryption_voucher"]
-                        self.voucher = self.onvoucherrequired(self.vouchername)
-                        self.key = self.voucher.secretkey
-                        _assert(self.key is not None, "Unable to obtain secret key from voucher")
-                    else:
-                        _assert(self.vouchername == item["encryption_voucher"],
-                                "Unexpected: Different vouchers required for same file?")
-
-                elif item.ion_annotations[0].text in ["com.amazon.drm.EncryptedPage@1.0", "com.amazon.drm.EncryptedPage@2.0"]:
-                    decompress = False
-                    decrypt = True
-                    if item["cipher_text"].ion_annotations[0].text == "com.amazon.drm.Compressed@1.0":
-                        decompress = True
-                    ct = item["cipher_text"]
-                    civ = item["cipher_iv"]
-                    if ct is not None and civ is not None:
-                        self.processpage(ct, civ, outpages, decompress, decrypt)
-
-                elif item.ion_annotations[0].text in ["com.amazon.drm.PlainText@1.0", "com.amazon.drm.PlainText@2.0"]:
-                    decompress = False
-                    decrypt = False
-                    if item["data"].ion_annotations[0].text == "com.amazon.drm.Compressed@1.0":
-                        decompress = True
-                    self.processpage(item["data"], None, outpages, decompress, decrypt)
+            for item in reader.iter_values():
+                self.processitem(item, outpages)
+
+        _assert(count > 0, "DRMION envelope is empty")
+
+    def processitem(self, item, outpages):
+        if item.ion_annotations[0].text in ["com.amazon.drm.EnvelopeMetadata@1.0", "com.amazon.drm.EnvelopeMetadata@2.0"]:
+            if item.get("encryption_voucher") is None:
+                return
+
+            if self.vouchername == "":
+                self.vouchername = item["encryption_voucher"]
+                self.voucher = self.onvoucherrequired(self.vouchername)
+                self.key = self.voucher.secretkey
+                _assert(self.key is not None, "Unable to obtain secret key from voucher")
+            else:
+                _assert(self.vouchername == item["encryption_voucher"],
+                        "Unexpected: Different vouchers required for same file?")
+
+        elif item.ion_annotations[0].text in ["com.amazon.drm.EncryptedPage@1.0", "com.amazon.drm.EncryptedPage@2.0"]:
+            decompress = False
+            decrypt = True
+            if item["cipher_text"].ion_annotations[0].text == "com.amazon.drm.Compressed@1.0":
+                decompress = True
+            ct = item["cipher_text"]
+            civ = item["cipher_iv"]
+            if ct is not None and civ is not None:
+                self.processpage(ct, civ, outpages, decompress, decrypt)
+
+        elif item.ion_annotations[0].text in ["com.amazon.drm.PlainText@1.0", "com.amazon.drm.PlainText@2.0"]:
+            decompress = False
+            decrypt = False
+            if item["data"].ion_annotations[0].text == "com.amazon.drm.Compressed@1.0":
+                decompress = True
+            self.processpage(item["data"], None, outpages, decompress, decrypt)
 
     def processpage(self, ct, civ, outpages, decompress, decrypt):
         if decrypt:
@@ -246,58 +352,266 @@ class DrmIon:
             outpages.write(segment.getvalue())
             return 0
 
+        # decompress in chunks straight into outpages, so a page is never
+        # held decompressed as a whole
         decomp = lzma.LZMADecompressor(format=lzma.FORMAT_ALONE)
+        data = memoryview(msg)[1:]
         while not decomp.eof:
-            segment = decomp.decompress(msg[1:])
-            msg = b""  # Contents were internally buffered after the first call
-            outpages.write(segment)
+            segment = decomp.decompress(data, max_length=LZMA_CHUNK_SIZE)
+            data = b""  # Contents were internally buffered after the first call
+            if segment:
+                outpages.write(segment)
+            else:
+                _assert(not decomp.needs_input, "Truncated LZMA page")
+
+
+DRMION_MAGIC = b'\xeaDRMION\xee'
+VOUCHER_MAGIC = b'\xe0\x01\x00\xea'
+
+# max. bytes decompressed at once from a LZMA page
+LZMA_CHUNK_SIZE = 1024 * 1024
+
+# the fixed part of a local file header, see zipfile.structFileHeader
+_LOCAL_FILE_HEADER = struct.Struct("<4s2B4HL2L2H")
+
+
+def _strip_zip64_extra(extra: bytes) -> bytes:
+    # the zip64 extra field is written again if needed
+    fields = []
+    i = 0
+    while i + 4 <= len(extra):
+        tp, ln = struct.unpack("<HH", extra[i:i + 4])
+        if tp != 1:
+            fields.append(extra[i:i + 4 + ln])
+        i += 4 + ln
+    return b"".join(fields)
+
+
+def _raw_append_supported(zof: zipfile.ZipFile) -> bool:
+    # `_append_raw_entry` relies on these zipfile.ZipFile internals, which
+    # exist unchanged from Python 3.6 on but are not part of the api
+    return (isinstance(getattr(zof, "_writing", None), bool)
+            and isinstance(getattr(zof, "_seekable", None), bool)
+            and isinstance(getattr(zof, "_didModify", None), bool)
+            and isinstance(getattr(zof, "start_dir", None), int)
+            and isinstance(getattr(zof, "filelist", None), list)
+            and isinstance(getattr(zof, "NameToInfo", None), dict)
+            and hasattr(getattr(zof, "_lock", None), "__enter__"))
+
+
+def _append_raw_entry(zof: zipfile.ZipFile, zinfo: zipfile.ZipInfo,
+                      src) -> None:
+    """Appends an already compressed entry to an archive open for writing.
+
+    :mod:`zipfile` has no public api to add compressed data as is, so this
+    writes the local header and the data itself and registers `zinfo` like
+    :meth:`zipfile.ZipFile.writestr` does. The crc and sizes of `zinfo` must
+    be set and below the zip64 limits. Check :func:`_raw_append_supported`
+    first.
+
+    Raises:
+        ValueError: If `zof` is closed, not writable or has an open
+            writing handle.
+        RuntimeError: If the :mod:`zipfile` internals are not as expected.
+    """
+    if not _raw_append_supported(zof):
+        raise RuntimeError("zipfile internals changed, can't append raw "
+                           "entries")
+    if zof.fp is None:
+        raise ValueError("Attempt to write to ZIP archive that was already "
+                         "closed")
+    if zof.mode not in ("w", "x", "a"):
+        raise ValueError("write() requires mode 'w', 'x', or 'a'")
+    if zof._writing:
+        raise ValueError("Can't write to ZIP archive while an open writing "
+                         "handle exists")
+
+    with zof._lock:
+        if zof._seekable:
+            zof.fp.seek(zof.start_dir)
+        zinfo.header_offset = zof.fp.tell()
+        zof.fp.write(zinfo.FileHeader(zip64=False))
+        shutil.copyfileobj(src, zof.fp)
+        zof.filelist.append(zinfo)
+        zof.NameToInfo[zinfo.filename] = zinfo
+        zof.start_dir = zof.fp.tell()
+        zof._didModify = True
+
+
+def _copy_raw_entry(zif: zipfile.ZipFile, zof: zipfile.ZipFile,
+                    info: zipfile.ZipInfo) -> None:
+    # copies the compressed data of an entry as is, without decompressing,
+    # checking the crc and compressing it again. Falls back to a normal,
+    # recompressing copy if zipfile can't be used that way.
+    if info.flag_bits & 0x01 or max(info.file_size, info.compress_size) \
+            >= zipfile.ZIP64_LIMIT or not _raw_append_supported(zof):
+        with zif.open(info) as src, zof.open(info, "w") as dst:
+            shutil.copyfileobj(src, dst)
+        return
+
+    fp = zif.fp
+    fp.seek(info.header_offset)
+    header = _LOCAL_FILE_HEADER.unpack(fp.read(_LOCAL_FILE_HEADER.size))
+    if header[0] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile("Bad magic number for file header")
+    fp.seek(header[10] + header[11], os.SEEK_CUR)
+
+    zinfo = copy.copy(info)
+    zinfo.flag_bits &= ~0x08  # sizes and crc are known, no data descriptor
+    zinfo.extra = _strip_zip64_extra(info.extra)
+    _append_raw_entry(zof, zinfo, _BoundedReader(fp, info.compress_size))
 
 
 class KFXZipBook:
-    def __init__(self, infile, auth: "kindle.Authenticator"):
+    """Decrypts a kfx-zip archive.
+
+    Args:
+        infile: The kfx-zip archive.
+        auth: The Authenticator of the device the book was downloaded for.
+        spool_threshold: If not ``None``, decrypted entries are written to
+            a :class:`~tempfile.SpooledTemporaryFile`, which moves to disk
+            once it is larger than this number of bytes. Otherwise they are
+            kept in memory as ``bytes``.
+        spool_dir: The directory for spooled entries.
+    """
+
+    def __init__(self, infile, auth: "kindle.Authenticator",
+                 spool_threshold=None, spool_dir=None):
         self.infile = infile
         self.dsn = auth.device_info["device_serial_number"]
         self.voucher = None
         self.decrypted = {}
+        self.spool_threshold = spool_threshold
+        self.spool_dir = spool_dir
 
     def getPIDMetaInfo(self):
         return (None, None)
 
     def processBook(self):
         with zipfile.ZipFile(self.infile, 'r') as zf:
-            for filename in zf.namelist():
-                with zf.open(filename) as fh:
-                    data = fh.read(8)
-                    if data != b'\xeaDRMION\xee':
-                        continue
-                    data += fh.read()
-                    if self.voucher is None:
-                        self.decrypt_voucher()
-                    print("Decrypting KFX DRMION: {0}".format(filename))
-                    outfile = BytesIO()
-                    DrmIon(data[8:-8], lambda name: self.voucher).parse(outfile)
-                    outfile = outfile.getvalue()
-                    if len(outfile) > 0:
-                        self.decrypted[filename] = outfile
-                    else:
-                        print("Decrypting KFX DRMION {0} results in a length of Zero. Skip file.".format(filename))
+            for info in zf.infolist():
+                outfile = self._decrypt_drmion(zf, info)
+                if outfile is not None:
+                    self.decrypted[info.filename] = outfile
 
         if not self.decrypted:
             print("The .kfx-zip archive does not contain an encrypted DRMION file")
 
-    def decrypt_voucher(self):
-        with zipfile.ZipFile(self.infile, 'r') as zf:
-            for info in zf.infolist():
-                with zf.open(info.filename) as fh:
-                    data = fh.read(4)
-                    if data != b'\xe0\x01\x00\xea':
-                        continue
-
-                    data += fh.read()
-                    if b'ProtectedData' in data:
-                        break   # found DRM voucher
-            else:
-                raise Exception("The .kfx-zip archive contains an encrypted DRMION file without a DRM voucher")
+    def process(self, outpath):
+        """Decrypts the book and writes the result to `outpath`.
+
+        Other than :meth:`processBook` and :meth:`getFile`, the archive is
+        walked only once. The first bytes of every entry are read to
+        classify it. DRMION entries are decrypted while they are read, all
+        other entries are copied into the output as they are, without
+        decompressing and compressing them again. The voucher is decrypted
+        on the first DRMION entry. If it comes later in the archive, it is
+        looked up in advance.
+        """
+        voucher = (None, None)
+        found = False
+        with zipfile.ZipFile(self.infile, 'r') as zif, \
+                zipfile.ZipFile(outpath, 'w') as zof:
+            for info in zif.infolist():
+                outfile = None
+                with zif.open(info) as fh:
+                    magic = fh.read(8)
+                    if magic == DRMION_MAGIC:
+                        found = True
+                        if self.voucher is None:
+                            if voucher[0] is None:
+                                voucher = self._find_voucher(zif)
+                            self._decrypt_voucher_data(*voucher)
+                        outfile = self._decrypt_drmion_stream(fh, info)
+                    elif voucher[0] is None and self.voucher is None:
+                        voucher = self._voucher_candidate(info, fh, magic)
+
+                try:
+                    self._write_entry(zif, zof, info, outfile)
+                finally:
+                    if hasattr(outfile, "close"):
+                        outfile.close()
+
+        if not found:
+            print("The .kfx-zip archive does not contain an encrypted DRMION file")
+
+    def _write_entry(self, zif, zof, info, outfile):
+        if outfile is None:
+            _copy_raw_entry(zif, zof, info)
+        else:
+            # the decrypted data has other sizes, a zip64 extra field of
+            # the source entry is stale and written again if needed
+            zinfo = copy.copy(info)
+            zinfo.extra = _strip_zip64_extra(info.extra)
+            if isinstance(outfile, bytes):
+                zof.writestr(zinfo, outfile)
+                return
+            # SpooledTemporaryFile.seek returns None before Python 3.7
+            outfile.seek(0, os.SEEK_END)
+            zinfo.file_size = outfile.tell()
+            outfile.seek(0)
+            with zof.open(zinfo, 'w') as dst:
+                shutil.copyfileobj(outfile, dst, LZMA_CHUNK_SIZE)
+
+    @staticmethod
+    def _voucher_candidate(info, fh, magic):
+        # Returns the entry and its data, if it looks like a DRM voucher.
+        if magic[:4] == VOUCHER_MAGIC:
+            data = magic + fh.read()
+            if b'ProtectedData' in data:
+                return info, data
+        return None, None
+
+    def _find_voucher(self, zf):
+        for info in zf.infolist():
+            with zf.open(info) as fh:
+                voucher = self._voucher_candidate(info, fh, fh.read(8))
+            if voucher[0] is not None:
+                return voucher
+        return None, None
+
+    def _decrypt_drmion(self, zf, info):
+        with zf.open(info) as fh:
+            if fh.read(8) != DRMION_MAGIC:
+                return None
+            if self.voucher is None:
+                self.decrypt_voucher(zf)
+            return self._decrypt_drmion_stream(fh, info)
+
+    def _decrypt_drmion_stream(self, fh, info):
+        # `fh` is positioned after the DRMION magic
+        print("Decrypting KFX DRMION: {0}".format(info.filename))
+        if self.spool_threshold is None:
+            outfile = BytesIO()
+        else:
+            outfile = SpooledTemporaryFile(
+                max_size=self.spool_threshold, dir=self.spool_dir)
+        # the envelope is streamed without the 8 byte trailer
+        ionstream = _BoundedReader(fh, info.file_size - 16)
+        try:
+            DrmIon(ionstream, lambda name: self.voucher).parse(outfile)
+        except BaseException:
+            outfile.close()
+            raise
+
+        if outfile.tell() > 0:
+            if self.spool_threshold is None:
+                return outfile.getvalue()
+            return outfile
+        outfile.close()
+        print("Decrypting KFX DRMION {0} results in a length of Zero. Skip file.".format(info.filename))
+        return None
+
+    def decrypt_voucher(self, zf=None):
+        if zf is None:
+            with zipfile.ZipFile(self.infile, 'r') as zf:
+                return self.decrypt_voucher(zf)
+
+        self._decrypt_voucher_data(*self._find_voucher(zf))
+
+    def _decrypt_voucher_data(self, info, data):
+        if info is None:
+            raise Exception("The .kfx-zip archive contains an encrypted DRMION file without a DRM voucher")
 
         print("Decrypting KFX DRM voucher: {0}".format(info.filename))
 
@@ -337,7 +651,11 @@ class KFXZipBook:
         return 'KFX-ZIP'
 
     def cleanup(self):
-        pass
+        # closes and removes spooled entries
+        for outfile in self.decrypted.values():
+            if hasattr(outfile, "close"):
+                outfile.close()
+        self.decrypted.clear()
 
     def getFile(self, outpath):
         if not self.decrypted:
@@ -346,4 +664,5 @@ class KFXZipBook:
             with zipfile.ZipFile(self.infile, 'r') as zif:
                 with zipfile.ZipFile(outpath, 'w') as zof:
                     for info in zif.infolist():
-                        zof.writestr(info, self.decrypted.get(info.filename, zif.read(info.filename)))
+                        outfile = self.decrypted.get(info.filename)
+                        self._write_entry(zif, zof, info, outfile)
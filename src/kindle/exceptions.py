@@ -80,3 +80,34 @@ class NoRefreshToken(Exception):
 
 class FileEncryptionError(Exception):
     """Raised if something is wrong with file encryption"""
+
+
+def _error_data(resp):
+    try:
+        return resp.json()
+    except ValueError:
+        return resp.text
+
+
+def raise_for_status(resp) -> None:
+    """Raises the matching :class:`StatusError` for an error response.
+
+    The response body must be read already.
+    """
+    code = resp.status_code
+    if code < 400:
+        return
+
+    data = _error_data(resp)
+    if code == 400:
+        raise BadRequest(resp, data)
+    elif code in (401, 403):
+        raise Unauthorized(resp, data)
+    elif code == 404:
+        raise NotFoundError(resp, data)
+    elif code == 429:
+        raise RatelimitError(resp, data)
+    elif code >= 500:
+        raise ServerError(resp, data)
+    else:
+        raise UnexpectedError(resp, data)
@@ -0,0 +1,191 @@
+import json
+import logging
+import pathlib
+import sqlite3
+import threading
+from typing import (
+    Dict, Iterable, Iterator, Optional, Union, TYPE_CHECKING
+)
+
+from .api import LIBRARY_SECTIONS, LibraryEvent, iter_library
+from .models import iter_meta_data
+
+if TYPE_CHECKING:
+    from .api import AuthOrClient
+
+
+logger = logging.getLogger("kindle.library")
+
+
+class LibraryStore:
+    """A persistent local copy of the user library backed by SQLite.
+
+    Items are stored by ASIN together with the ``sync_time`` of the last
+    sync. The first sync fetches the full library. Every following sync
+    only requests the changes since the last sync and applies them as
+    upserts and deletes. Lookups never touch the network.
+
+    Args:
+        filename: The SQLite database file. Defaults to an in-memory
+            database.
+
+    Example:
+        >>> with LibraryStore("library.db") as store:
+        ...     store.sync(client)
+        ...     item = store.get("B00XXXXXXX")
+    """
+
+    def __init__(self, filename: Union[str, pathlib.Path] = ":memory:") -> None:
+        self.filename = filename
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(filename), check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS items "
+                "(asin TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta "
+                "(key TEXT PRIMARY KEY, value TEXT)")
+
+    def __enter__(self) -> "LibraryStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({str(self.filename)!r})"
+
+    def __len__(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) FROM items").fetchone()
+        return row[0]
+
+    def __contains__(self, asin: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM items WHERE asin = ?", (asin.upper(),)
+            ).fetchone()
+        return row is not None
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            asins = [row[0] for row in self._conn.execute(
+                "SELECT asin FROM items ORDER BY asin")]
+        return iter(asins)
+
+    def __getitem__(self, asin: str) -> Dict:
+        item = self.get(asin)
+        if item is None:
+            raise KeyError(asin)
+        return item
+
+    @property
+    def sync_time(self) -> Optional[str]:
+        """The ``sync_time`` of the last applied sync."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'sync_time'").fetchone()
+        return row[0] if row else None
+
+    def get(self, asin: str, default: Optional[Dict] = None) -> Optional[Dict]:
+        """Returns the stored ``meta_data`` item for `asin`."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM items WHERE asin = ?", (asin.upper(),)
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def values(self) -> Iterator[Dict]:
+        """Yields all stored ``meta_data`` items ordered by ASIN."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM items ORDER BY asin").fetchall()
+        for row in rows:
+            yield json.loads(row[0])
+
+    def _apply_events(self,
+                      events: Iterable[LibraryEvent],
+                      full: bool) -> Dict[str, int]:
+        updated = 0
+        removed = 0
+        sync_time = None
+
+        # one transaction, an interrupted sync leaves the store untouched
+        with self._lock, self._conn:
+            if full:
+                self._conn.execute("DELETE FROM items")
+
+            for section, data in events:
+                if section == "sync_time":
+                    sync_time = data
+                elif not isinstance(data, dict) or not data.get("ASIN"):
+                    continue
+                elif section == "add_update_list":
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO items (asin, data) "
+                        "VALUES (?, ?)",
+                        (data["ASIN"].upper(), json.dumps(data)))
+                    updated += 1
+                elif section == "removal_list":
+                    self._conn.execute(
+                        "DELETE FROM items WHERE asin = ?",
+                        (data["ASIN"].upper(),))
+                    removed += 1
+
+            if sync_time is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) "
+                    "VALUES ('sync_time', ?)", (sync_time,))
+
+        logger.info(f"applied {'full' if full else 'incremental'} sync: "
+                    f"{updated} updated, {removed} removed")
+        return {"updated": updated, "removed": removed}
+
+    def apply(self, library: Dict, full: bool = False) -> Dict[str, int]:
+        """Applies a library response to the store.
+
+        Args:
+            library: A library returned by :func:`kindle.api.get_library`.
+            full: If ``True``, `library` is a full sync and replaces all
+                stored items.
+
+        Returns:
+            The number of ``updated`` and ``removed`` items.
+        """
+        events = [
+            LibraryEvent(section, item)
+            for section in LIBRARY_SECTIONS
+            for item in iter_meta_data(library, section)
+        ]
+        events.append(LibraryEvent("sync_time", library.get("sync_time")))
+        return self._apply_events(events, full)
+
+    def sync(self, auth: "AuthOrClient", full: bool = False) -> Dict[str, int]:
+        """Syncs the store with the user library.
+
+        Only the changes since the last sync are fetched, unless the store
+        is empty or `full` is ``True``. The response is streamed with
+        :func:`kindle.api.iter_library` and applied item by item.
+
+        Args:
+            auth: The Kindle Authenticator or a
+                :class:`~kindle.client.KindleClient`.
+            full: If ``True``, force a full sync.
+
+        Returns:
+            The number of ``updated`` and ``removed`` items.
+        """
+        last_sync = None if full else self.sync_time
+        events = iter_library(auth, last_sync=last_sync)
+        return self._apply_events(events, full=last_sync is None)
+
+    def clear(self) -> None:
+        """Removes all items and the ``sync_time``."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM items")
+            self._conn.execute("DELETE FROM meta")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
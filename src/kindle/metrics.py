@@ -0,0 +1,399 @@
+"""Optional request metrics grouped by api function.
+
+Pass a :class:`Metrics` instance to :class:`~kindle.client.KindleClient` or
+:class:`~kindle.client.AsyncKindleClient` to enable it. Without it, the
+clients do not measure anything.
+
+Every finished request yields one :class:`RequestRecord`. Its
+``endpoint`` is the name of the outermost :mod:`kindle.api` or
+:mod:`kindle.async_api` function in which the request was sent. Records are
+aggregated into cheap fixed-bucket histograms and counters, which can be
+exported with :meth:`Metrics.to_prometheus` or observed one by one with a
+callback.
+
+Example:
+    >>> metrics = Metrics()
+    >>> with KindleClient(auth, metrics=metrics) as client:
+    ...     kindle.api.get_library(client)
+    >>> print(metrics.to_prometheus())
+"""
+
+import functools
+import inspect
+import logging
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from contextvars import ContextVar
+    contextvars_available = True
+except ImportError:  # Python 3.6 without the contextvars backport
+    contextvars_available = False
+
+
+logger = logging.getLogger("kindle.metrics")
+
+# upper bounds in seconds of the time histograms
+TIME_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+# upper bounds in bytes of the response size histograms
+SIZE_BUCKETS = (
+    1024, 16 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2,
+    64 * 1024 ** 2
+)
+PHASES = ("connect", "ttfb", "transfer", "total")
+UNKNOWN_ENDPOINT = "unknown"
+
+RequestRecord = namedtuple(
+    "RequestRecord",
+    ["endpoint", "method", "host", "status", "retries", "connect_time",
+     "ttfb", "transfer_time", "elapsed", "bytes"])
+RequestRecord.__doc__ = """The measurements of a single request.
+
+`status` is ``None`` if no response was received. All times are in
+seconds. `connect_time` is the time to open a new connection. Name
+resolution is not measured on its own but is part of it, like the TLS
+handshake. It is ``0`` if a pooled connection was reused or on Python 3.6
+without the contextvars backport. `ttfb` is the time until the
+response headers were received, `transfer_time` the time to read the body.
+`elapsed` is the total time including all retries. `bytes` is the number of
+body bytes received.
+"""
+
+if contextvars_available:
+    _endpoint: "ContextVar[Optional[str]]" = ContextVar(
+        "kindle_endpoint", default=None)
+
+
+def current_endpoint() -> Optional[str]:
+    """Returns the api function name of the running request or ``None``."""
+    if not contextvars_available:
+        return None
+    return _endpoint.get()
+
+
+def _iter_in_endpoint(name: str, iterator):
+    try:
+        while True:
+            token = _endpoint.set(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _endpoint.reset(token)
+            yield item
+    finally:
+        iterator.close()
+
+
+async def _aiter_in_endpoint(name: str, iterator):
+    try:
+        while True:
+            token = _endpoint.set(name)
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                _endpoint.reset(token)
+            yield item
+    finally:
+        await iterator.aclose()
+
+
+def instrumented(func: Callable) -> Callable:
+    """Labels all requests sent by `func` with its name.
+
+    Works with functions, coroutine functions and (async) generator
+    functions. If `func` is called by another instrumented function, the
+    label of the outer function is kept.
+    """
+    if not contextvars_available:
+        return func
+
+    name = func.__name__
+
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            iterator = func(*args, **kwargs)
+            if _endpoint.get() is not None:
+                return iterator
+            return _aiter_in_endpoint(name, iterator)
+
+    elif inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            iterator = func(*args, **kwargs)
+            if _endpoint.get() is not None:
+                return iterator
+            return _iter_in_endpoint(name, iterator)
+
+    elif inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if _endpoint.get() is not None:
+                return await func(*args, **kwargs)
+            token = _endpoint.set(name)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _endpoint.reset(token)
+
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _endpoint.get() is not None:
+                return func(*args, **kwargs)
+            token = _endpoint.set(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _endpoint.reset(token)
+
+    return wrapper
+
+
+def bind_endpoint(func: Callable) -> Callable:
+    """Binds the current endpoint label to `func`.
+
+    Worker threads do not inherit the label. Wrap a function with this
+    before it is submitted to a thread pool.
+    """
+    name = current_endpoint()
+    if name is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _endpoint.set(name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _endpoint.reset(token)
+
+    return wrapper
+
+
+class Histogram:
+    """A histogram with fixed buckets.
+
+    Args:
+        buckets: The sorted upper bounds of the buckets. A final ``+Inf``
+            bucket is always added.
+    """
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def __repr__(self):
+        return (f"{type(self).__name__}(count={self.count}, "
+                f"sum={self.sum:.6g})")
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def copy(self) -> "Histogram":
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.sum = self.sum
+        return histogram
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """Returns ``(upper bound, count)`` pairs as used by Prometheus."""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Returns the upper bucket bound which contains the `q` quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return float("inf")
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def _escape(value: str) -> str:
+    return (value.replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def _labels(**labels: Any) -> str:
+    return ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+
+
+class Metrics:
+    """Collects :class:`RequestRecord` per endpoint.
+
+    Thread-safe, one instance can be shared by several clients.
+
+    Args:
+        callback: Called with every :class:`RequestRecord`. Exceptions
+            raised by the callback are logged and ignored.
+        time_buckets: The histogram buckets for times in seconds.
+        size_buckets: The histogram buckets for response sizes in bytes.
+    """
+
+    def __init__(self,
+                 callback: Optional[Callable[[RequestRecord], Any]] = None,
+                 time_buckets: Sequence[float] = TIME_BUCKETS,
+                 size_buckets: Sequence[float] = SIZE_BUCKETS) -> None:
+        self.callback = callback
+        self.time_buckets = tuple(time_buckets)
+        self.size_buckets = tuple(size_buckets)
+        self._lock = threading.Lock()
+        self._times: Dict[Tuple[str, str], Histogram] = {}
+        self._sizes: Dict[str, Histogram] = {}
+        self._requests: Dict[Tuple[str, str], int] = {}
+        self._retries: Dict[str, int] = {}
+
+    def __repr__(self):
+        return f"{type(self).__name__}(endpoints={self.endpoints})"
+
+    @property
+    def endpoints(self) -> List[str]:
+        with self._lock:
+            return sorted(self._sizes)
+
+    def observe(self, record: RequestRecord) -> None:
+        """Adds a record to the histograms and counters."""
+        endpoint = record.endpoint
+        status = str(record.status) if record.status is not None else "error"
+        times = zip(PHASES, (record.connect_time, record.ttfb,
+                             record.transfer_time, record.elapsed))
+
+        with self._lock:
+            for phase, value in times:
+                histogram = self._times.get((endpoint, phase))
+                if histogram is None:
+                    histogram = Histogram(self.time_buckets)
+                    self._times[(endpoint, phase)] = histogram
+                histogram.observe(value)
+
+            histogram = self._sizes.get(endpoint)
+            if histogram is None:
+                histogram = Histogram(self.size_buckets)
+                self._sizes[endpoint] = histogram
+            histogram.observe(record.bytes)
+
+            key = (endpoint, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._retries[endpoint] = \
+                self._retries.get(endpoint, 0) + record.retries
+
+        if self.callback is not None:
+            try:
+                self.callback(record)
+            except Exception:
+                logger.exception("metrics callback failed")
+
+    def histogram(self, endpoint: str,
+                  phase: str = "total") -> Optional[Histogram]:
+        """Returns the time histogram of an endpoint and phase.
+
+        The histogram is a copy, later requests do not change it.
+
+        Args:
+            endpoint: The api function name.
+            phase: One of ``connect``, ``ttfb``, ``transfer`` or ``total``.
+        """
+        with self._lock:
+            histogram = self._times.get((endpoint, phase))
+            return histogram.copy() if histogram is not None else None
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Returns a summary per endpoint as a plain dict."""
+        with self._lock:
+            result = {}
+            for endpoint, sizes in self._sizes.items():
+                total = self._times[(endpoint, "total")]
+                result[endpoint] = {
+                    "requests": sizes.count,
+                    "statuses": {
+                        status: count
+                        for (name, status), count in self._requests.items()
+                        if name == endpoint
+                    },
+                    "retries": self._retries.get(endpoint, 0),
+                    "bytes": int(sizes.sum),
+                    "seconds": {
+                        phase: self._times[(endpoint, phase)].sum
+                        for phase in PHASES
+                    },
+                    "p50": total.quantile(0.5),
+                    "p99": total.quantile(0.99),
+                }
+            return result
+
+    def to_prometheus(self, prefix: str = "kindle") -> str:
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            name = f"{prefix}_request_duration_seconds"
+            lines.append(f"# HELP {name} Request time per phase.")
+            lines.append(f"# TYPE {name} histogram")
+            for (endpoint, phase), histogram in sorted(self._times.items()):
+                self._histogram_lines(lines, name, histogram,
+                                      endpoint=endpoint, phase=phase)
+
+            name = f"{prefix}_response_bytes"
+            lines.append(f"# HELP {name} Received response body bytes.")
+            lines.append(f"# TYPE {name} histogram")
+            for endpoint, histogram in sorted(self._sizes.items()):
+                self._histogram_lines(lines, name, histogram,
+                                      endpoint=endpoint)
+
+            name = f"{prefix}_requests_total"
+            lines.append(f"# HELP {name} Finished requests by status.")
+            lines.append(f"# TYPE {name} counter")
+            for (endpoint, status), count in sorted(self._requests.items()):
+                labels = _labels(endpoint=endpoint, status=status)
+                lines.append(f"{name}{{{labels}}} {count}")
+
+            name = f"{prefix}_retries_total"
+            lines.append(f"# HELP {name} Retried request attempts.")
+            lines.append(f"# TYPE {name} counter")
+            for endpoint, count in sorted(self._retries.items()):
+                labels = _labels(endpoint=endpoint)
+                lines.append(f"{name}{{{labels}}} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _histogram_lines(lines: List[str], name: str, histogram: Histogram,
+                         **labels: Any) -> None:
+        base = _labels(**labels)
+        for bound, count in histogram.cumulative():
+            lines.append(
+                f'{name}_bucket{{{base},le="{_format_bound(bound)}"}} {count}')
+        lines.append(f"{name}_sum{{{base}}} {histogram.sum!r}")
+        lines.append(f"{name}_count{{{base}}} {histogram.count}")
+
+    def reset(self) -> None:
+        with self._lock:
+            self._times.clear()
+            self._sizes.clear()
+            self._requests.clear()
+            self._retries.clear()
@@ -0,0 +1,235 @@
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def _as_list(value: Any) -> List:
+    # xmltodict returns a single element as dict and repeated ones as list
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _text(value: Any) -> Optional[str]:
+    # an element with attributes like `pronunciation` becomes a dict
+    if isinstance(value, dict):
+        return value.get("#text")
+    return value
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    # content types and dates repeat for most items of a library
+    return sys.intern(value) if value is not None else None
+
+
+def _names(container: Any, tag: str) -> Tuple[str, ...]:
+    names = []
+    for entry in _as_list(container):
+        if isinstance(entry, dict):
+            names.extend(_text(v) for v in _as_list(entry.get(tag)))
+    return tuple(name for name in names if name)
+
+
+def iter_meta_data(library: Dict, section: str) -> Iterator[Dict]:
+    """Yields the ``meta_data`` items of a library section.
+
+    Args:
+        library: A library returned by :func:`kindle.api.get_library`.
+        section: The section name. Can be ``add_update_list`` or
+            ``removal_list``.
+    """
+    for container in _as_list(library.get(section)):
+        if isinstance(container, dict):
+            yield from _as_list(container.get("meta_data"))
+
+
+class LibraryItem:
+    """A single item of the user library.
+
+    Only the commonly used fields of a ``meta_data`` entry are kept as
+    attributes. The original dict is available as :attr:`raw`, if it was
+    requested when the item was created.
+    """
+
+    __slots__ = (
+        "asin", "title", "authors", "publishers", "publication_date",
+        "purchase_date", "content_type", "cde_contenttype", "origin_type",
+        "raw"
+    )
+
+    def __init__(self,
+                 asin: str,
+                 title: Optional[str] = None,
+                 authors: Tuple[str, ...] = (),
+                 publishers: Tuple[str, ...] = (),
+                 publication_date: Optional[str] = None,
+                 purchase_date: Optional[str] = None,
+                 content_type: Optional[str] = None,
+                 cde_contenttype: Optional[str] = None,
+                 origin_type: Optional[str] = None,
+                 raw: Optional[Dict] = None) -> None:
+        self.asin = asin
+        self.title = title
+        self.authors = authors
+        self.publishers = publishers
+        self.publication_date = publication_date
+        self.purchase_date = purchase_date
+        self.content_type = content_type
+        self.cde_contenttype = cde_contenttype
+        self.origin_type = origin_type
+        self.raw = raw
+
+    def __repr__(self):
+        return (f"{type(self).__name__}(asin={self.asin!r}, "
+                f"title={self.title!r})")
+
+    def __eq__(self, other):
+        if not isinstance(other, LibraryItem):
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k)
+                   for k in self.__slots__ if k != "raw")
+
+    @classmethod
+    def from_dict(cls, data: Dict, keep_raw: bool = False) -> "LibraryItem":
+        """Creates an item from a ``meta_data`` dict.
+
+        Args:
+            data: The ``meta_data`` dict as returned by
+                :func:`kindle.api.get_library`.
+            keep_raw: If ``True``, keep `data` as :attr:`raw`.
+        """
+        origins = _as_list(data.get("origins"))
+        origin = _as_list(origins[0].get("origin"))[:1] \
+            if origins and isinstance(origins[0], dict) else []
+
+        return cls(
+            asin=data["ASIN"],
+            title=_text(data.get("title")),
+            authors=_names(data.get("authors"), "author"),
+            publishers=_names(data.get("publishers"), "publisher"),
+            publication_date=_intern(data.get("publication_date")),
+            purchase_date=_intern(data.get("purchase_date")),
+            content_type=_intern(data.get("content_type")),
+            cde_contenttype=_intern(data.get("cde_contenttype")),
+            origin_type=_intern(origin[0].get("type")) if origin else None,
+            raw=data if keep_raw else None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the attributes as a flat dict."""
+        return {k: getattr(self, k) for k in self.__slots__ if k != "raw"}
+
+
+class Library:
+    """A compact collection of :class:`LibraryItem` with an ASIN index.
+
+    Items are kept in response order. Lookups by ASIN are O(1) and case
+    insensitive.
+
+    Args:
+        items: The library items.
+        removed: The ASINs of the ``removal_list``.
+        sync_time: The ``sync_time`` of the response.
+        raw: The full library response, if requested.
+    """
+
+    __slots__ = ("_items", "_index", "_removed", "sync_time", "raw")
+
+    def __init__(self,
+                 items: Iterable[LibraryItem] = (),
+                 removed: Iterable[str] = (),
+                 sync_time: Optional[str] = None,
+                 raw: Optional[Dict] = None) -> None:
+        self._items: List[LibraryItem] = []
+        self._index: Dict[str, int] = {}
+        self._removed: List[str] = list(removed)
+        self.sync_time = sync_time
+        self.raw = raw
+        for item in items:
+            self.add(item)
+
+    def __repr__(self):
+        return (f"{type(self).__name__}(items={len(self)}, "
+                f"sync_time={self.sync_time!r})")
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[LibraryItem]:
+        return iter(self._items)
+
+    def __contains__(self, asin: str) -> bool:
+        return asin.upper() in self._index
+
+    def __getitem__(self, asin: str) -> LibraryItem:
+        return self._items[self._index[asin.upper()]]
+
+    @property
+    def removed(self) -> Tuple[str, ...]:
+        """The ASINs of the ``removal_list``."""
+        return tuple(self._removed)
+
+    def get(self,
+            asin: str,
+            default: Optional[LibraryItem] = None) -> Optional[LibraryItem]:
+        index = self._index.get(asin.upper())
+        return self._items[index] if index is not None else default
+
+    def add(self, item: LibraryItem) -> None:
+        """Adds an item or replaces the item with the same ASIN."""
+        key = item.asin.upper()
+        index = self._index.get(key)
+        if index is None:
+            self._index[key] = len(self._items)
+            self._items.append(item)
+        else:
+            self._items[index] = item
+
+    @classmethod
+    def from_dict(cls, library: Dict, keep_raw: bool = False) -> "Library":
+        """Creates a collection from a library response.
+
+        Args:
+            library: A library returned by :func:`kindle.api.get_library`.
+            keep_raw: If ``True``, keep the response as :attr:`raw` and every
+                ``meta_data`` dict as :attr:`LibraryItem.raw`.
+        """
+        items = (
+            LibraryItem.from_dict(data, keep_raw)
+            for data in iter_meta_data(library, "add_update_list")
+            if isinstance(data, dict) and data.get("ASIN")
+        )
+        removed = (
+            data["ASIN"] for data in iter_meta_data(library, "removal_list")
+            if isinstance(data, dict) and data.get("ASIN")
+        )
+        return cls(items, removed, library.get("sync_time"),
+                   raw=library if keep_raw else None)
+
+    @classmethod
+    def from_events(cls,
+                    events: Iterable[Tuple[str, Any]],
+                    keep_raw: bool = False) -> "Library":
+        """Creates a collection from :func:`kindle.api.iter_library` events.
+
+        The full response is never built, so :attr:`raw` is always ``None``.
+
+        Args:
+            events: The ``(section, data)`` events.
+            keep_raw: If ``True``, keep every ``meta_data`` dict as
+                :attr:`LibraryItem.raw`.
+        """
+        library = cls()
+        for section, data in events:
+            library._apply_event(section, data, keep_raw)
+        return library
+
+    def _apply_event(self, section: str, data: Any, keep_raw: bool) -> None:
+        if section == "sync_time":
+            self.sync_time = data
+        elif not isinstance(data, dict) or not data.get("ASIN"):
+            return
+        elif section == "add_update_list":
+            self.add(LibraryItem.from_dict(data, keep_raw))
+        elif section == "removal_list":
+            self._removed.append(data["ASIN"])
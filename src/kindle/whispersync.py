@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .api import (
+    AuthOrClient, _client_for, _max_sync_number, iter_whispersync_datasets,
+    iter_whispersync_records
+)
+from .client import KindleClient
+
+
+logger = logging.getLogger("kindle.whispersync")
+
+WhispersyncRecord = namedtuple("WhispersyncRecord", ["dataset", "record"])
+WhispersyncRecord.__doc__ = """A record and the identifier of its dataset."""
+
+DatasetRecords = namedtuple(
+    "DatasetRecords", ["dataset", "records", "cursor", "error", "elapsed"])
+DatasetRecords.__doc__ = """The fetched records of a single dataset.
+
+`cursor` is the highest ``syncNumber`` of the records. If fetching failed,
+`error` is the raised exception and `records` is empty.
+"""
+
+
+def _dataset_identifier(dataset: Dict) -> Optional[str]:
+    # the identifier is the path segment of the records url
+    return dataset.get("identifier") or dataset.get("name")
+
+
+class CursorStore:
+    """Persists the whispersync cursor of every dataset.
+
+    The cursor is the highest ``syncNumber`` that was fetched. It is used as
+    ``after`` parameter on the next run, so only new records are requested.
+    The cursor of the dataset list itself is stored as :attr:`datasets`.
+
+    Every change is written to the file at once. Use the store as context
+    manager to batch changes, they are written once when the outermost
+    block is left or :meth:`flush` is called.
+
+    Args:
+        filename: The JSON file. Defaults to memory only.
+
+    Example:
+        >>> store = CursorStore("whispersync.json")
+        >>> for dataset, record in iter_new_records(client, store):
+        ...     print(dataset, record)
+
+        >>> with store:
+        ...     for identifier, cursor in cursors.items():
+        ...         store.set(identifier, cursor)
+    """
+
+    def __init__(self,
+                 filename: Optional[Union[str, pathlib.Path]] = None) -> None:
+        self.filename = pathlib.Path(filename) if filename is not None else None
+        self._lock = threading.Lock()
+        self._datasets: Optional[int] = None
+        self._cursors: Dict[str, int] = {}
+        self._batches = 0
+        self._dirty = False
+
+        if self.filename is not None and self.filename.exists():
+            data = json.loads(self.filename.read_text())
+            self._datasets = data.get("datasets")
+            self._cursors = data.get("records", {})
+
+    def __repr__(self):
+        return (f"{type(self).__name__}({self.filename!r}, "
+                f"datasets={len(self._cursors)})")
+
+    def __enter__(self) -> "CursorStore":
+        with self._lock:
+            self._batches += 1
+        return self
+
+    def __exit__(self, *exc) -> None:
+        with self._lock:
+            self._batches -= 1
+            if not self._batches:
+                self._flush()
+
+    def __len__(self) -> int:
+        return len(self._cursors)
+
+    def __contains__(self, identifier: str) -> bool:
+        return identifier in self._cursors
+
+    @property
+    def datasets(self) -> Optional[int]:
+        """The cursor of the dataset list."""
+        return self._datasets
+
+    @datasets.setter
+    def datasets(self, cursor: Optional[int]) -> None:
+        with self._lock:
+            self._datasets = cursor
+            self._changed()
+
+    def get(self, identifier: str) -> Optional[int]:
+        """Returns the record cursor of a dataset."""
+        return self._cursors.get(identifier)
+
+    def set(self, identifier: str, cursor: Optional[int]) -> None:
+        """Stores the record cursor of a dataset.
+
+        A cursor of ``None`` removes the dataset.
+        """
+        with self._lock:
+            if cursor is None:
+                self._cursors.pop(identifier, None)
+            else:
+                self._cursors[identifier] = cursor
+            self._changed()
+
+    def items(self) -> List[Tuple[str, int]]:
+        return list(self._cursors.items())
+
+    def clear(self) -> None:
+        """Removes all cursors, the next run fetches everything."""
+        with self._lock:
+            self._datasets = None
+            self._cursors.clear()
+            self._changed()
+
+    def flush(self) -> None:
+        """Writes pending changes to the file."""
+        with self._lock:
+            self._flush()
+
+    def _changed(self) -> None:
+        self._dirty = True
+        if not self._batches:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._dirty:
+            return
+        self._dirty = False
+        if self.filename is None:
+            return
+        body = json.dumps(
+            {"datasets": self._datasets, "records": self._cursors}, indent=4)
+        tmp = self.filename.with_name(self.filename.name + ".tmp")
+        tmp.write_text(body)
+        os.replace(tmp, self.filename)
+
+
+def get_changed_datasets(auth: AuthOrClient,
+                         store: CursorStore
+                         ) -> Tuple[List[Dict], Optional[int]]:
+    """Returns the datasets changed since the last run.
+
+    Args:
+        auth: The Kindle Authenticator or a
+            :class:`~kindle.client.KindleClient`.
+        store: The cursor store.
+
+    Returns:
+        The changed datasets and the new dataset cursor. The cursor is not
+        stored, this is up to the caller once all records were fetched.
+    """
+    datasets = [
+        dataset for dataset in iter_whispersync_datasets(
+            auth, after=store.datasets)
+        if _dataset_identifier(dataset)
+    ]
+    return datasets, _max_sync_number(datasets, store.datasets)
+
+
+def iter_new_records(auth: AuthOrClient,
+                     store: CursorStore) -> Iterator[WhispersyncRecord]:
+    """Yields all records added since the last run.
+
+    Only datasets with a ``syncNumber`` greater than the stored dataset
+    cursor are visited. For each of them, the records after the stored
+    record cursor are fetched page by page. The cursor of a dataset is
+    stored once all of its records were consumed. So an interrupted run
+    resumes with the first unfinished dataset. The store is written once
+    when the generator is exhausted or closed.
+
+    Args:
+        auth: The Kindle Authenticator or a
+            :class:`~kindle.client.KindleClient`.
+        store: The cursor store.
+    """
+    with _client_for(auth) as client, store:
+        datasets, datasets_cursor = get_changed_datasets(client, store)
+        logger.info(f"{len(datasets)} whispersync datasets changed")
+
+        for dataset in datasets:
+            identifier = _dataset_identifier(dataset)
+            cursor = store.get(identifier)
+            for record in iter_whispersync_records(
+                    client, identifier, after=cursor):
+                cursor = _max_sync_number([record], cursor)
+                yield WhispersyncRecord(identifier, record)
+            store.set(identifier, cursor)
+
+        store.datasets = datasets_cursor
+
+
+def _fetch_dataset(client: KindleClient,
+                   identifier: str,
+                   after: Optional[int]) -> DatasetRecords:
+    start = time.monotonic()
+    try:
+        records = list(iter_whispersync_records(client, identifier, after))
+    except Exception as exc:
+        logger.warning(f"fetching records of {identifier} failed: {exc!r}")
+        return DatasetRecords(
+            identifier, [], after, exc, time.monotonic() - start)
+
+    return DatasetRecords(identifier, records,
+                          _max_sync_number(records, after), None,
+                          time.monotonic() - start)
+
+
+def fetch_records(auth: AuthOrClient,
+                  identifiers: Iterable[str],
+                  concurrency: int = 8,
+                  store: Optional[CursorStore] = None
+                  ) -> Iterator[DatasetRecords]:
+    """Fetches the records of many datasets concurrently.
+
+    All datasets share one pooled client. Results are yielded as soon as a
+    dataset is complete, not in input order. A failed dataset is yielded
+    with its error, the other datasets continue. Closing the generator
+    early cancels all datasets which were not started yet.
+
+    Args:
+        auth: The Kindle Authenticator or a
+            :class:`~kindle.client.KindleClient`.
+        identifiers: The dataset identifiers.
+        concurrency: The max. number of datasets fetched at the same time.
+        store: If given, only records after the stored cursor are fetched
+            and the cursor of every successfully fetched dataset is updated.
+            The store is written once when the generator is exhausted or
+            closed.
+
+    Example:
+        >>> datasets, _ = get_changed_datasets(client, store)
+        >>> identifiers = [d["identifier"] for d in datasets]
+        >>> for result in fetch_records(client, identifiers, store=store):
+        ...     print(result.dataset, len(result.records))
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be >= 1.")
+
+    identifiers = list(dict.fromkeys(identifiers))
+    with _client_for(auth) as client, ExitStack() as stack:
+        if store is not None:
+            stack.enter_context(store)
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        futures = [
+            executor.submit(
+                _fetch_dataset, client, identifier,
+                store.get(identifier) if store is not None else None)
+            for identifier in identifiers
+        ]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                if store is not None and result.error is None:
+                    store.set(result.dataset, result.cursor)
+                yield result
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
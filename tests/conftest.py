@@ -0,0 +1,156 @@
+import base64
+import http.server
+import json
+import pathlib
+import sys
+import threading
+import time
+
+import httpx
+import pytest
+from amazon.ion import simpleion
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "src"))
+
+
+class FakeLocale:
+    language = "en-US"
+
+
+class FakeAuth(httpx.Auth):
+    """Stands in for a registered Authenticator, requests are not signed."""
+
+    device_info = {"device_type": "A2CZJZGLK2JJVM",
+                   "device_serial_number": "SERIAL"}
+    customer_info = {"user_id": "USER"}
+    locale = FakeLocale()
+
+    def auth_flow(self, request):
+        yield request
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Dispatches GET requests to ``routes[path](handler)``."""
+
+    protocol_version = "HTTP/1.1"
+    routes = {}
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        self.server.requests.append(self.path)
+        self.routes[path](self)
+
+    def reply(self, status=200, body=b"", headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def auth():
+    return FakeAuth()
+
+
+@pytest.fixture
+def server():
+    """A local HTTP server. Register routes in ``server.routes``."""
+    routes = {}
+    handler = type("RoutedHandler", (Handler,), {"routes": routes})
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    srv.daemon_threads = True
+    srv.requests = []
+    srv.routes = routes
+    srv.url = f"http://127.0.0.1:{srv.server_port}"
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def library_xml(asins=(), sync_time="T1", removals=()):
+    """Builds a syncMetaData response with a ``meta_data`` item per ASIN."""
+    parts = [f"<response><sync_time>{sync_time}</sync_time>"
+             f"<add_update_list>"]
+    for asin in asins:
+        parts.append(
+            f'<meta_data><ASIN>{asin}</ASIN>'
+            f'<title pronunciation="t">Title {asin}</title>'
+            f'<authors><author pronunciation="a">Author</author>'
+            f'<author pronunciation="b">Second</author></authors>'
+            f'<cde_contenttype>EBOK</cde_contenttype>'
+            f'<origins><origin><type>Purchase</type></origin></origins>'
+            f'</meta_data>')
+    parts.append("</add_update_list><removal_list>")
+    for asin in removals:
+        parts.append(f"<meta_data><ASIN>{asin}</ASIN></meta_data>")
+    parts.append("</removal_list></response>")
+    return "".join(parts).encode()
+
+
+@pytest.fixture
+def library_server(server, monkeypatch):
+    """Serves ``server.library`` as the library sync endpoint."""
+    from kindle import api, async_api
+
+    server.library = library_xml()
+    server.routes["/sync"] = lambda handler: handler.reply(200, server.library)
+    monkeypatch.setattr(api, "LIBRARY_URL", f"{server.url}/sync")
+    monkeypatch.setattr(async_api, "LIBRARY_URL", f"{server.url}/sync")
+    return server
+
+
+def part_body(asin, name):
+    return f"{asin}:{name};".encode() * 500
+
+
+def add_book(server, asin, query="", fail=False):
+    """Serves the manifest of `asin` and its voucher and base part.
+
+    `query` is appended to the part urls, e.g. a signed url ``Expires``.
+    Returns the raw manifest.
+    """
+    context = {"manifestTime": str(int(time.time() * 1000)),
+               "transport": "WiFi", "reason": "x", "swVersion": "1"}
+    raw = {
+        "content": {"id": asin},
+        "responseContext": base64.b64encode(
+            simpleion.dumps(context)).decode(),
+        "resources": [
+            {"id": "v1", "type": "DRM_VOUCHER", "requirement": "REQUIRED",
+             "endpoint": {"url": f"{server.url}/{asin}/voucher?v=1{query}"}},
+            {"id": "b", "type": "KINDLE_MAIN_BASE", "requirement": "REQUIRED",
+             "optimalEndpoint": {
+                 "directUrl": f"{server.url}/{asin}/base?v=1{query}"}},
+        ]
+    }
+
+    def manifest(handler):
+        if fail:
+            handler.reply(500)
+        else:
+            handler.reply(200, json.dumps(raw).encode(),
+                          [("Content-Type", "application/json")])
+
+    def part(name):
+        return lambda handler: handler.reply(200, part_body(asin, name))
+
+    server.routes[f"/manifest/{asin}"] = manifest
+    server.routes[f"/{asin}/voucher"] = part("voucher")
+    server.routes[f"/{asin}/base"] = part("base")
+    return raw
+
+
+@pytest.fixture
+def book_server(server, monkeypatch):
+    """Serves manifests added with :func:`add_book`."""
+    from kindle import api
+
+    monkeypatch.setattr(api, "MANIFEST_URL", f"{server.url}/manifest/{{asin}}")
+    return server
@@ -0,0 +1,178 @@
+import hashlib
+import hmac
+import io
+import os
+
+import pyaes
+import pytest
+from pbkdf2 import PBKDF2
+
+from kindle import aescipher
+from kindle.aescipher import AESCipher, derive_from_pbkdf2
+
+
+DATA = '{"access_token": "Atna|token"}'
+
+
+@pytest.fixture
+def derivations(monkeypatch):
+    calls = []
+    derive = aescipher.derive_from_pbkdf2
+
+    def counting(*args, **kwargs):
+        calls.append(kwargs["salt"])
+        return derive(*args, **kwargs)
+
+    monkeypatch.setattr(aescipher, "derive_from_pbkdf2", counting)
+    return calls
+
+
+def test_native_pbkdf2_matches_pure_python():
+    salt = os.urandom(12)
+    expected = PBKDF2("password", salt, 1000, hashlib.sha256, hmac).read(32)
+    assert derive_from_pbkdf2("password", key_size=32, salt=salt,
+                              kdf_iterations=1000, hashmod=hashlib.sha256,
+                              mac=hmac) == expected
+
+
+def test_every_encryption_uses_a_new_salt():
+    crypter = AESCipher("password")
+    first = crypter.to_dict(DATA)
+    assert crypter.from_dict(first) == DATA
+    second = crypter.to_dict(DATA)
+    assert first["salt"] != second["salt"]
+    assert first["iv"] != second["iv"]
+
+    third = crypter.to_bytes(DATA)
+    assert third[:16] != crypter.to_bytes(DATA)[:16]
+
+
+def test_decryption_reuses_cached_keys(derivations, tmp_path):
+    fn = tmp_path / "auth.json"
+    AESCipher("password").to_file(DATA, fn)
+
+    crypter = AESCipher("password")
+    assert crypter.from_file(fn) == DATA
+    assert crypter.from_file(fn) == DATA
+    assert len(derivations) == 2
+
+    # a saved file is decrypted with the key derived while saving
+    crypter.to_file(DATA, fn, encryption="bytes")
+    assert crypter.from_file(fn, encryption="bytes") == DATA
+    assert len(derivations) == 3
+    assert derivations[1] == derivations[0] != derivations[2]
+
+
+def test_key_cache_is_bounded(derivations):
+    crypter = AESCipher("password")
+    for _ in range(aescipher.KEY_CACHE_SIZE + 5):
+        crypter.to_bytes(DATA)
+    assert len(crypter._keys) == aescipher.KEY_CACHE_SIZE
+
+
+
+def pyaes_encrypt(key, iv, data):
+    encrypter = pyaes.Encrypter(pyaes.AESModeOfOperationCBC(key, iv))
+    return encrypter.feed(data) + encrypter.feed()
+
+
+@pytest.mark.parametrize("backend", aescipher.AES_BACKENDS)
+@pytest.mark.parametrize("size", [0, 1, 15, 16, 17, 1000])
+def test_backends_match_pyaes(backend, size):
+    key, iv, data = os.urandom(32), os.urandom(16), os.urandom(size)
+    encrypted = aescipher.aes_cbc_encrypt(key, iv, data, backend=backend)
+    assert encrypted == pyaes_encrypt(key, iv, data)
+    assert aescipher.aes_cbc_decrypt(
+        key, iv, encrypted, backend=backend) == data
+
+
+@pytest.mark.parametrize("backend", aescipher.AES_BACKENDS)
+def test_backends_without_padding(backend):
+    key, iv, data = os.urandom(16), os.urandom(16), os.urandom(64)
+    encrypted = aescipher.aes_cbc_encrypt(key, iv, data, padding="none",
+                                          backend=backend)
+    assert len(encrypted) == 64
+    assert aescipher.aes_cbc_decrypt(key, iv, encrypted, padding="none",
+                                     backend=backend) == data
+    with pytest.raises(ValueError):
+        aescipher.aes_cbc_encrypt(key, iv, data[:-1], padding="none",
+                                  backend=backend)
+
+
+def test_backend_errors():
+    key, iv = os.urandom(32), os.urandom(16)
+    with pytest.raises(ValueError, match="backend must be"):
+        aescipher.aes_cbc_encrypt(key, iv, b"data", backend="other")
+    with pytest.raises(ValueError, match="16 bytes"):
+        aescipher.aes_cbc_encrypt(key, iv[:8], b"data")
+    with pytest.raises(ValueError, match="invalid length"):
+        aescipher.aes_cbc_decrypt(key, iv, b"x" * 17)
+    with pytest.raises(ValueError, match="range"):
+        aescipher.aes_cbc_encrypt(key, iv, "€")
+
+
+def chunked(cipher, data, size):
+    out = b"".join(cipher.update(data[i:i + size])
+                   for i in range(0, len(data), size))
+    return out + cipher.finalize()
+
+
+@pytest.mark.parametrize("backend", aescipher.AES_BACKENDS)
+@pytest.mark.parametrize("chunk_size", [1, 7, 16, 33, 4096])
+def test_chunked_matches_one_shot(backend, chunk_size):
+    key, iv, data = os.urandom(32), os.urandom(16), os.urandom(1000)
+    expected = aescipher.aes_cbc_encrypt(key, iv, data, backend=backend)
+
+    encryptor = aescipher.AESCBCEncryptor(key, iv, backend=backend)
+    assert chunked(encryptor, data, chunk_size) == expected
+    decryptor = aescipher.AESCBCDecryptor(key, iv, backend=backend)
+    assert chunked(decryptor, expected, chunk_size) == data
+
+
+def test_chunked_without_padding():
+    key, iv, data = os.urandom(32), os.urandom(16), os.urandom(64)
+    encryptor = aescipher.AESCBCEncryptor(key, iv, padding="none")
+    encrypted = chunked(encryptor, data, 10)
+    assert encrypted == aescipher.aes_cbc_encrypt(key, iv, data,
+                                                  padding="none")
+    decryptor = aescipher.AESCBCDecryptor(key, iv, padding="none")
+    assert chunked(decryptor, encrypted, 10) == data
+
+    encryptor = aescipher.AESCBCEncryptor(key, iv, padding="none")
+    encryptor.update(data[:-1])
+    with pytest.raises(ValueError, match="final block"):
+        encryptor.finalize()
+
+
+def test_chunked_empty_input():
+    key, iv = os.urandom(32), os.urandom(16)
+    encrypted = aescipher.AESCBCEncryptor(key, iv).finalize()
+    assert encrypted == aescipher.aes_cbc_encrypt(key, iv, b"")
+    with pytest.raises(ValueError, match="invalid length"):
+        aescipher.AESCBCDecryptor(key, iv).finalize()
+
+
+def test_chunked_finalize_once():
+    key, iv = os.urandom(32), os.urandom(16)
+    encryptor = aescipher.AESCBCEncryptor(key, iv)
+    encryptor.finalize()
+    with pytest.raises(ValueError, match="already finalized"):
+        encryptor.update(b"data")
+    with pytest.raises(ValueError, match="already finalized"):
+        encryptor.finalize()
+
+
+def test_stream():
+    key, iv, data = os.urandom(32), os.urandom(16), os.urandom(100000)
+    encrypted = io.BytesIO()
+    written = aescipher.aes_cbc_stream(
+        aescipher.AESCBCEncryptor(key, iv), io.BytesIO(data), encrypted,
+        chunk_size=1000)
+    assert written == len(encrypted.getvalue())
+    assert encrypted.getvalue() == aescipher.aes_cbc_encrypt(key, iv, data)
+
+    decrypted = io.BytesIO()
+    encrypted.seek(0)
+    aescipher.aes_cbc_stream(aescipher.AESCBCDecryptor(key, iv), encrypted,
+                             decrypted, chunk_size=999)
+    assert decrypted.getvalue() == data
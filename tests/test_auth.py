@@ -0,0 +1,281 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from kindle import auth as auth_module
+from kindle.auth import Authenticator
+
+
+def expired_auth():
+    auth = Authenticator()
+    auth.locale = "us"
+    auth.refresh_token = "Atnr|refresh"
+    auth.access_token = "Atna|old"
+    auth.expires = 0.0
+    return auth
+
+
+def new_token(number):
+    expires = (datetime.utcnow() + timedelta(hours=1)).timestamp()
+    return {"access_token": f"Atna|new{number}", "expires": expires}
+
+
+def test_repr_hides_private_attributes():
+    auth = expired_auth()
+    assert "_refresh_lock" not in repr(auth)
+    assert "Atnr|refresh" in repr(auth)
+
+
+def test_refresh_is_single_flight(monkeypatch):
+    calls = []
+
+    def refresh(refresh_token, domain):
+        calls.append(domain)
+        time.sleep(0.1)
+        return new_token(len(calls))
+
+    monkeypatch.setattr(auth_module, "refresh_access_token", refresh)
+    auth = expired_auth()
+    threads = [threading.Thread(target=auth.refresh_access_token)
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ["com"]
+    assert auth.access_token == "Atna|new1"
+    assert not auth.access_token_expired
+
+    auth.refresh_access_token(force=True)
+    assert auth.access_token == "Atna|new2"
+
+
+def test_async_refresh_is_single_flight(monkeypatch):
+    calls = []
+
+    async def refresh(refresh_token, domain):
+        calls.append(domain)
+        await asyncio.sleep(0.1)
+        return new_token(len(calls))
+
+    monkeypatch.setattr(auth_module, "async_refresh_access_token", refresh)
+    auth = expired_auth()
+
+    async def main():
+        await asyncio.gather(
+            *(auth.async_refresh_access_token() for _ in range(8)))
+
+    asyncio.run(main())
+    assert calls == ["com"]
+    assert auth.access_token == "Atna|new1"
+
+
+def test_refresh_is_shared_by_threads_and_event_loops(monkeypatch):
+    calls = []
+
+    def refresh(refresh_token, domain):
+        calls.append("sync")
+        time.sleep(0.3)
+        return new_token(len(calls))
+
+    async def async_refresh(refresh_token, domain):
+        calls.append("async")
+        await asyncio.sleep(0.3)
+        return new_token(len(calls))
+
+    monkeypatch.setattr(auth_module, "refresh_access_token", refresh)
+    monkeypatch.setattr(auth_module, "async_refresh_access_token",
+                        async_refresh)
+    auth = expired_auth()
+
+    async def main():
+        ticks = []
+
+        async def tick():
+            while len(ticks) < 5:
+                ticks.append(1)
+                await asyncio.sleep(0.02)
+
+        await asyncio.gather(
+            tick(), *(auth.async_refresh_access_token() for _ in range(4)))
+        return ticks
+
+    thread = threading.Thread(target=auth.refresh_access_token)
+    thread.start()
+    time.sleep(0.05)
+    # the loop keeps running while it waits for the sync refresh
+    loops = [threading.Thread(target=lambda: asyncio.run(main()))
+             for _ in range(2)]
+    start = time.monotonic()
+    for loop in loops:
+        loop.start()
+    for t in [thread] + loops:
+        t.join()
+
+    assert calls == ["sync"]
+    assert time.monotonic() - start < 0.5
+    assert auth.access_token == "Atna|new1"
+
+    auth.expires = 0.0
+    results = []
+    loops = [threading.Thread(target=lambda: results.append(
+        asyncio.run(main()))) for _ in range(2)]
+    for loop in loops:
+        loop.start()
+    for loop in loops:
+        loop.join()
+    assert calls == ["sync", "async"]
+    assert len(results) == 2
+
+
+def test_failed_refresh_is_raised_by_all_waiters(monkeypatch):
+    calls = []
+
+    def refresh(refresh_token, domain):
+        calls.append(domain)
+        time.sleep(0.1)
+        if len(calls) == 1:
+            raise ValueError("refresh failed")
+        return new_token(len(calls))
+
+    monkeypatch.setattr(auth_module, "refresh_access_token", refresh)
+    auth = expired_auth()
+    errors = []
+
+    def run():
+        try:
+            auth.refresh_access_token()
+        except ValueError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1 and len(errors) == 4
+    auth.refresh_access_token()
+    assert auth.access_token == "Atna|new2"
+
+
+def test_cancelled_waiter_keeps_refresh_running(monkeypatch):
+    async def refresh(refresh_token, domain):
+        await asyncio.sleep(0.1)
+        return new_token(1)
+
+    monkeypatch.setattr(auth_module, "async_refresh_access_token", refresh)
+    auth = expired_auth()
+
+    async def main():
+        owner = asyncio.ensure_future(auth.async_refresh_access_token())
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(auth.async_refresh_access_token())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await owner
+        return waiter.cancelled()
+
+    assert asyncio.run(main())
+    assert auth.access_token == "Atna|new1"
+
+
+def test_refresh_without_refresh_token():
+    auth = expired_auth()
+    auth.refresh_token = None
+    with pytest.raises(auth_module.NoRefreshToken):
+        auth.refresh_access_token()
+
+
+def test_refresh_scheduler(monkeypatch):
+    refreshed = threading.Event()
+    calls = []
+
+    def refresh(refresh_token, domain):
+        calls.append(domain)
+        if len(calls) == 1:
+            raise RuntimeError("temporary failure")
+        refreshed.set()
+        return {"access_token": "Atna|new",
+                "expires": (datetime.utcnow()
+                            + timedelta(hours=2)).timestamp()}
+
+    monkeypatch.setattr(auth_module, "refresh_access_token", refresh)
+    auth = expired_auth()
+    auth.expires = (datetime.utcnow() + timedelta(minutes=2)).timestamp()
+
+    # due at once, the first attempt fails and is retried
+    auth.start_refresh_scheduler(margin=300, jitter=0, retry_interval=0.05)
+    try:
+        assert auth.refresh_scheduler_running
+        assert refreshed.wait(5)
+        time.sleep(0.05)
+        assert len(calls) == 2
+        assert auth.access_token == "Atna|new"
+        # the next refresh is scheduled shortly before the new expiration
+        assert auth._refresh_entry[0] - time.monotonic() > 3600
+    finally:
+        auth.stop_refresh_scheduler()
+    assert not auth.refresh_scheduler_running
+
+
+def test_refresh_scheduler_requires_refresh_token():
+    auth = expired_auth()
+    auth.refresh_token = None
+    with pytest.raises(auth_module.NoRefreshToken):
+        auth.start_refresh_scheduler()
+    auth.refresh_token = "Atnr|refresh"
+    with pytest.raises(ValueError):
+        auth.start_refresh_scheduler(retry_interval=0)
+
+
+def test_due_scheduled_refresh_is_not_skipped(monkeypatch):
+    calls = []
+
+    def refresh(refresh_token, domain):
+        calls.append(domain)
+        return new_token(len(calls))
+
+    monkeypatch.setattr(auth_module, "refresh_access_token", refresh)
+    jitter = iter([120.0, 0.0, 0.0])
+    monkeypatch.setattr(auth_module.random, "uniform",
+                        lambda a, b: next(jitter))
+    auth = expired_auth()
+    auth.expires = (datetime.utcnow() + timedelta(minutes=10)).timestamp()
+
+    auth.start_refresh_scheduler(margin=300, jitter=120)
+    try:
+        schedule = auth._refresh_schedule
+        # due, a new jitter draw must not postpone it
+        auth._run_scheduled_refresh(schedule)
+        assert calls == ["com"]
+
+        # refreshed by another caller before the entry was due
+        auth.refresh_access_token(force=True)
+        auth._run_scheduled_refresh(schedule)
+        assert len(calls) == 2
+    finally:
+        auth.stop_refresh_scheduler()
+
+
+def test_refresh_schedulers_share_one_thread(monkeypatch):
+    def refresh(refresh_token, domain):
+        return new_token(0)
+
+    monkeypatch.setattr(auth_module, "refresh_access_token", refresh)
+    auths = [expired_auth() for _ in range(20)]
+    for auth in auths:
+        auth.expires = (datetime.utcnow() + timedelta(hours=1)).timestamp()
+        auth.start_refresh_scheduler()
+    try:
+        names = [t.name for t in threading.enumerate()]
+        assert names.count("kindle-refresh-scheduler") == 1
+        assert all(auth.refresh_scheduler_running for auth in auths)
+    finally:
+        for auth in auths:
+            auth.stop_refresh_scheduler()
+    assert not any(auth.refresh_scheduler_running for auth in auths)
@@ -0,0 +1,93 @@
+import threading
+import time
+import zipfile
+
+import pytest
+from conftest import add_book, part_body
+
+from kindle.bulk import download_ebooks
+from kindle.cache import ManifestCache
+from kindle.client import KindleClient, NO_RETRY
+from kindle.exceptions import ServerError
+
+
+def test_download_ebooks(book_server, auth, tmp_path):
+    for asin in ("B001", "B002"):
+        add_book(book_server, asin)
+    add_book(book_server, "B003", fail=True)
+    progress = []
+
+    with KindleClient(auth, retry=NO_RETRY) as client:
+        summary = download_ebooks(
+            client, ["b002", "B001", "B003", "B002"], target_dir=tmp_path,
+            concurrency=2,
+            progress=lambda item, done, total: progress.append((done, total)))
+
+    assert [item.asin for item in summary.items] == ["B002", "B001", "B003"]
+    assert [item.asin for item in summary.succeeded] == ["B002", "B001"]
+    [failed] = summary.failed
+    assert isinstance(failed.error, ServerError) and failed.path is None
+    assert progress == [(1, 3), (2, 3), (3, 3)]
+    assert str(summary).startswith("3 items in")
+
+    for item in summary.succeeded:
+        assert item.path == tmp_path / f"{item.asin}_EBOK.kfx-zip"
+        with zipfile.ZipFile(item.path) as zf:
+            assert zf.read(f"{item.asin}_EBOK.azw") == \
+                part_body(item.asin, "base")
+
+
+def test_download_ebooks_from_library(book_server, auth, tmp_path):
+    add_book(book_server, "B001")
+    library = {"add_update_list": {"meta_data": [
+        {"ASIN": "B001", "cde_contenttype": "EBOK"},
+        {"ASIN": "B002", "cde_contenttype": "PDOC"},
+    ]}}
+    summary = download_ebooks(auth, library, target_dir=tmp_path)
+    assert [item.asin for item in summary.succeeded] == ["B001"]
+    assert not summary.failed
+
+
+def test_max_requests_per_host(book_server, auth, tmp_path):
+    asins = [f"B{i:03d}" for i in range(6)]
+    for asin in asins:
+        add_book(book_server, asin)
+
+    lock = threading.Lock()
+    running = [0, 0]  # current, peak
+
+    def limited(route):
+        def handle(handler):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            route(handler)
+        return handle
+
+    for path, route in list(book_server.routes.items()):
+        book_server.routes[path] = limited(route)
+
+    summary = download_ebooks(auth, asins, target_dir=tmp_path,
+                              concurrency=6, max_requests_per_host=2)
+    assert len(summary.succeeded) == 6
+    assert running[1] == 2
+
+
+def test_manifest_cache_is_reused(book_server, auth, tmp_path):
+    add_book(book_server, "B001")
+    cache = ManifestCache()
+    with KindleClient(auth) as client:
+        download_ebooks(client, ["B001"], target_dir=tmp_path,
+                        manifest_cache=cache)
+        download_ebooks(client, ["B001"], target_dir=tmp_path,
+                        manifest_cache=cache)
+    manifests = [r for r in book_server.requests if r.startswith("/manifest")]
+    assert manifests == ["/manifest/B001"]
+
+
+def test_invalid_concurrency(auth):
+    with pytest.raises(ValueError):
+        download_ebooks(auth, ["B001"], concurrency=0)
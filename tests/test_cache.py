@@ -0,0 +1,221 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from conftest import add_book
+
+from kindle import api, async_api
+from kindle import cache as cache_module
+from kindle.cache import ManifestCache, ResponseCache, manifest_expiry
+from kindle.client import AsyncKindleClient, KindleClient
+
+
+def manifest(*urls, issued=None):
+    issued = time.time() if issued is None else issued
+    return {
+        "content": {"id": "B001"},
+        "responseContext": {"manifestTime": str(int(issued * 1000))},
+        "resources": [{"id": str(i), "endpoint": {"url": url}}
+                      for i, url in enumerate(urls)]
+    }
+
+
+def test_manifest_expiry():
+    now = time.time()
+    assert manifest_expiry(manifest(issued=now - 600), max_age=3600) == \
+        pytest.approx(now + 3000, abs=2)
+
+    signed = f"https://host/part?Expires={int(now) + 1000}&Signature=x"
+    assert manifest_expiry(manifest(signed), margin=100) == \
+        pytest.approx(now + 900, abs=2)
+
+    amz_date = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(now))
+    presigned = f"https://host/part?X-Amz-Date={amz_date}&X-Amz-Expires=500"
+    assert manifest_expiry(manifest(signed, presigned), margin=100) == \
+        pytest.approx(now + 400, abs=2)
+
+
+def test_manifest_cache_returns_copies():
+    cache = ManifestCache()
+    cache.put("b001", "SERIAL", {}, manifest())
+    first = cache.get("B001", "SERIAL", api._parse_manifest)
+    first["content"]["id"] = "changed"
+    assert cache.get("B001", "SERIAL", api._parse_manifest)["content"] == \
+        {"id": "B001"}
+    assert cache.get("B001", "OTHER", api._parse_manifest) is None
+
+
+def test_manifest_cache_expiry():
+    cache = ManifestCache(max_age=0.2, margin=0)
+    cache.put("B001", "SERIAL", {}, manifest())
+    assert cache.get("B001", "SERIAL", api._parse_manifest) is not None
+    time.sleep(0.3)
+    assert cache.get("B001", "SERIAL", api._parse_manifest) is None
+    assert len(cache) == 0
+
+    # an almost expired signed url is never cached
+    cache = ManifestCache(margin=120)
+    url = f"https://host/part?Expires={int(time.time()) + 60}"
+    cache.put("B002", "SERIAL", {}, manifest(url))
+    assert len(cache) == 0
+
+
+def test_manifest_cache_lru_and_invalidate():
+    cache = ManifestCache(max_entries=2)
+    for asin in ("B001", "B002"):
+        cache.put(asin, "SERIAL", {}, manifest())
+    cache.get("B001", "SERIAL", api._parse_manifest)
+    cache.put("B003", "SERIAL", {}, manifest())
+    assert cache.get("B002", "SERIAL", api._parse_manifest) is None
+
+    cache.put("B001", "OTHER", {}, manifest())
+    cache.invalidate("b001", "SERIAL")
+    assert cache.get("B001", "SERIAL", api._parse_manifest) is None
+    assert cache.get("B001", "OTHER", api._parse_manifest) is not None
+    cache.invalidate("B001")
+    assert cache.get("B001", "OTHER", api._parse_manifest) is None
+
+
+def test_get_manifest_ebook_with_cache(book_server, auth, tmp_path):
+    raw = add_book(book_server, "B001")
+    cache = ManifestCache(tmp_path)
+    with KindleClient(auth) as client:
+        fetched = api.get_manifest_ebook(client, "b001", cache=cache)
+        cached = api.get_manifest_ebook(client, "B001", cache=cache)
+    assert book_server.requests.count("/manifest/B001") == 1
+    assert fetched == cached
+    assert fetched["responseContext"]["transport"] == "WiFi"
+
+    # the raw response is stored, not the parsed manifest
+    [file] = tmp_path.iterdir()
+    assert json.loads(file.read_text())["manifest"] == raw
+
+    # a new cache loads and parses the stored response
+    loaded = ManifestCache(tmp_path).get("B001", "SERIAL", api._parse_manifest)
+    assert loaded == fetched
+
+
+def test_async_get_manifest_ebook_with_cache(book_server, auth, tmp_path):
+    raw = add_book(book_server, "B001")
+    cache = ManifestCache(tmp_path)
+
+    async def main():
+        async with AsyncKindleClient(auth) as client:
+            return [await async_api.get_manifest_ebook(client, "B001", cache)
+                    for _ in range(2)]
+
+    fetched, cached = asyncio.run(main())
+    assert book_server.requests.count("/manifest/B001") == 1
+    assert fetched == cached
+    [file] = tmp_path.iterdir()
+    assert json.loads(file.read_text())["manifest"] == raw
+
+
+@pytest.fixture
+def news_server(server, monkeypatch):
+    """Serves ``/news`` with ``server.headers``; answers a matching
+    ``If-None-Match`` with 304.
+    """
+    server.headers = []
+    server.conditional = []
+
+    def news(handler):
+        etag = handler.headers.get("If-None-Match")
+        server.conditional.append(etag)
+        if etag is not None and ("ETag", etag) in server.headers:
+            handler.reply(304, headers=server.headers)
+        else:
+            handler.reply(200, b'{"news": 1}',
+                          [("Content-Type", "application/json")]
+                          + server.headers)
+
+    server.routes["/news"] = news
+    monkeypatch.setattr(api, "NEWS_URL", f"{server.url}/news")
+    monkeypatch.setattr(async_api, "NEWS_URL", f"{server.url}/news")
+    return server
+
+
+def test_fresh_response_is_cached(news_server, auth):
+    news_server.headers = [("Cache-Control", "max-age=60")]
+    cache = ResponseCache()
+    with KindleClient(auth) as client:
+        assert api.get_news(client, cache=cache) == {"news": 1}
+        assert api.get_news(client, cache=cache) == {"news": 1}
+    assert len(news_server.requests) == 1
+    assert (cache.hits, cache.revalidated, cache.misses) == (1, 0, 1)
+
+
+def test_stale_response_is_revalidated(news_server, auth):
+    news_server.headers = [("Cache-Control", "no-cache"), ("ETag", '"v1"')]
+    cache = ResponseCache()
+    with KindleClient(auth) as client:
+        for _ in range(3):
+            assert api.get_news(client, cache=cache) == {"news": 1}
+    assert news_server.conditional == [None, '"v1"', '"v1"']
+    assert (cache.hits, cache.revalidated, cache.misses) == (0, 2, 1)
+
+    # a changed resource replaces the cached body
+    news_server.headers = [("ETag", '"v2"')]
+    with KindleClient(auth) as client:
+        api.get_news(client, cache=cache)
+    assert cache.misses == 2
+
+
+def test_no_store_is_not_cached(news_server, auth):
+    news_server.headers = [("Cache-Control", "no-store, max-age=60")]
+    cache = ResponseCache()
+    with KindleClient(auth) as client:
+        api.get_news(client, cache=cache)
+        api.get_news(client, cache=cache)
+    assert len(news_server.requests) == 2
+    assert len(cache) == 0
+
+
+def test_disk_cache(news_server, auth, tmp_path):
+    news_server.headers = [("Cache-Control", "max-age=60")]
+    with KindleClient(auth) as client:
+        api.get_news(client, cache=ResponseCache(tmp_path))
+        cache = ResponseCache(tmp_path)
+        assert api.get_news(client, cache=cache) == {"news": 1}
+    assert len(news_server.requests) == 1
+    assert cache.hits == 1
+
+
+def test_async_revalidation(news_server, auth):
+    news_server.headers = [("Cache-Control", "max-age=0"), ("ETag", '"v1"')]
+    cache = ResponseCache()
+
+    async def main():
+        async with AsyncKindleClient(auth) as client:
+            return [await async_api.get_news(client, cache=cache)
+                    for _ in range(2)]
+
+    assert asyncio.run(main()) == [{"news": 1}, {"news": 1}]
+    assert news_server.conditional == [None, '"v1"']
+    assert cache.revalidated == 1
+
+
+def test_memory_size_bound():
+    cache = ResponseCache(max_size=100)
+    for i in range(5):
+        response = httpx.Response(
+            200, headers={"Cache-Control": "max-age=60"},
+            content=b"x" * 40,
+            request=httpx.Request("GET", f"https://host/{i}"))
+        response.read()
+        cache.update(str(i), None, response)
+    assert len(cache) == 2
+    assert cache.lookup("0") is None
+    assert cache.lookup("4").content == b"x" * 40
+
+
+def test_freshness_lifetime():
+    assert cache_module._freshness_lifetime(
+        {"age": "10"}, {"max-age": "60"}) == 50
+    assert cache_module._freshness_lifetime(
+        {"date": "Mon, 01 Jan 2024 00:00:00 GMT",
+         "expires": "Mon, 01 Jan 2024 00:05:00 GMT"}, {}) == 300
+    assert cache_module._freshness_lifetime({}, {"no-cache": None}) == 0
+    assert cache_module._freshness_lifetime({}, {}) == 0
@@ -0,0 +1,260 @@
+import asyncio
+import socket
+import threading
+import time
+
+import httpx
+import pytest
+
+from kindle import api, async_api
+from kindle.client import (
+    AsyncKindleClient, KindleClient, NO_RETRY, RetryPolicy, _Retrier,
+    _retry_after
+)
+from kindle.exceptions import (
+    BadRequest, NetworkError, NotFoundError, RatelimitError, ServerError,
+    Unauthorized, UnexpectedError
+)
+
+
+FAST = RetryPolicy(max_retries=3, backoff=0)
+
+
+def flaky(server, path, statuses, headers=()):
+    """Answers `path` with `statuses` one after another, then with 200."""
+    statuses = list(statuses)
+
+    def handle(handler):
+        if statuses:
+            handler.reply(statuses.pop(0), b'{"error": "x"}', headers)
+        else:
+            handler.reply(200, b"ok")
+
+    server.routes[path] = handle
+
+
+def test_failed_requests_are_retried(server, auth):
+    flaky(server, "/flaky", [503, 500])
+    with KindleClient(auth, retry=FAST) as client:
+        assert client.get(f"{server.url}/flaky").content == b"ok"
+        assert client.retries == 2
+    assert server.requests == ["/flaky"] * 3
+
+
+def test_max_retries(server, auth):
+    flaky(server, "/flaky", [503] * 5)
+    with KindleClient(auth, retry=FAST) as client:
+        with pytest.raises(ServerError):
+            client.get(f"{server.url}/flaky")
+    assert len(server.requests) == 4
+
+
+@pytest.mark.parametrize("status, error", [
+    (400, BadRequest), (401, Unauthorized), (403, Unauthorized),
+    (404, NotFoundError), (429, RatelimitError), (500, ServerError),
+    (418, UnexpectedError),
+])
+def test_status_errors(server, auth, status, error):
+    flaky(server, "/error", [status, status])
+    with KindleClient(auth, retry=NO_RETRY) as client:
+        with pytest.raises(error) as excinfo:
+            client.get(f"{server.url}/error")
+        with pytest.raises(error):
+            with client.stream("GET", f"{server.url}/error"):
+                pass
+    assert excinfo.value.response.status_code == status
+
+
+def test_client_errors_are_not_retried(server, auth):
+    flaky(server, "/missing", [404])
+    with KindleClient(auth, retry=FAST) as client:
+        with pytest.raises(NotFoundError):
+            client.get(f"{server.url}/missing")
+        assert client.retries == 0
+
+
+def test_retry_after(server, auth, monkeypatch):
+    delays = []
+    monkeypatch.setattr("kindle.client.time.sleep", delays.append)
+    flaky(server, "/busy", [429], [("Retry-After", "7")])
+    flaky(server, "/gone", [503], [("Retry-After", "3600")])
+
+    with KindleClient(auth, retry=FAST) as client:
+        assert client.get(f"{server.url}/busy").content == b"ok"
+        # waiting longer than max_retry_after raises at once
+        with pytest.raises(ServerError):
+            client.get(f"{server.url}/gone")
+    assert delays == [7.0]
+    assert server.requests == ["/busy", "/busy", "/gone"]
+
+
+def test_retry_after_header_formats():
+    def response(value):
+        return httpx.Response(503, headers={"Retry-After": value})
+
+    assert _retry_after(response("12")) == 12.0
+    assert _retry_after(response("-1")) == 0.0
+    assert _retry_after(response("Wed, 21 Oct 2015 07:28:00 GMT")) == 0.0
+    assert _retry_after(response("soon")) is None
+    assert _retry_after(httpx.Response(503)) is None
+
+
+def test_only_idempotent_methods_are_retried():
+    retrier = _Retrier(FAST)
+    request = httpx.Request("POST", "http://127.0.0.1/")
+    response = httpx.Response(503)
+    assert retrier.delay("GET", 0, response) is not None
+    assert retrier.delay("POST", 0, response) is None
+    timeout = httpx.ReadTimeout("x", request=request)
+    assert retrier.delay("POST", 0, exc=timeout) is None
+    # a request which failed to connect was never sent
+    refused = httpx.ConnectError("x", request=request)
+    assert retrier.delay("POST", 0, exc=refused) is not None
+    assert retrier.delay("GET", 3, response) is None
+
+
+def test_retry_budget():
+    retrier = _Retrier(RetryPolicy(backoff=0, budget_ratio=0.5,
+                                   budget_burst=2))
+    response = httpx.Response(503)
+    assert retrier.delay("GET", 0, response) == 0
+    assert retrier.delay("GET", 0, response) == 0
+    # the burst is used up, two requests earn a new token
+    assert retrier.delay("GET", 0, response) is None
+    retrier.started()
+    assert retrier.delay("GET", 0, response) is None
+    retrier.started()
+    assert retrier.delay("GET", 0, response) == 0
+    assert retrier.retries == 3
+
+    for _ in range(10):
+        retrier.started()
+    assert retrier._tokens == 2
+
+
+def test_backoff_is_capped(monkeypatch):
+    retrier = _Retrier(RetryPolicy(max_retries=10, backoff=1,
+                                   max_backoff=5))
+    monkeypatch.setattr("kindle.client.random.uniform", lambda a, b: b)
+    response = httpx.Response(503)
+    assert [retrier.delay("GET", n, response) for n in range(5)] == [
+        1, 2, 4, 5, 5]
+
+
+def test_connect_errors(auth):
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    with KindleClient(auth, retry=FAST) as client:
+        with pytest.raises(NetworkError):
+            client.get(f"http://127.0.0.1:{port}/")
+        assert client.retries == 3
+
+
+def test_stream_is_retried(server, auth):
+    flaky(server, "/flaky", [502])
+    with KindleClient(auth, retry=FAST) as client:
+        with client.stream("GET", f"{server.url}/flaky") as r:
+            assert r.read() == b"ok"
+        assert client.retries == 1
+
+
+def test_async_retries(server, auth):
+    flaky(server, "/flaky", [503])
+    flaky(server, "/stream", [504])
+    flaky(server, "/broken", [500] * 5)
+
+    async def main():
+        async with AsyncKindleClient(auth, retry=FAST) as client:
+            r = await client.get(f"{server.url}/flaky")
+            assert r.content == b"ok"
+            async with client.stream("GET", f"{server.url}/stream") as r:
+                assert await r.aread() == b"ok"
+            with pytest.raises(ServerError):
+                await client.get(f"{server.url}/broken")
+            return client.retries
+
+    assert asyncio.run(main()) == 5
+
+
+def test_api_functions_raise_status_errors(library_server, auth):
+    library_server.routes["/sync"] = lambda handler: handler.reply(503)
+
+    async def main():
+        async with AsyncKindleClient(auth, retry=NO_RETRY) as client:
+            await async_api.get_library(client, model=False)
+
+    with KindleClient(auth, retry=NO_RETRY) as client:
+        with pytest.raises(ServerError):
+            api.get_library(client, model=False)
+        with pytest.raises(ServerError):
+            list(api.iter_library(client))
+    with pytest.raises(ServerError):
+        asyncio.run(main())
+
+
+def test_pool_stats_count_reused_connections(server, auth):
+    server.routes["/ok"] = lambda handler: handler.reply(200, b"ok")
+    local = server.url.replace("127.0.0.1", "localhost")
+
+    with KindleClient(auth) as client:
+        for _ in range(5):
+            client.get(f"{server.url}/ok")
+        for _ in range(2):
+            client.get(f"{local}/ok")
+        stats = client.pool_stats
+
+        assert stats.as_dict() == {
+            "127.0.0.1": {"requests": 5, "connections": 1, "reused": 4},
+            "localhost": {"requests": 2, "connections": 1, "reused": 1},
+        }
+        assert stats.requests == 7 and stats.connections == 2
+        assert stats.reuse_ratio == pytest.approx(5 / 7)
+
+        stats.reset()
+        assert stats.as_dict() == {} and stats.reuse_ratio == 0.0
+
+
+def test_pool_stats_count_new_connections(server, auth):
+    def closing(handler):
+        handler.reply(200, b"ok", [("Connection", "close")])
+        handler.close_connection = True
+
+    def slow(handler):
+        time.sleep(0.2)
+        handler.reply(200, b"ok")
+
+    server.routes["/close"] = closing
+    server.routes["/slow"] = slow
+
+    with KindleClient(auth) as client:
+        for _ in range(3):
+            client.get(f"{server.url}/close")
+        assert client.pool_stats.as_dict()["127.0.0.1"] == {
+            "requests": 3, "connections": 3, "reused": 0}
+
+        client.pool_stats.reset()
+        threads = [threading.Thread(target=client.get,
+                                    args=(f"{server.url}/slow",))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # parallel requests can't share a HTTP/1.1 connection
+        assert client.pool_stats.connections == 3
+
+
+def test_async_pool_stats(server, auth):
+    server.routes["/ok"] = lambda handler: handler.reply(200, b"ok")
+
+    async def main():
+        async with AsyncKindleClient(auth) as client:
+            for _ in range(4):
+                await client.get(f"{server.url}/ok")
+            return client.pool_stats.as_dict()
+
+    assert asyncio.run(main()) == {
+        "127.0.0.1": {"requests": 4, "connections": 1, "reused": 3}}
@@ -0,0 +1,412 @@
+import io
+import lzma
+import os
+import random
+import struct
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from amazon.ion import simpleion
+from amazon.ion.core import IonType
+from amazon.ion.simple_types import (
+    IonPyBytes, IonPyDict, IonPyList, IonPySymbol
+)
+from conftest import FakeAuth
+
+from kindle import dedrm
+from kindle.aescipher import aes_cbc_encrypt
+
+
+KEY = os.urandom(16)
+COMPRESSED = "com.amazon.drm.Compressed@1.0"
+
+
+class FakeVoucher:
+    secretkey = KEY + os.urandom(16)
+
+
+def annotate(value, *annotations):
+    value.ion_annotations = annotations
+    return value
+
+
+def blob(data, *annotations):
+    return annotate(IonPyBytes.from_value(IonType.BLOB, data), *annotations)
+
+
+def compress(data):
+    compressor = lzma.LZMACompressor(format=lzma.FORMAT_ALONE)
+    return b"\x00" + compressor.compress(data) + compressor.flush()
+
+
+def make_drmion(pages=8, page_size=16 * 1024, seed=0):
+    """Returns a DRMION envelope with all page kinds and its plain text."""
+    rnd = random.Random(seed)
+    metadata = IonPyDict.from_value(
+        IonType.STRUCT, {"encryption_voucher": "voucher1", "size": 1})
+    items = [annotate(metadata, "com.amazon.drm.EnvelopeMetadata@2.0")]
+    expected = b""
+
+    for i in range(pages):
+        page = bytes(rnd.getrandbits(8) for _ in range(200)) \
+            * (page_size // 200)
+        expected += page
+        kind = i % 4
+        if kind < 2:
+            data = compress(page) if kind else page
+            iv = os.urandom(16)
+            item = {"cipher_text": blob(aes_cbc_encrypt(KEY, iv, data),
+                                        COMPRESSED if kind else "raw"),
+                    "cipher_iv": blob(iv)}
+            annotation = "com.amazon.drm.EncryptedPage@2.0"
+        else:
+            data = compress(page) if kind == 3 else page
+            item = {"data": blob(data, COMPRESSED if kind == 3 else "raw")}
+            annotation = "com.amazon.drm.PlainText@2.0"
+        items.append(annotate(IonPyDict.from_value(IonType.STRUCT, item),
+                              annotation))
+
+    envelope = annotate(IonPyList.from_value(IonType.LIST, items),
+                        "com.amazon.drm.Envelope@2.0")
+    doctype = annotate(
+        IonPySymbol.from_value(IonType.SYMBOL,
+                               "com.amazon.drm.ProtectedData@2.0"),
+        "doctype")
+    index = annotate(
+        IonPyList.from_value(IonType.LIST, [IonPyDict.from_value(
+            IonType.STRUCT, {"offset": 1, "length": 2})]),
+        "com.amazon.drm.EnvelopeIndexTable@1.0")
+    data = simpleion.dumps([doctype, envelope, index],
+                           sequence_as_stream=True)
+    return data, expected
+
+
+class TrackingReader(io.BytesIO):
+    """Records the read position whenever a page is written."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.positions = []
+
+
+class TrackingOutput(io.BytesIO):
+    def __init__(self, source):
+        super().__init__()
+        self.source = source
+
+    def write(self, data):
+        self.source.positions.append(self.source.tell())
+        return super().write(data)
+
+
+def test_drmion_decrypts_all_page_kinds():
+    data, expected = make_drmion()
+    vouchers = []
+
+    def on_voucher(name):
+        vouchers.append(name)
+        return FakeVoucher()
+
+    out = io.BytesIO()
+    dedrm.DrmIon(data, on_voucher).parse(out)
+    assert out.getvalue() == expected
+    assert vouchers == ["voucher1"]
+
+
+def test_drmion_reads_envelope_incrementally():
+    data, expected = make_drmion(pages=16)
+    source = TrackingReader(data)
+    out = TrackingOutput(source)
+    dedrm.DrmIon(source, lambda name: FakeVoucher()).parse(out)
+
+    assert out.getvalue() == expected
+    # the first page is written long before the envelope was read
+    assert source.positions[0] < len(data) // 4
+
+
+def test_stream_reader_matches_simpleion():
+    data, _ = make_drmion(pages=4, page_size=1000)
+    loaded = simpleion.loads(data, single_value=False)
+
+    reader = dedrm._IonStreamReader(io.BytesIO(data))
+    events = []
+    values = None
+    for event in reader:
+        events.append(event.ion_type)
+        if event.ion_type is IonType.LIST and values is None:
+            values = list(reader.iter_values())
+
+    # the index table container is skipped without being read
+    assert events == [IonType.SYMBOL, IonType.LIST, IonType.LIST]
+    assert values == list(loaded[1])
+    assert [v.ion_annotations[0].text for v in values] == \
+        [v.ion_annotations[0].text for v in loaded[1]]
+
+
+def test_truncated_lzma_page():
+    page = compress(b"x" * 100000)[:-20]
+    with pytest.raises(Exception, match="Truncated LZMA page"):
+        dedrm.DrmIon(b"", None).processpage(page, None, io.BytesIO(),
+                                            decompress=True, decrypt=False)
+
+
+def protected_value():
+    value = IonPyDict.from_value(IonType.STRUCT, {"voucher": b"x", "mac": 1})
+    value.ion_annotations = ("com.amazon.drm.VoucherEnvelope@1.0",)
+    return simpleion.dumps(value, imports=[dedrm.PROTECTED_DATA_TABLE])
+
+
+def test_catalog_resolves_protected_data_symbols():
+    value = dedrm.get_ion_parser(protected_value(), addprottable=True)
+    assert dict(value) == {"voucher": b"x", "mac": 1}
+    assert value.ion_annotations[0].text == \
+        "com.amazon.drm.VoucherEnvelope@1.0"
+
+    # without the table, the symbols are unknown
+    assert "voucher" not in dedrm.get_ion_parser(protected_value())
+
+
+def test_catalog_is_shared():
+    assert dedrm._ion_catalog(True) is dedrm.PROTECTED_DATA_CATALOG
+    assert dedrm._ion_catalog(False) is dedrm._EMPTY_CATALOG
+    with pytest.raises(TypeError):
+        dedrm.PROTECTED_DATA_CATALOG.register(dedrm.PROTECTED_DATA_TABLE)
+
+
+def test_catalog_concurrent_parsing():
+    data = protected_value()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(
+            lambda _: dict(dedrm.get_ion_parser(data, addprottable=True)),
+            range(200)))
+    assert all(result == {"voucher": b"x", "mac": 1} for result in results)
+
+
+class Unseekable(io.RawIOBase):
+    """A write-only stream, zipfile adds data descriptors to entries."""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+
+def drmion_entry(**kwargs):
+    data, expected = make_drmion(**kwargs)
+    return dedrm.DRMION_MAGIC + data + b"\x00" * 8, expected
+
+
+def make_kfx_zip(path, zip64=False, descriptor=False):
+    """Writes a kfx-zip archive and returns the expected decrypted entries."""
+    first, first_plain = drmion_entry(pages=4, seed=1)
+    second, second_plain = drmion_entry(pages=5, seed=2)
+    entries = [
+        ("voucher.voucher", dedrm.VOUCHER_MAGIC + b"ProtectedData voucher",
+         zipfile.ZIP_STORED),
+        ("book.azw", first, zipfile.ZIP_DEFLATED),
+        ("image.res", os.urandom(5000) * 3, zipfile.ZIP_DEFLATED),
+        ("meta.azw.md", second, zipfile.ZIP_STORED),
+        ("book.manifest", b'{"content": {}}', zipfile.ZIP_DEFLATED),
+    ]
+    expected = {name: data for name, data, _ in entries}
+    expected.update({"book.azw": first_plain, "meta.azw.md": second_plain})
+
+    target = Unseekable() if descriptor else open(path, "wb")
+    with zipfile.ZipFile(target, "w") as zf:
+        for name, data, compression in entries:
+            info = zipfile.ZipInfo(name, date_time=(2021, 1, 1, 0, 0, 0))
+            info.compress_type = compression
+            with zf.open(info, "w", force_zip64=zip64) as entry:
+                entry.write(data)
+    if descriptor:
+        path.write_bytes(target.buffer.getvalue())
+    else:
+        target.close()
+    return expected
+
+
+def read_entries(path):
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        return {info.filename: (zf.read(info), info.compress_type)
+                for info in zf.infolist()}
+
+
+@pytest.mark.parametrize("zip64,descriptor",
+                         [(False, False), (True, False), (False, True),
+                          (True, True)])
+@pytest.mark.parametrize("spool_threshold", [None, 1000])
+def test_process_matches_process_book(tmp_path, zip64, descriptor,
+                                      spool_threshold):
+    source = tmp_path / "book.kfx-zip"
+    expected = make_kfx_zip(source, zip64, descriptor)
+    with zipfile.ZipFile(source) as zf:
+        flags = {info.flag_bits & 0x08 for info in zf.infolist()}
+    assert flags == ({0x08} if descriptor else {0})
+
+    def book():
+        kfx = dedrm.KFXZipBook(str(source), FakeAuth(), spool_threshold,
+                               tmp_path)
+        kfx.voucher = FakeVoucher()
+        return kfx
+
+    legacy = book()
+    legacy.processBook()
+    legacy.getFile(str(tmp_path / "legacy.kfx-zip"))
+    legacy.cleanup()
+    book().process(str(tmp_path / "single.kfx-zip"))
+
+    single = read_entries(tmp_path / "single.kfx-zip")
+    assert single == read_entries(tmp_path / "legacy.kfx-zip")
+    assert {name: data for name, (data, _) in single.items()} == expected
+    # no spooled entries are left behind
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "book.kfx-zip", "legacy.kfx-zip", "single.kfx-zip"]
+
+
+def test_process_copies_entries_without_recompressing(tmp_path):
+    source = tmp_path / "book.kfx-zip"
+    make_kfx_zip(source)
+    kfx = dedrm.KFXZipBook(str(source), FakeAuth())
+    kfx.voucher = FakeVoucher()
+    kfx.process(str(tmp_path / "out.kfx-zip"))
+
+    with zipfile.ZipFile(source) as zin, \
+            zipfile.ZipFile(tmp_path / "out.kfx-zip") as zout:
+        for name in ("voucher.voucher", "image.res", "book.manifest"):
+            a, b = zin.getinfo(name), zout.getinfo(name)
+            assert (a.CRC, a.compress_size) == (b.CRC, b.compress_size)
+
+
+def test_process_finds_a_later_voucher(tmp_path, monkeypatch):
+    source = tmp_path / "book.kfx-zip"
+    drmion, plain = drmion_entry(pages=2)
+    with zipfile.ZipFile(source, "w") as zf:
+        zf.writestr("book.azw", drmion)
+        zf.writestr("voucher.voucher",
+                    dedrm.VOUCHER_MAGIC + b"ProtectedData voucher")
+
+    seen = []
+
+    def decrypt_voucher_data(self, info, data):
+        seen.append(info.filename)
+        self.voucher = FakeVoucher()
+
+    monkeypatch.setattr(dedrm.KFXZipBook, "_decrypt_voucher_data",
+                        decrypt_voucher_data)
+    dedrm.KFXZipBook(str(source), FakeAuth()).process(
+        str(tmp_path / "out.kfx-zip"))
+    assert seen == ["voucher.voucher"]
+    with zipfile.ZipFile(tmp_path / "out.kfx-zip") as zf:
+        assert zf.read("book.azw") == plain
+
+
+def test_append_raw_entry_checks_archive(tmp_path):
+    info = zipfile.ZipInfo("entry")
+    with zipfile.ZipFile(tmp_path / "out.zip", "w") as zf:
+        with zf.open("other", "w"):
+            with pytest.raises(ValueError, match="open writing handle"):
+                dedrm._append_raw_entry(zf, info, io.BytesIO())
+    with pytest.raises(ValueError, match="closed"):
+        dedrm._append_raw_entry(zf, info, io.BytesIO())
+    with zipfile.ZipFile(tmp_path / "out.zip") as zf:
+        with pytest.raises(ValueError, match="requires mode"):
+            dedrm._append_raw_entry(zf, info, io.BytesIO())
+
+
+def test_raw_copy_falls_back_without_zipfile_internals(tmp_path,
+                                                      monkeypatch):
+    source = tmp_path / "book.kfx-zip"
+    expected = make_kfx_zip(source)
+    monkeypatch.setattr(dedrm, "_raw_append_supported", lambda zof: False)
+    kfx = dedrm.KFXZipBook(str(source), FakeAuth())
+    kfx.voucher = FakeVoucher()
+    kfx.process(str(tmp_path / "out.kfx-zip"))
+
+    entries = read_entries(tmp_path / "out.kfx-zip")
+    assert {name: data for name, (data, _) in entries.items()} == expected
+
+
+def test_raw_append_checks_zipfile_internals(tmp_path):
+    with zipfile.ZipFile(tmp_path / "out.zip", "w") as zf:
+        assert dedrm._raw_append_supported(zf)
+        writing = zf._writing
+        del zf._writing
+        try:
+            assert not dedrm._raw_append_supported(zf)
+            with pytest.raises(RuntimeError, match="internals"):
+                dedrm._append_raw_entry(
+                    zf, zipfile.ZipInfo("x"), io.BytesIO())
+        finally:
+            zf._writing = writing
+
+
+def extra_ids(extra):
+    ids = []
+    while len(extra) >= 4:
+        tp, ln = struct.unpack("<HH", extra[:4])
+        ids.append(tp)
+        extra = extra[4 + ln:]
+    return ids
+
+
+def local_extra_ids(path):
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as fp:
+        result = {}
+        for info in zf.infolist():
+            fp.seek(info.header_offset)
+            header = dedrm._LOCAL_FILE_HEADER.unpack(
+                fp.read(dedrm._LOCAL_FILE_HEADER.size))
+            fp.seek(header[10], os.SEEK_CUR)
+            result[info.filename] = extra_ids(fp.read(header[11]))
+        return result
+
+
+class LegacySpool(io.BytesIO):
+    """Behaves like SpooledTemporaryFile on Python 3.6."""
+
+    def seek(self, *args):
+        super().seek(*args)
+
+
+@pytest.mark.parametrize("outfile", [
+    b"decrypted" * 100, io.BytesIO(b"decrypted" * 100),
+    LegacySpool(b"decrypted" * 100)
+], ids=["bytes", "file", "legacy-spool"])
+def test_write_entry_drops_the_zip64_extra(tmp_path, outfile):
+    # e.g. an entry behind the 4 GiB offset of a large source archive
+    zip64 = struct.pack("<HHQ", 1, 8, 2 ** 33)
+    other = struct.pack("<HH2s", 0xCAFE, 2, b"ok")
+    info = zipfile.ZipInfo("book.azw", date_time=(2021, 1, 1, 0, 0, 0))
+    info.extra = zip64 + other
+    info.file_size = info.compress_size = 2 ** 33
+
+    kfx = dedrm.KFXZipBook(None, FakeAuth())
+    with zipfile.ZipFile(tmp_path / "out.zip", "w") as zof:
+        kfx._write_entry(None, zof, info, outfile)
+
+    assert local_extra_ids(tmp_path / "out.zip") == {"book.azw": [0xCAFE]}
+    with zipfile.ZipFile(tmp_path / "out.zip") as zf:
+        assert zf.read("book.azw") == b"decrypted" * 100
+    assert info.extra == zip64 + other
+
+
+def test_write_entry_with_spooled_file(tmp_path):
+    source = tmp_path / "in.zip"
+    with zipfile.ZipFile(source, "w") as zf:
+        zf.writestr("book.azw", b"encrypted")
+
+    kfx = dedrm.KFXZipBook(str(source), FakeAuth(), spool_threshold=10)
+    with zipfile.ZipFile(source) as zif, \
+            zipfile.ZipFile(tmp_path / "out.zip", "w") as zof:
+        kfx._write_entry(zif, zof, zif.getinfo("book.azw"),
+                         LegacySpool(b"x" * 100))
+
+    with zipfile.ZipFile(tmp_path / "out.zip") as zf:
+        assert zf.getinfo("book.azw").file_size == 100
+        assert zf.read("book.azw") == b"x" * 100
@@ -0,0 +1,390 @@
+import asyncio
+import json
+import time
+import zipfile
+
+import httpx
+import pytest
+
+from kindle import api, async_api
+from kindle.client import AsyncKindleClient, KindleClient, NO_RETRY
+from kindle.exceptions import ServerError
+
+
+def body_of(name):
+    return (name.encode() * 1000)[:5000]
+
+
+def serve_parts(server, names, fail=()):
+    def route(name):
+        def handle(handler):
+            if name in fail:
+                handler.reply(500)
+            else:
+                handler.reply(200, body_of(name))
+        return handle
+
+    for name in names:
+        server.routes[f"/{name}"] = route(name)
+
+
+def manifest(server, attachables=4):
+    resources = [
+        {"id": "v1", "type": "DRM_VOUCHER", "requirement": "REQUIRED",
+         "endpoint": {"url": f"{server.url}/voucher?v=1"}},
+        {"id": "b", "type": "KINDLE_MAIN_BASE", "requirement": "REQUIRED",
+         "optimalEndpoint": {"directUrl": f"{server.url}/base"}},
+    ]
+    resources += [
+        {"id": f"r{i}", "type": "KINDLE_MAIN_ATTACHABLE",
+         "requirement": "DEFERRED",
+         "endpoint": {"url": f"{server.url}/r{i}"}}
+        for i in range(attachables)
+    ]
+    return {
+        "content": {"id": "B00TEST"},
+        "responseContext": {"manifestTime": "1", "transport": "WiFi",
+                            "reason": "x", "swVersion": "1"},
+        "resources": resources
+    }
+
+
+PARTS = ["voucher", "base", "r0", "r1", "r2", "r3"]
+
+
+def entries(path):
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+def test_concurrent_download_keeps_manifest_order(server, auth, tmp_path):
+    serve_parts(server, PARTS)
+    (tmp_path / "seq").mkdir()
+    (tmp_path / "con").mkdir()
+    with KindleClient(auth) as client:
+        sequential = api.download_ebook(
+            client, manifest(server), target_dir=tmp_path / "seq")
+        concurrent = api.download_ebook(
+            client, manifest(server), concurrency=3,
+            target_dir=tmp_path / "con")
+
+    with zipfile.ZipFile(sequential) as a, zipfile.ZipFile(concurrent) as b:
+        assert a.namelist() == b.namelist()
+    files = entries(concurrent)
+    assert files == entries(sequential)
+    for name in PARTS:
+        assert body_of(name) in files.values()
+
+
+def test_concurrent_download_failure_cleans_up(server, auth, tmp_path):
+    serve_parts(server, PARTS, fail={"r2"})
+    with KindleClient(auth, retry=NO_RETRY) as client:
+        with pytest.raises(ServerError):
+            api.download_ebook(client, manifest(server), concurrency=3,
+                               target_dir=tmp_path)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_async_concurrent_download(server, auth, tmp_path):
+    serve_parts(server, PARTS)
+
+    async def main():
+        async with AsyncKindleClient(auth) as client:
+            return await async_api.download_ebook(
+                client, manifest(server), concurrency=3, target_dir=tmp_path)
+
+    files = entries(asyncio.run(main()))
+    for name in PARTS:
+        assert body_of(name) in files.values()
+
+
+def test_async_concurrent_download_failure_cleans_up(server, auth, tmp_path):
+    serve_parts(server, PARTS, fail={"r1"})
+
+    async def main():
+        async with AsyncKindleClient(auth, retry=NO_RETRY) as client:
+            await async_api.download_ebook(
+                client, manifest(server), concurrency=3, target_dir=tmp_path)
+
+    with pytest.raises(ServerError):
+        asyncio.run(main())
+    assert list(tmp_path.iterdir()) == []
+
+
+def serve_dropping(server, name, honor_range=True):
+    """Serves `name` and drops the first connection after 1000 bytes."""
+    body = body_of(name)
+    drops = [1]
+
+    def handle(handler):
+        start = 0
+        rng = handler.headers.get("Range")
+        if rng and honor_range:
+            start = int(rng.split("=")[1].split("-")[0])
+            handler.send_response(206)
+            handler.send_header(
+                "Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+        else:
+            handler.send_response(200)
+        handler.send_header("Content-Length", str(len(body) - start))
+        handler.end_headers()
+        if drops:
+            drops.pop()
+            handler.wfile.write(body[start:start + 1000])
+            handler.wfile.flush()
+            handler.close_connection = True
+            return
+        handler.wfile.write(body[start:])
+
+    server.routes[f"/{name}"] = handle
+
+
+@pytest.mark.parametrize("concurrency", [1, 2])
+def test_dropped_part_is_resumed(server, auth, tmp_path, concurrency):
+    serve_parts(server, PARTS)
+    serve_dropping(server, "base")
+    with KindleClient(auth) as client:
+        path = api.download_ebook(client, manifest(server),
+                                  concurrency=concurrency, target_dir=tmp_path)
+
+    assert body_of("base") in entries(path).values()
+    assert server.requests.count("/base") == 2
+
+
+def test_dropped_part_without_range_support_restarts(server, auth, tmp_path):
+    # a spooled part can be truncated and fetched again
+    serve_parts(server, PARTS)
+    serve_dropping(server, "base", honor_range=False)
+    with KindleClient(auth) as client:
+        path = api.download_ebook(client, manifest(server), concurrency=2,
+                                  target_dir=tmp_path)
+    assert body_of("base") in entries(path).values()
+
+
+def test_dropped_part_without_range_support_fails_unspooled(server, auth,
+                                                            tmp_path):
+    # a part streamed into the archive can't be rewound
+    serve_parts(server, PARTS)
+    serve_dropping(server, "base", honor_range=False)
+    with KindleClient(auth) as client:
+        with pytest.raises(RuntimeError, match="range requests"):
+            api.download_ebook(client, manifest(server), target_dir=tmp_path)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_dropped_part_is_resumed_with_range(server, auth, tmp_path):
+    serve_parts(server, PARTS)
+    serve_dropping(server, "r0")
+    seen = []
+    handle = server.routes["/r0"]
+
+    def record(handler):
+        seen.append(handler.headers.get("Range"))
+        handle(handler)
+
+    server.routes["/r0"] = record
+    with KindleClient(auth) as client:
+        api.download_ebook(client, manifest(server), concurrency=2,
+                           target_dir=tmp_path)
+    assert seen == [None, "bytes=1000-"]
+
+
+def test_kfx_zip_contents(server, auth, tmp_path):
+    serve_parts(server, PARTS + ["other"])
+    server.routes["/other"] = lambda handler: handler.reply(
+        200, b"other", [("content-disposition",
+                         'attachment; filename="other.bin"')])
+    book = manifest(server, attachables=2)
+    book["resources"].append(
+        {"id": "o", "type": "OTHER", "requirement": "REQUIRED",
+         "endpoint": {"url": f"{server.url}/other"}})
+
+    with KindleClient(auth) as client:
+        path = api.download_ebook(client, book, target_dir=tmp_path)
+
+    assert path == tmp_path / "B00TEST_EBOK.kfx-zip"
+    assert list(tmp_path.iterdir()) == [path]
+    files = entries(path)
+    assert files == {
+        "v1.voucher": body_of("voucher"),
+        "B00TEST_EBOK.azw": body_of("base"),
+        "r0.azw.res": body_of("r0"),
+        "r1.azw.res": body_of("r1"),
+        "other.bin": b"other",
+        "B00TEST.manifest": json.dumps(book).encode(),
+    }
+
+
+def test_kfx_zip_writer_entry_without_size(tmp_path, auth):
+    writer = api._KFXZipWriter(auth, {"content": {"id": "b00test"}}, tmp_path)
+    with writer.open_entry("sized", 3) as entry:
+        entry.write(b"abc")
+    with writer.open_entry("unsized") as entry:
+        entry.write(b"x" * 100000)
+    path = writer.commit({"content": {"id": "b00test"}}, decrypt=False)
+
+    assert entries(path) == {
+        "sized": b"abc", "unsized": b"x" * 100000,
+        "B00TEST.manifest": b'{"content": {"id": "b00test"}}'}
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_kfx_zip_writer_abort_removes_archive(tmp_path, auth):
+    writer = api._KFXZipWriter(auth, {"content": {"id": "B00TEST"}}, tmp_path)
+    with writer.open_entry("part") as entry:
+        entry.write(b"abc")
+    writer.abort()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_concurrent_download_limits_waiting_parts(server, auth, tmp_path):
+    # the first part is slow, later parts must not pile up behind it
+    names = ["voucher", "base"] + [f"r{i}" for i in range(8)]
+    serve_parts(server, names)
+    started = []
+
+    def slow_voucher(handler):
+        time.sleep(0.5)
+        started.append(len(server.requests))
+        handler.reply(200, body_of("voucher"))
+
+    server.routes["/voucher"] = slow_voucher
+    with KindleClient(auth) as client:
+        path = api.download_ebook(client, manifest(server, attachables=8),
+                                  concurrency=2, target_dir=tmp_path)
+
+    assert started == [4]
+    assert len(server.requests) == 10
+    assert len(entries(path)) == 11
+
+
+def test_async_concurrent_download_limits_waiting_parts(server, auth,
+                                                        tmp_path):
+    names = ["voucher", "base"] + [f"r{i}" for i in range(8)]
+    serve_parts(server, names)
+    started = []
+
+    def slow_voucher(handler):
+        time.sleep(0.5)
+        started.append(len(server.requests))
+        handler.reply(200, body_of("voucher"))
+
+    server.routes["/voucher"] = slow_voucher
+
+    async def main():
+        async with AsyncKindleClient(auth) as client:
+            return await async_api.download_ebook(
+                client, manifest(server, attachables=8), concurrency=2,
+                target_dir=tmp_path)
+
+    path = asyncio.run(main())
+    assert started == [4]
+    assert len(entries(path)) == 11
+
+
+def serve_trickling(server, name, seconds):
+    """Serves `name` slowly, a few bytes at a time for `seconds`."""
+    def handle(handler):
+        handler.send_response(200)
+        handler.send_header("Content-Length", "1000000")
+        handler.end_headers()
+        try:
+            for _ in range(int(seconds / 0.05)):
+                handler.wfile.write(b"x" * 100)
+                handler.wfile.flush()
+                time.sleep(0.05)
+        except OSError:
+            pass
+        handler.close_connection = True
+
+    server.routes[f"/{name}"] = handle
+
+
+def test_concurrent_download_failure_stops_running_parts(server, auth,
+                                                         tmp_path,
+                                                         monkeypatch):
+    serve_parts(server, PARTS, fail={"base"})
+    serve_trickling(server, "voucher", seconds=10)
+    # a stalled part is only noticed by the read timeout
+    server.routes["/r0"] = lambda handler: time.sleep(10)
+    monkeypatch.setattr(api, "DOWNLOAD_TIMEOUT",
+                        httpx.Timeout(None, read=0.5))
+
+    start = time.monotonic()
+    with KindleClient(auth, retry=NO_RETRY) as client:
+        with pytest.raises(ServerError):
+            api.download_ebook(client, manifest(server), concurrency=3,
+                               target_dir=tmp_path)
+    assert time.monotonic() - start < 3
+    assert list(tmp_path.iterdir()) == []
+
+
+def serve_wrong_range(server, name):
+    """Drops the first connection of `name` after 1000 bytes and answers
+    range requests with the whole body as 206.
+    """
+    body = body_of(name)
+    drops = [1]
+
+    def handle(handler):
+        if drops:
+            drops.pop()
+            handler.send_response(200)
+            handler.send_header("Content-Length", str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body[:1000])
+            handler.wfile.flush()
+            handler.close_connection = True
+            return
+        if handler.headers.get("Range"):
+            handler.reply(206, body, [
+                ("Content-Range", f"bytes 0-{len(body) - 1}/{len(body)}")])
+        else:
+            handler.reply(200, body)
+
+    server.routes[f"/{name}"] = handle
+
+
+def test_wrong_range_restarts_spooled_part(server, auth, tmp_path):
+    serve_parts(server, PARTS)
+    serve_wrong_range(server, "base")
+    with KindleClient(auth) as client:
+        path = api.download_ebook(client, manifest(server), concurrency=2,
+                                  target_dir=tmp_path)
+
+    assert body_of("base") in entries(path).values()
+    assert server.requests.count("/base") == 3
+
+
+def test_wrong_range_fails_unspooled_part(server, auth, tmp_path):
+    serve_parts(server, PARTS)
+    serve_wrong_range(server, "base")
+    with KindleClient(auth) as client:
+        with pytest.raises(RuntimeError, match="instead of 1000"):
+            api.download_ebook(client, manifest(server), target_dir=tmp_path)
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("value, start", [
+    ("bytes 1000-4999/5000", 1000),
+    ("bytes 0-9/*", 0),
+    ("bytes */5000", None),
+    ("", None),
+])
+def test_content_range_start(value, start):
+    r = httpx.Response(206, headers={"Content-Range": value})
+    assert api._content_range_start(r) == start
+
+
+def test_async_wrong_range_restarts_spooled_part(server, auth, tmp_path):
+    serve_parts(server, PARTS)
+    serve_wrong_range(server, "base")
+
+    async def main():
+        async with AsyncKindleClient(auth) as client:
+            return await async_api.download_ebook(
+                client, manifest(server), concurrency=2, target_dir=tmp_path)
+
+    assert body_of("base") in entries(asyncio.run(main())).values()
+    assert server.requests.count("/base") == 3
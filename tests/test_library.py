@@ -0,0 +1,138 @@
+import asyncio
+from urllib.parse import parse_qs, urlsplit
+from xml.etree import ElementTree
+
+import pytest
+from conftest import library_xml
+
+from kindle import api, async_api
+from kindle.client import AsyncKindleClient, KindleClient
+from kindle.library import LibraryStore
+
+
+def last_sync_param(server):
+    query = parse_qs(urlsplit(server.requests[-1]).query)
+    return query.get("last_sync_time", [None])[0]
+
+
+def test_first_sync_is_full_then_incremental(library_server, auth):
+    store = LibraryStore()
+    library_server.library = library_xml(["B001", "B002"], "T1")
+    with KindleClient(auth) as client:
+        assert store.sync(client) == {"updated": 2, "removed": 0}
+        assert last_sync_param(library_server) is None
+        assert store.sync_time == "T1"
+
+        library_server.library = library_xml(["B003"], "T2",
+                                             removals=["B001"])
+        assert store.sync(client) == {"updated": 1, "removed": 1}
+        assert last_sync_param(library_server) == "T1"
+
+    assert list(store) == ["B002", "B003"]
+    assert store.sync_time == "T2"
+    assert store["b002"]["title"]["#text"] == "Title B002"
+
+
+def test_full_sync_replaces_items(library_server, auth):
+    store = LibraryStore()
+    library_server.library = library_xml(["B001", "B002"], "T1")
+    with KindleClient(auth) as client:
+        store.sync(client)
+        library_server.library = library_xml(["B003"], "T2")
+        store.sync(client, full=True)
+        assert last_sync_param(library_server) is None
+    assert list(store) == ["B003"]
+
+
+def test_apply_and_lookups():
+    store = LibraryStore()
+    library = {
+        "sync_time": "T1",
+        "add_update_list": {"meta_data": [{"ASIN": "B001", "title": "a"},
+                                          {"ASIN": "b002", "title": "b"}]},
+        "removal_list": None,
+    }
+    assert store.apply(library, full=True) == {"updated": 2, "removed": 0}
+    assert len(store) == 2
+    assert "b001" in store and "B002" in store
+    assert store.get("B009") is None
+    assert [item["title"] for item in store.values()] == ["a", "b"]
+    with pytest.raises(KeyError):
+        store["B009"]
+
+    store.clear()
+    assert len(store) == 0
+    assert store.sync_time is None
+
+
+def test_store_is_persistent(tmp_path):
+    fn = tmp_path / "library.db"
+    with LibraryStore(fn) as store:
+        store.apply({"sync_time": "T1",
+                     "add_update_list": {"meta_data": {"ASIN": "B001"}}})
+    with LibraryStore(fn) as store:
+        assert list(store) == ["B001"]
+        assert store.sync_time == "T1"
+
+
+def test_interrupted_sync_leaves_store_untouched(library_server, auth):
+    store = LibraryStore()
+    library_server.library = library_xml(["B001"], "T1")
+    with KindleClient(auth) as client:
+        store.sync(client)
+        library_server.library = library_xml(["B002", "B003"], "T2")[:-40]
+        with pytest.raises(ElementTree.ParseError):
+            store.sync(client)
+    assert list(store) == ["B001"]
+    assert store.sync_time == "T1"
+
+
+def test_stream_parser_matches_xmltodict():
+    body = library_xml(["B001", "B002"], "T1", removals=["B003"])
+    expected = api._parse_xml_response(body.decode())
+
+    parser = api._LibraryStreamParser()
+    events = []
+    # one byte at a time, items are split across chunks
+    for i in range(len(body)):
+        events.extend(parser.feed(body[i:i + 1]))
+    events.extend(parser.close())
+
+    assert events == [
+        ("sync_time", "T1"),
+        *(("add_update_list", item)
+          for item in expected["add_update_list"]["meta_data"]),
+        ("removal_list", expected["removal_list"]["meta_data"]),
+    ]
+
+
+def test_stream_parser_drops_finished_items():
+    parser = api._LibraryStreamParser()
+    body = library_xml([f"B{i:03d}" for i in range(50)])
+    events = list(parser.feed(body[:body.index(b"</add_update_list>")]))
+    assert len(events) >= 49
+    response, section = parser._stack[:2]
+    assert section.tag == "add_update_list"
+    assert len(section) <= 1
+    assert [elem.tag for elem in response] == ["add_update_list"]
+
+
+def test_iter_library(library_server, auth):
+    library_server.library = library_xml(["B001", "B002"], "T1")
+    with KindleClient(auth) as client:
+        events = list(api.iter_library(client, last_sync="T0"))
+    assert [e.section for e in events] == [
+        "sync_time", "add_update_list", "add_update_list"]
+    assert events[1].data["ASIN"] == "B001"
+    assert "last_sync_time=T0" in library_server.requests[-1]
+
+
+def test_async_iter_library(library_server, auth):
+    library_server.library = library_xml(["B001"], "T1")
+
+    async def main():
+        async with AsyncKindleClient(auth) as client:
+            return [event async for event in async_api.iter_library(client)]
+
+    with KindleClient(auth) as client:
+        assert asyncio.run(main()) == list(api.iter_library(client))
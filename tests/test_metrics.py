@@ -0,0 +1,172 @@
+import asyncio
+import threading
+
+import pytest
+
+from kindle import api, async_api
+from kindle.client import AsyncKindleClient, KindleClient, NO_RETRY
+from kindle.exceptions import ServerError
+from kindle.metrics import (
+    Histogram, Metrics, RequestRecord, bind_endpoint, current_endpoint,
+    instrumented
+)
+
+
+def record(endpoint="get_library", status=200, retries=0, elapsed=0.2,
+           size=2048):
+    return RequestRecord(
+        endpoint=endpoint, method="GET", host="example.com", status=status,
+        retries=retries, connect_time=0.01, ttfb=0.05, transfer_time=0.1,
+        elapsed=elapsed, bytes=size)
+
+
+def test_histogram():
+    histogram = Histogram([1, 5])
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.cumulative() == [(1, 2), (5, 3), (float("inf"), 4)]
+    assert histogram.quantile(0.5) == 1
+    assert histogram.quantile(0.75) == 5
+    assert histogram.quantile(1) == float("inf")
+    assert Histogram([1]).quantile(0.5) is None
+
+
+def test_histogram_returns_a_copy():
+    metrics = Metrics()
+    metrics.observe(record())
+    histogram = metrics.histogram("get_library")
+    metrics.observe(record())
+
+    assert histogram.count == 1
+    assert metrics.histogram("get_library").count == 2
+    assert metrics.histogram("get_library", "ttfb").sum == pytest.approx(0.1)
+    assert metrics.histogram("missing") is None
+
+
+def test_snapshot():
+    metrics = Metrics()
+    metrics.observe(record(retries=2))
+    metrics.observe(record(status=None, elapsed=3.0, size=0))
+    metrics.observe(record(endpoint="whispersync", status=404))
+
+    assert metrics.endpoints == ["get_library", "whispersync"]
+    summary = metrics.snapshot()["get_library"]
+    assert summary["requests"] == 2
+    assert summary["statuses"] == {"200": 1, "error": 1}
+    assert summary["retries"] == 2
+    assert summary["bytes"] == 2048
+    assert summary["seconds"]["total"] == pytest.approx(3.2)
+    assert summary["p50"] == 0.25 and summary["p99"] == 5.0
+
+    metrics.reset()
+    assert metrics.snapshot() == {}
+
+
+def test_prometheus_output():
+    metrics = Metrics(time_buckets=[0.1, 1], size_buckets=[1024])
+    metrics.observe(record(endpoint='say "hi"\n'))
+    text = metrics.to_prometheus(prefix="test")
+
+    labels = 'endpoint="say \\"hi\\"\\n"'
+    assert "# TYPE test_request_duration_seconds histogram" in text
+    assert (f'test_request_duration_seconds_bucket{{{labels},'
+            f'phase="total",le="0.1"}} 0') in text
+    assert (f'test_request_duration_seconds_bucket{{{labels},'
+            f'phase="total",le="+Inf"}} 1') in text
+    assert f'test_request_duration_seconds_count{{{labels},' \
+           f'phase="connect"}} 1' in text
+    assert f'test_response_bytes_bucket{{{labels},le="1024.0"}} 0' in text
+    assert f'test_response_bytes_sum{{{labels}}} 2048' in text
+    assert f'test_requests_total{{{labels},status="200"}} 1' in text
+    assert f'test_retries_total{{{labels}}} 0' in text
+    assert text.endswith("\n")
+
+
+def test_callback_errors_are_ignored():
+    seen = []
+
+    def callback(r):
+        seen.append(r)
+        raise RuntimeError("broken")
+
+    metrics = Metrics(callback=callback)
+    metrics.observe(record())
+    assert seen == [record()]
+    assert metrics.snapshot()["get_library"]["requests"] == 1
+
+
+def test_endpoint_labels():
+    @instrumented
+    def outer():
+        return inner(), list(gen())
+
+    @instrumented
+    def inner():
+        return current_endpoint()
+
+    @instrumented
+    def gen():
+        yield current_endpoint()
+
+    assert outer() == ("outer", ["outer"])
+    assert list(gen()) == ["gen"]
+    assert current_endpoint() is None
+
+    @instrumented
+    def submit():
+        worker = bind_endpoint(current_endpoint)
+        result = []
+        thread = threading.Thread(target=lambda: result.append(worker()))
+        thread.start()
+        thread.join()
+        return result
+
+    assert submit() == ["submit"]
+
+
+def test_client_records_requests(library_server, auth):
+    seen = []
+    metrics = Metrics(callback=seen.append)
+    with KindleClient(auth, metrics=metrics) as client:
+        api.get_library(client)
+        list(api.iter_library(client))
+        client.get(f"{library_server.url}/sync")
+
+    assert [r.endpoint for r in seen] == [
+        "get_library", "iter_library", "unknown"]
+    first, second, _ = seen
+    assert first.status == 200 and first.bytes == len(library_server.library)
+    assert first.connect_time > 0 and second.connect_time == 0
+    for r in seen:
+        assert r.host == "127.0.0.1" and r.method == "GET"
+        assert 0 < r.ttfb <= r.elapsed
+
+    assert metrics.histogram("get_library", "connect").count == 1
+
+
+def test_client_records_failed_requests(library_server, auth):
+    library_server.routes["/sync"] = lambda handler: handler.reply(500)
+    metrics = Metrics()
+    with KindleClient(auth, metrics=metrics, retry=NO_RETRY) as client:
+        with pytest.raises(ServerError):
+            api.get_library(client)
+
+    assert metrics.snapshot()["get_library"]["statuses"] == {"500": 1}
+
+
+def test_async_client_records_requests(library_server, auth):
+    seen = []
+
+    async def main():
+        metrics = Metrics(callback=seen.append)
+        async with AsyncKindleClient(auth, metrics=metrics) as client:
+            await async_api.get_library(client)
+            async for _ in async_api.iter_library(client):
+                pass
+
+    asyncio.run(main())
+    assert [r.endpoint for r in seen] == ["get_library", "iter_library"]
+    assert seen[0].connect_time > 0 and seen[1].connect_time == 0
+    assert all(r.status == 200 and r.ttfb > 0 for r in seen)
@@ -0,0 +1,70 @@
+import pytest
+from conftest import library_xml
+
+from kindle import api
+from kindle.client import KindleClient
+from kindle.models import Library, LibraryItem
+
+
+@pytest.fixture
+def library():
+    body = library_xml(["B001", "B002"], "T1", removals=["B003"])
+    return api._parse_xml_response(body.decode())
+
+
+def test_item_from_dict(library):
+    data = library["add_update_list"]["meta_data"][0]
+    item = LibraryItem.from_dict(data)
+    assert item.to_dict() == {
+        "asin": "B001",
+        "title": "Title B001",
+        "authors": ("Author", "Second"),
+        "publishers": (),
+        "publication_date": None,
+        "purchase_date": None,
+        "content_type": None,
+        "cde_contenttype": "EBOK",
+        "origin_type": "Purchase",
+    }
+    assert item.raw is None
+    assert LibraryItem.from_dict(data, keep_raw=True).raw is data
+    with pytest.raises(AttributeError):
+        item.extra = 1
+
+
+def test_library_from_dict(library):
+    model = Library.from_dict(library)
+    assert len(model) == 2
+    assert [item.asin for item in model] == ["B001", "B002"]
+    assert "b002" in model and model["b002"].asin == "B002"
+    assert model.get("B009") is None
+    assert model.removed == ("B003",)
+    assert model.sync_time == "T1"
+    assert model.raw is None
+    assert Library.from_dict(library, keep_raw=True).raw is library
+
+
+def test_library_add_replaces_same_asin():
+    model = Library([LibraryItem("B001", "old"), LibraryItem("B002")])
+    model.add(LibraryItem("b001", "new"))
+    assert [item.title for item in model] == ["new", None]
+
+
+def test_single_item_response():
+    # xmltodict returns a single meta_data element as dict
+    library = {"add_update_list": {"meta_data": {"ASIN": "B001"}}}
+    assert [item.asin for item in Library.from_dict(library)] == ["B001"]
+
+
+def test_get_library_model_matches_dict(library_server, auth):
+    library_server.library = library_xml(["B001", "B002"], "T1",
+                                         removals=["B003"])
+    with KindleClient(auth) as client:
+        raw = api.get_library(client)
+        model = api.get_library(client, model=True, keep_raw=True)
+
+    expected = Library.from_dict(raw)
+    assert list(model) == list(expected)
+    assert model.removed == expected.removed
+    assert model.sync_time == expected.sync_time
+    assert model["B001"].raw == raw["add_update_list"]["meta_data"][0]
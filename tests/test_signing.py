@@ -0,0 +1,44 @@
+import base64
+
+import pytest
+import rsa
+
+from kindle.auth import (
+    SIGNING_BACKENDS, RSASigner, _cached_signer, cryptography_available,
+    sign_request
+)
+
+
+@pytest.fixture(scope="module")
+def keys():
+    public, private = rsa.newkeys(1024)
+    return public, private.save_pkcs1().decode("utf-8")
+
+
+def _verify(headers, public, body=b"{}"):
+    signature, date = headers["x-adp-signature"].split(":", 1)
+    data = f"GET\n/path\n{date}\n{body.decode()}\nTOKEN".encode()
+    assert rsa.verify(data, base64.b64decode(signature), public) == "SHA-256"
+
+
+@pytest.mark.parametrize("backend", SIGNING_BACKENDS)
+def test_signer_backends_produce_valid_signatures(keys, backend):
+    if backend == "cryptography" and not cryptography_available:
+        pytest.skip("cryptography is not installed")
+    public, pem = keys
+    signer = RSASigner(pem, backend=backend)
+    _verify(sign_request("GET", "/path", b"{}", "TOKEN", signer), public)
+
+
+def test_str_key_reuses_parsed_signer(keys):
+    public, pem = keys
+    _cached_signer.cache_clear()
+    for _ in range(3):
+        _verify(sign_request("GET", "/path", b"{}", "TOKEN", pem), public)
+    info = _cached_signer.cache_info()
+    assert (info.misses, info.hits) == (1, 2)
+
+
+def test_unknown_backend_raises(keys):
+    with pytest.raises(ValueError):
+        RSASigner(keys[1], backend="nope")
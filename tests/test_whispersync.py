@@ -0,0 +1,248 @@
+import asyncio
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from kindle import api, async_api, whispersync
+from kindle.client import AsyncKindleClient, KindleClient, NO_RETRY
+from kindle.exceptions import ServerError
+from kindle.whispersync import CursorStore, fetch_records, iter_new_records
+
+
+PAGE_SIZE = 2
+
+
+def page(items, after):
+    items = [i for i in items if after is None or i["syncNumber"] > after]
+    return json.dumps(items[:PAGE_SIZE])
+
+
+@pytest.fixture
+def whispersync_server(server, monkeypatch):
+    """Serves ``server.serve(datasets)``, a dict of identifier to record
+    sync numbers, two items per page.
+    """
+    server.datasets = {}
+    base = "/whispersync/v2/data/{user_id}/datasets"
+    monkeypatch.setattr(api, "WHISPERSYNC_URL", server.url + base)
+    base = base.format(user_id="USER")
+
+    def after(handler):
+        query = parse_qs(urlsplit(handler.path).query)
+        return int(query["after"][0]) if "after" in query else None
+
+    def datasets(handler):
+        items = [{"identifier": identifier, "syncNumber": max(numbers)}
+                 for identifier, numbers in server.datasets.items()]
+        items.sort(key=lambda i: i["syncNumber"])
+        body = '{"datasets": %s}' % page(items, after(handler))
+        handler.reply(200, body.encode())
+
+    def records(identifier):
+        def handle(handler):
+            items = [{"syncNumber": n, "value": f"{identifier}{n}"}
+                     for n in server.datasets[identifier]]
+            body = '{"records": %s}' % page(items, after(handler))
+            handler.reply(200, body.encode())
+        return handle
+
+    def serve(data):
+        server.datasets = data
+        for identifier in data:
+            server.routes[f"{base}/{identifier}/records"] = records(identifier)
+
+    server.routes[base] = datasets
+    server.serve = serve
+    return server
+
+
+def values(records):
+    return [r["value"] for r in records]
+
+
+def test_iter_records_walks_all_pages(whispersync_server, auth):
+    whispersync_server.serve({"a": [1, 2, 3, 4, 5]})
+    records = list(api.iter_whispersync_records(auth, "a", after=1))
+
+    assert values(records) == ["a2", "a3", "a4", "a5"]
+    assert [r.split("?")[-1] for r in whispersync_server.requests] == [
+        "after=1", "after=3", "after=5"]
+
+
+@pytest.mark.parametrize("with_client", [False, True])
+def test_async_iterators_accept_auth_and_client(whispersync_server, auth,
+                                                with_client):
+    whispersync_server.serve({"a": [1, 2, 3], "b": [7]})
+
+    async def main():
+        if with_client:
+            client = AsyncKindleClient(auth)
+            source = client
+        else:
+            client = None
+            source = auth
+        datasets = [d async for d in
+                    async_api.iter_whispersync_datasets(source)]
+        records = [r async for r in
+                   async_api.iter_whispersync_records(source, "a")]
+        if client is not None:
+            assert not client.is_closed
+            await client.aclose()
+        return datasets, records
+
+    datasets, records = asyncio.run(main())
+    assert [d["identifier"] for d in datasets] == ["a", "b"]
+    assert values(records) == ["a1", "a2", "a3"]
+
+
+@pytest.fixture
+def count_writes(monkeypatch):
+    writes = []
+    replace = whispersync.os.replace
+
+    def counting(src, dst):
+        writes.append(dst)
+        replace(src, dst)
+
+    monkeypatch.setattr(whispersync.os, "replace", counting)
+    return writes
+
+
+def test_cursor_store_batches_writes(tmp_path, count_writes):
+    path = tmp_path / "cursors.json"
+    store = CursorStore(path)
+    store.set("a", 1)
+    assert len(count_writes) == 1
+
+    with store:
+        with store:
+            store.set("b", 2)
+            store.datasets = 5
+        store.set("a", 3)
+        assert len(count_writes) == 1
+    assert len(count_writes) == 2
+
+    with store:
+        pass
+    store.flush()
+    assert len(count_writes) == 2
+
+    loaded = CursorStore(path)
+    assert loaded.datasets == 5
+    assert sorted(loaded.items()) == [("a", 3), ("b", 2)]
+
+
+def test_iter_new_records_saves_once_and_resumes(whispersync_server, auth,
+                                                 tmp_path, count_writes):
+    whispersync_server.serve({"a": [1, 2, 3], "b": [4, 5]})
+    path = tmp_path / "cursors.json"
+
+    with KindleClient(auth) as client:
+        records = list(iter_new_records(client, CursorStore(path)))
+        assert [(d, r["value"]) for d, r in records] == [
+            ("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b4"), ("b", "b5")]
+        assert len(count_writes) == 1
+
+        whispersync_server.datasets["b"].append(6)
+        store = CursorStore(path)
+        records = list(iter_new_records(client, store))
+        assert [(d, r["value"]) for d, r in records] == [("b", "b6")]
+        assert store.get("b") == 6 and store.datasets == 6
+
+        assert list(iter_new_records(client, CursorStore(path))) == []
+
+
+def test_iter_new_records_closed_early_keeps_finished(whispersync_server,
+                                                      auth, tmp_path):
+    whispersync_server.serve({"a": [1], "b": [2, 3]})
+    path = tmp_path / "cursors.json"
+
+    with KindleClient(auth) as client:
+        records = iter_new_records(client, CursorStore(path))
+        for _ in range(2):
+            next(records)
+        records.close()
+
+        store = CursorStore(path)
+        assert store.get("a") == 1 and "b" not in store
+        assert store.datasets is None
+
+        records = list(iter_new_records(client, store))
+    assert [(d, r["value"]) for d, r in records] == [("b", "b2"), ("b", "b3")]
+
+
+def test_fetch_records_runs_datasets_concurrently(whispersync_server, auth):
+    whispersync_server.serve({name: [1, 2, 3] for name in "abcdef"})
+    base = "/whispersync/v2/data/USER/datasets"
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def slow(handle):
+        def wrapped(handler):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+            handle(handler)
+        return wrapped
+
+    for name in "abcdef":
+        path = f"{base}/{name}/records"
+        whispersync_server.routes[path] = slow(whispersync_server.routes[path])
+
+    with KindleClient(auth) as client:
+        results = list(fetch_records(client, list("abcdefa"), concurrency=3))
+
+    assert sorted(r.dataset for r in results) == list("abcdef")
+    for result in results:
+        assert values(result.records) == [f"{result.dataset}{n}"
+                                          for n in (1, 2, 3)]
+        assert result.cursor == 3 and result.error is None
+    assert 1 < max(peak) <= 3
+
+    with pytest.raises(ValueError):
+        list(fetch_records(auth, ["a"], concurrency=0))
+
+
+def test_fetch_records_reports_failed_dataset(whispersync_server, auth,
+                                              tmp_path, count_writes):
+    whispersync_server.serve({"a": [1, 2, 3], "b": [4], "c": [5, 6]})
+    whispersync_server.routes[
+        "/whispersync/v2/data/USER/datasets/b/records"] = \
+        lambda handler: handler.reply(500)
+    store = CursorStore(tmp_path / "cursors.json")
+    store.set("c", 5)
+
+    with KindleClient(auth, retry=NO_RETRY) as client:
+        results = {r.dataset: r for r in fetch_records(
+            client, ["a", "b", "c"], concurrency=2, store=store)}
+
+    assert isinstance(results["b"].error, ServerError)
+    assert results["b"].records == [] and results["b"].cursor is None
+    assert values(results["a"].records) == ["a1", "a2", "a3"]
+    assert values(results["c"].records) == ["c6"]
+    assert sorted(CursorStore(tmp_path / "cursors.json").items()) == [
+        ("a", 3), ("c", 6)]
+    assert len(count_writes) == 2
+
+
+def test_fetch_records_closed_early_cancels_pending(whispersync_server, auth,
+                                                    tmp_path):
+    whispersync_server.serve({name: [1] for name in "abcdef"})
+    store = CursorStore(tmp_path / "cursors.json")
+
+    with KindleClient(auth) as client:
+        results = fetch_records(client, "abcdef", concurrency=1, store=store)
+        first = next(results)
+        results.close()
+
+    fetched = [r for r in whispersync_server.requests if "/records" in r]
+    assert len(fetched) < 6
+    assert CursorStore(tmp_path / "cursors.json").items() == [
+        (first.dataset, 1)]